@@ -3,6 +3,8 @@ from flask import Flask
 from routes.home import home_bp
 from routes.text_processing import text_processing_bp
 from routes.video_generation import video_generation_bp
+from routes.video_serving import video_serving_bp
+from routes.peaks import peaks_bp
 from utils.paths import PathManager
 from celery_app import start_rabbitmq_listener
 
@@ -27,6 +29,8 @@ path_manager.ensure_directories()
 app.register_blueprint(home_bp)
 app.register_blueprint(text_processing_bp)
 app.register_blueprint(video_generation_bp)
+app.register_blueprint(video_serving_bp)
+app.register_blueprint(peaks_bp)
 
 if __name__ == '__main__':
     start_rabbitmq_listener()
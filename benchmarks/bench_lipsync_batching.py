@@ -0,0 +1,133 @@
+# benchmarks/bench_lipsync_batching.py — Wav2Lip throughput vs. batch size (CPU)
+# -----------------------------------------------------------------------------
+#   python -m benchmarks.bench_lipsync_batching --backend torch --threads 8
+#   python -m benchmarks.bench_lipsync_batching --backend torch,onnx,onnx-int8
+#
+# 1) forward:   raw backend throughput (windows/s) for each batch size
+# 2) scheduler: K synthetic clips of M windows submitted at once through
+#               BatchScheduler with max_batch = each batch size, i.e. what
+#               generate_batch_lip_sync(backend=...) gets from dynamic batching
+#
+# Inputs are random tensors of the real shapes, so no templates/audio are
+# needed — only the checkpoint of the chosen backend. With several backends
+# a final table compares their best forward throughput (frames/s on CPU).
+
+from __future__ import annotations
+
+import os
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")      # CPU numbers unless overridden
+
+import time
+import argparse
+import concurrent.futures as futures
+from typing import Dict
+
+import numpy as np
+
+from utils.lipsync_engine import BACKENDS, BatchScheduler, IMG_SIZE, MEL_STEP
+
+
+class _SyntheticClip:
+    """Stands in for engine._Clip: fixed random inputs, predictions discarded."""
+
+    def __init__(self, n: int, rng: np.random.Generator):
+        self.n = n
+        self.spans = [(0, n)]
+        self.img = rng.random((n, IMG_SIZE, IMG_SIZE, 6), dtype=np.float32)
+        self.mel = rng.standard_normal((n, 80, MEL_STEP, 1), dtype=np.float32)
+        self.future: futures.Future = futures.Future()
+
+    def inputs(self, a: int, b: int):
+        return self.img[a:b], self.mel[a:b]
+
+    def deliver(self, a: int, preds) -> None:
+        if a + len(preds) >= self.n:
+            self.future.set_result(None)
+
+    def fail(self, exc: BaseException) -> None:
+        self.future.set_exception(exc)
+
+
+def _threads(n: int) -> None:
+    try:
+        import torch
+        torch.set_num_threads(n)
+    except ImportError:
+        pass
+
+
+def _make_backend(name: str, threads: int):
+    if name.startswith("onnx"):
+        return BACKENDS[name](intra_threads=threads)
+    return BACKENDS[name]()
+
+
+def bench_forward(backend, sizes, windows: int, rng) -> float:
+    """Print windows/s per batch size; returns the best one."""
+    best = 0.0
+    print(f"\n{'batch':>6} {'windows/s':>10} {'ms/batch':>9}")
+    for b in sizes:
+        img = rng.random((b, IMG_SIZE, IMG_SIZE, 6), dtype=np.float32)
+        mel = rng.standard_normal((b, 80, MEL_STEP, 1), dtype=np.float32)
+        backend(img, mel)                                  # warm-up
+        runs = max(1, windows // b)
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            backend(img, mel)
+        dt = time.perf_counter() - t0
+        best = max(best, runs * b / dt)
+        print(f"{b:>6} {runs * b / dt:>10.1f} {dt / runs * 1000:>9.1f}")
+    return best
+
+
+def bench_scheduler(backend, sizes, clips: int, clip_windows: int, wait_ms: float, rng) -> None:
+    print(f"\n{'max_batch':>9} {'windows/s':>10} {'batches':>8} {'avg_fill':>8}")
+    for b in sizes:
+        sched = BatchScheduler(backend, max_batch=b, max_wait_ms=wait_ms)
+        sched.start()
+        items = [_SyntheticClip(clip_windows, rng) for _ in range(clips)]
+        t0 = time.perf_counter()
+        for c in items:
+            sched.enqueue(c)
+        futures.wait([c.future for c in items])
+        dt = time.perf_counter() - t0
+        st = sched.stats()
+        print(f"{b:>9} {clips * clip_windows / dt:>10.1f} {st['batches']:>8} {st['avg_fill']:>8}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Wav2Lip throughput vs. batch size")
+    ap.add_argument("--backend", default="torch",
+                    help=f"comma-separated, any of {', '.join(sorted(BACKENDS))}")
+    ap.add_argument("--batch-sizes", default="1,2,4,8,16,32,64,128")
+    ap.add_argument("--windows", type=int, default=512, help="windows per forward measurement")
+    ap.add_argument("--clips", type=int, default=12, help="synthetic clips for the scheduler run")
+    ap.add_argument("--clip-windows", type=int, default=60, help="frames per synthetic clip (~2.4 s)")
+    ap.add_argument("--max-wait-ms", type=float, default=20)
+    ap.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+
+    _threads(args.threads)
+    sizes = [int(x) for x in args.batch_sizes.split(",")]
+    rng = np.random.default_rng(0)
+    names = [n.strip() for n in args.backend.split(",") if n.strip()]
+    unknown = set(names) - set(BACKENDS)
+    if unknown:
+        ap.error(f"unknown backend(s): {', '.join(sorted(unknown))}")
+
+    best: Dict[str, float] = {}
+    for name in names:
+        backend = _make_backend(name, args.threads)
+        print(f"\nbackend={name} threads={args.threads}")
+        best[name] = bench_forward(backend, sizes, args.windows, rng)
+        bench_scheduler(backend, sizes, args.clips, args.clip_windows, args.max_wait_ms, rng)
+
+    if len(best) > 1:
+        base = best[names[0]]
+        print(f"\n{'backend':<10} {'frames/s':>9} {'vs ' + names[0]:>10}")
+        for name, fps in best.items():
+            print(f"{name:<10} {fps:>9.1f} {fps / base:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# benchmarks/loadtest_worker.py — soak / load test of the AMQP worker without RabbitMQ
+# ------------------------------------------------------------------------------------
+#   python -m benchmarks.loadtest_worker --jobs 2000 --rate 2 --pattern burst --workers 4
+#   python -m benchmarks.loadtest_worker --jobs 5000 --pattern ramp --prefetch 16 --json soak.json
+#
+# celery_app.on_message / worker_job run unchanged on utils/memory_broker.py
+# (consume_memory); only the expensive leaves are replaced by stand-ins:
+#
+#   TTS       TTS_BACKEND=fake (utils/tts_router.StandInBackend): latency +
+#             jitter per segment, tone of 0.06 s per character
+#   lip-sync  sleeps base + rtf × audio seconds under --lipsync-slots
+#             concurrent renders (the GPU), clip by clip, as generate_batch_lip_sync
+#   upload    sleeps up to --upload-latency
+#   NLP       _smart_split only (--real-nlp keeps stanza)
+#
+# Arrivals: poisson (constant rate), burst (--burst-size jobs at once, same
+# average rate) or ramp (rate grows from 0.2× to 1.8× --rate over the run).
+# Text lengths are a short / medium / long mix (--mix).
+#
+# Report: throughput, queue wait (publish → pipeline start, broker + pool),
+# job latency p50/p95/p99 (with --partial also time to the first segment), broker depth / unacked / prefetch, RSS at start,
+# peak and end, and RSS growth per 1000 jobs over the second half of the run
+# (a steady slope on a soak run is a leak), per-job peak RSS (result["memory"])
+# and the worker's per-stage memory history / budget pauses (MEM_BUDGET_MB).
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+WORDS = ("сәлем әлем бүгін ертең біз сіз олар мектеп кітап жақсы үлкен кіші қала ауыл "
+         "жұмыс оқушы мұғалім сабақ тарих ғылым тіл өнер дала тау өзен күн ай жыл").split()
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _text(rng: random.Random, mix: List[float]) -> str:
+    kind = rng.choices(("short", "medium", "long"), weights=mix)[0]
+    lo, hi = {"short": (3, 15), "medium": (20, 60), "long": (100, 250)}[kind]
+    words = [rng.choice(WORDS) for _ in range(rng.randint(lo, hi))]
+    for i in range(5, len(words), rng.randint(5, 9)):
+        words[i] += rng.choice(".,")
+    return " ".join(words).capitalize() + "."
+
+
+def arrivals(pattern: str, n: int, rate: float, burst_size: int, rng: random.Random) -> List[float]:
+    """Send times (seconds from start) of n jobs with the given average rate."""
+    t, out = 0.0, []
+    if pattern == "burst":
+        gap = burst_size / rate
+        for i in range(n):
+            out.append((i // burst_size) * gap + rng.uniform(0, 0.05 * gap))
+        return sorted(out)
+    span = n / rate
+    for _ in range(n):
+        r = rate if pattern == "poisson" else rate * (0.2 + 1.6 * min(1.0, t / span))
+        t += rng.expovariate(r)
+        out.append(t)
+    return out
+
+
+def _pct(xs: List[float], q: float) -> float | None:
+    return round(float(np.percentile(xs, q)), 3) if xs else None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Load / soak test of celery_app without RabbitMQ")
+    ap.add_argument("--jobs", type=int, default=1000)
+    ap.add_argument("--rate", type=float, default=1.0, help="average arrivals per second")
+    ap.add_argument("--pattern", choices=("poisson", "burst", "ramp"), default="poisson")
+    ap.add_argument("--burst-size", type=int, default=20)
+    ap.add_argument("--mix", default="0.7,0.25,0.05", help="short,medium,long text shares")
+    ap.add_argument("--avatar-share", type=float, default=0.9, help="share of jobs with useAvatar")
+    ap.add_argument("--merge-share", type=float, default=0.5)
+    ap.add_argument("--workers", type=int, default=int(os.getenv("MAX_WORKERS", 1)), help="MAX_WORKERS")
+    ap.add_argument("--prefetch", type=int, default=None, help="RMQ_PREFETCH (default as celery_app)")
+    ap.add_argument("--priority", action="store_true", help="RMQ_PRIORITY=1 (cost-aware scheduling)")
+    ap.add_argument("--tts-latency", type=float, default=0.3, help="stand-in TTS seconds per segment")
+    ap.add_argument("--tts-fail-rate", type=float, default=0.0)
+    ap.add_argument("--lipsync-base", type=float, default=0.5, help="stand-in render seconds per call")
+    ap.add_argument("--lipsync-rtf", type=float, default=0.4, help="render seconds per audio second")
+    ap.add_argument("--lipsync-slots", type=int, default=1, help="concurrent stand-in renders")
+    ap.add_argument("--upload-latency", type=float, default=0.1)
+    ap.add_argument("--real-nlp", action="store_true", help="run stanza on every segment")
+    ap.add_argument("--partial", action="store_true", help="request per-segment partial results")
+    ap.add_argument("--timeout", type=float, default=None, help="give up after this many seconds")
+    ap.add_argument("--report-every", type=float, default=10.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="write the report to this file")
+    ap.add_argument("--verbose", action="store_true", help="keep the worker's INFO log on the console")
+    args = ap.parse_args()
+
+    # celery_app reads its config at import time
+    os.environ["MAX_WORKERS"] = str(args.workers)
+    if args.prefetch is not None:
+        os.environ["RMQ_PREFETCH"] = str(args.prefetch)
+    os.environ["RMQ_PRIORITY"] = "1" if args.priority else "0"
+    os.environ["TTS_BACKEND"] = "fake"
+    os.environ["TTS_FAKE_LATENCY_S"] = str(args.tts_latency)
+    os.environ["TTS_FAKE_JITTER_S"] = str(args.tts_latency / 3)
+    os.environ["TTS_FAKE_FAIL_RATE"] = str(args.tts_fail_rate)
+    os.environ["FILE_SERVER_UPLOAD_URL"] = ""
+
+    import celery_app as worker
+    from utils.nlp import _smart_split
+    from utils.cost import wav_seconds
+    from utils.memory_broker import MemoryBroker
+    from utils.concurrency import concurrency_stats
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    media = Path(tempfile.mkdtemp(prefix="loadtest_"))
+    worker.MEDIA_ROOT = media
+    gpu = threading.Semaphore(max(1, args.lipsync_slots))
+    rng = random.Random(args.seed)
+
+    def lipsync(tasks, max_workers=1, video_dir=None, tracer=None, tier=None, on_clip=None, **_kw):
+        out = []
+        for i, (w, _g, _a) in enumerate(tasks, 1):
+            with gpu:
+                time.sleep((args.lipsync_base if i == 1 else 0) + args.lipsync_rtf * wav_seconds(w))
+            out.append(str(Path(video_dir) / f"{i:03d}.mp4"))
+            if on_clip:
+                on_clip(i, out[-1])
+        return out
+
+    def green(wav_path, out_path):
+        time.sleep(0.05 + 0.05 * wav_seconds(wav_path))
+
+    def upload(fp):
+        time.sleep(random.uniform(0, args.upload_latency))
+        return f"http://loadtest/{Path(fp).parent.parent.name}/{Path(fp).name}"
+
+    started: Dict[Any, float] = {}
+    pipeline = worker.lipsync_pipeline
+
+    def timed_pipeline(*a, **kw):
+        started[kw.get("page_id")] = time.monotonic()
+        return pipeline(*a, **kw)
+
+    worker.generate_batch_lip_sync = lipsync
+    worker.make_video_with_green_background = green
+    worker.concat_videos = lambda clips, out: time.sleep(0.01 * len(clips))
+    worker.upload_file = upload
+    worker.lipsync_pipeline = timed_pipeline
+    if not args.real_nlp:
+        worker.parse_text = lambda text: (_smart_split(text), [])
+
+    broker = MemoryBroker(max_priority=worker.MAX_PRIORITY if worker.PRIORITY_MODE else 0)
+    submitted: Dict[int, float] = {}
+    waits: List[float] = []
+    latencies: List[float] = []
+    job_peaks: List[float] = []
+    first_segment: List[float] = []
+    partial_seen: set = set()
+    done = threading.Event()
+    lock = threading.Lock()
+    counts = {"done": 0, "retries": 0}
+
+    def on_done(body: Dict[str, Any], _props) -> None:
+        now = time.monotonic()
+        pid = body.get("page_id")
+        if body.get("status") == "partial":
+            with lock:
+                if pid in submitted and pid not in partial_seen:
+                    partial_seen.add(pid)
+                    first_segment.append(now - submitted[pid])
+            return
+        with lock:
+            t_sub = submitted.get(pid)
+            if t_sub is not None:
+                latencies.append(now - t_sub)
+                if pid in started:
+                    waits.append(started.pop(pid) - t_sub)
+            counts["done"] += 1
+            if (body.get("memory") or {}).get("peak_rss_mb") is not None:
+                job_peaks.append(body["memory"]["peak_rss_mb"])
+            if counts["done"] >= args.jobs:
+                done.set()
+        shutil.rmtree(media / str(body.get("job_id")), ignore_errors=True)
+
+    broker.subscribe(worker.QUEUE_DONE_DEF, on_done)
+    worker.consume_memory(broker)
+
+    mix = [float(x) for x in args.mix.split(",")]
+    times = arrivals(args.pattern, args.jobs, args.rate, args.burst_size, rng)
+    rss: List[tuple] = [(0, _rss_mb())]                 # (jobs done, RSS MB)
+    t0 = time.monotonic()
+
+    def produce() -> None:
+        for i, at in enumerate(times):
+            delay = t0 + at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            payload = {"text": _text(rng, mix), "page_id": i, "content_id": i,
+                       "gender": rng.choice("mf"), "useAvatar": rng.random() < args.avatar_share,
+                       "merge": rng.random() < args.merge_share, "noCache": True, "partial": args.partial}
+            if args.priority:
+                payload["priority"] = rng.choice((0, 0, 0, 5, 9))
+            with lock:
+                submitted[i] = time.monotonic()
+            broker.publish(worker.QUEUE_IN, payload, priority=payload.get("priority"))
+
+    threading.Thread(target=produce, name="loadgen", daemon=True).start()
+
+    last = t0
+    while not done.wait(1.0):
+        now = time.monotonic()
+        rss.append((counts["done"], _rss_mb()))
+        if args.timeout and now - t0 > args.timeout:
+            print("timeout", file=sys.stderr)
+            break
+        if now - last >= args.report_every:
+            last = now
+            st = broker.stats()
+            q = st["queues"].get(worker.QUEUE_IN, {})
+            print(f"[{now - t0:7.1f}s] done {counts['done']}/{len(submitted)}  queue {q.get('depth', 0)}"
+                  f"  unacked {st['unacked']}  prefetch {st['prefetch']}  rss {rss[-1][1]:.0f} MB"
+                  f"{'  (intake paused)' if st['paused'] else ''}",
+                  flush=True)
+    elapsed = time.monotonic() - t0
+    rss.append((counts["done"], _rss_mb()))
+    broker.stop()
+
+    half = [(n, m) for n, m in rss if n >= counts["done"] / 2]
+    growth = None
+    if len(half) >= 3 and half[-1][0] > half[0][0]:
+        growth = round(float(np.polyfit([n for n, _ in half], [m for _, m in half], 1)[0]) * 1000, 2)
+    st = broker.stats()
+    q = st["queues"].get(worker.QUEUE_IN, {})
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose")},
+        "jobs_done": counts["done"], "elapsed_s": round(elapsed, 1),
+        "throughput_per_min": round(60 * counts["done"] / elapsed, 2),
+        "retries": max(0, q.get("published", 0) - len(submitted)),
+        "queue_wait_s": {"p50": _pct(waits, 50), "p95": _pct(waits, 95), "max": _pct(waits, 100)},
+        "latency_s": {"p50": _pct(latencies, 50), "p95": _pct(latencies, 95),
+                      "p99": _pct(latencies, 99), "max": _pct(latencies, 100)},
+        "first_segment_s": {"p50": _pct(first_segment, 50), "p95": _pct(first_segment, 95)}
+                           if args.partial else None,
+        "broker": {"max_depth": q.get("max_depth"), "wait_p95_s": _pct(broker.waits, 95),
+                   "final_prefetch": st["prefetch"]},
+        "rss_mb": {"start": round(rss[0][1], 1), "peak": round(max(m for _, m in rss), 1),
+                   "end": round(rss[-1][1], 1), "growth_per_1000_jobs": growth,
+                   "job_peak_p50": _pct(job_peaks, 50), "job_peak_max": _pct(job_peaks, 100)},
+        "capacity": worker.CAPACITY.snapshot(),
+        "concurrency": concurrency_stats(),
+        "memory": worker.MEMORY.stats(),
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    shutil.rmtree(media, ignore_errors=True)
+    os._exit(0 if counts["done"] >= args.jobs else 1)     # pool threads may still sleep in stand-ins
+
+
+if __name__ == "__main__":
+    main()
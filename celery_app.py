@@ -3,7 +3,7 @@
 
 from __future__ import annotations
 
-import os, json, uuid, pathlib, logging, time, functools, threading
+import os, sys, json, uuid, pathlib, logging, time, functools, threading
 import concurrent.futures as futures
 import datetime
 from typing import Any
@@ -12,12 +12,25 @@ import pika, requests
 
 # ──────────────────── внешние утилиты ────────────────────
 from utils.nlp import parse_text
-from utils.tts import synthesize_speech
-from utils.video_utils import generate_batch_lip_sync, make_video_with_green_background
+from utils.tts import synthesize_speech, synthesize_many, get_backend, backend_stats
+from utils.video_utils import (generate_batch_lip_sync, make_video_with_green_background, LIPSYNC_BACKEND,
+                               log_backend_notes)
 from utils.merge import concat_videos
+from utils.peaks import write_merged_peaks
 from utils.classify import classify_sentence_structure
 from utils.api_id import IDLogger
 from utils.output_id import OutputLogger
+from utils.trace import start_trace
+from utils.job_store import get_store
+from utils.result_cache import RESULT_CACHE, job_key
+from utils.quality import get_tier
+from utils.cost import COST_MODEL, PriorityJobQueue, parse_deadline, wav_seconds
+from utils.admission import Capacity, PREFETCH_MAX
+from utils.bulk import run_bulk, item_args
+from utils.concurrency import limiter, concurrency_stats
+from utils.memory_budget import MEMORY, JobMemory, RECYCLE_EXIT, supervise
+from utils.affinity import AFFINITY
+from utils.partials import PartialBatcher, wants_partials
 
 # ──────────────────── конфиг ────────────────────
 RABBIT_HOST = os.getenv("RABBIT_HOST")
@@ -32,6 +45,13 @@ QUEUE_IN        = os.getenv("RMQ_QUEUE_IN", "avatar_generated_tasks")
 QUEUE_DONE_DEF  = os.getenv("RMQ_QUEUE_DONE", "avatar_generated_done")
 QUEUE_ERROR     = os.getenv("RMQ_ERROR_QUEUE", "avatar_generated_errors")
 MAX_RETRIES     = int(os.getenv("RMQ_MAX_RETRIES", 3))
+UPGRADE_PRIORITY = int(os.getenv("RMQ_UPGRADE_PRIORITY", 0))   # приоритет финального рендера после черновика
+
+# Приоритетный режим: x-max-priority на входной очереди + локальная очередь по прогнозу стоимости
+# (utils/cost.py). Выключен по умолчанию: x-max-priority нельзя добавить к уже существующей
+# очереди без него (406) — очередь нужно пересоздать.
+PRIORITY_MODE = os.getenv("RMQ_PRIORITY", "0").strip().lower() in {"1", "true", "yes"}
+MAX_PRIORITY  = int(os.getenv("RMQ_MAX_PRIORITY", 10))
 
 # Если во входной очереди в брокере уже настроен DLX — укажи то же имя, чтобы избежать 406
 DLX_NAME = os.getenv("RMQ_EXISTING_DLX", "retry_exchange").strip()  # оставь пустым, если у брокера DLX не стоит
@@ -41,10 +61,14 @@ MEDIA_ROOT  = pathlib.Path("static/video_output").resolve()
 MEDIA_ROOT.mkdir(exist_ok=True)
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", 1))
 HEARTBEAT   = int(os.getenv("RMQ_HEARTBEAT", 60))
+# стартовый prefetch; дальше его подстраивает CAPACITY.prefetch() (utils/admission.py) по SLA и нагрузке
+PREFETCH    = int(os.getenv("RMQ_PREFETCH", MAX_WORKERS * 4 if PRIORITY_MODE else MAX_WORKERS))
 BLOCK_TOUT  = int(os.getenv("RMQ_BLOCK_TIMEOUT", 120))
 
-# Опционально ограничим GPU-конкурентность (если используешь Wav2Lip на CUDA)
-GPU_SEMAPHORE = threading.Semaphore(1)
+# Опционально ограничим GPU-конкурентность (если используешь Wav2Lip на CUDA).
+# Лимиты стадий адаптивные (utils/concurrency.py, AIMD): старт 1 рендер на GPU, 4 загрузки.
+GPU_SEMAPHORE = limiter("gpu", 1, 1, 2, resource="gpu")
+UPLOAD_LIMIT  = limiter("upload", 4, 1, 16)
 
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -60,6 +84,7 @@ logging.basicConfig(
         logging.FileHandler(log_file, mode="w", encoding="utf-8")  # отдельный файл для этого запуска
     ]
 )
+log_backend_notes()     # какие опции движка не действуют на бэкенде subprocess (service/app импортируют этот модуль)
 
 # ──────────────────── helpers ────────────────────
 def upload_file(fp: str) -> str | None:
@@ -69,7 +94,7 @@ def upload_file(fp: str) -> str | None:
         headers = {}
         if AUTH_TOKEN:
             headers["Authorization"] = f"Bearer {AUTH_TOKEN}"
-        with open(fp, "rb") as f:
+        with open(fp, "rb") as f, UPLOAD_LIMIT.slot(size=os.path.getsize(fp) / 2**20):
             r = requests.post(
                 FILE_UPLOAD,
                 files={"file": (os.path.basename(fp), f, "video/mp4")},
@@ -92,63 +117,147 @@ def upload_file(fp: str) -> str | None:
 
 
 def lipsync_pipeline(text: str, gender: str, lang: str, use_avatar: bool, merge: bool,
-                     page_id: int, content_id: int, text_id: int | None) -> dict[str, Any]:
+                     page_id: int, content_id: int, text_id: int | None,
+                     quality: str | None = None, tts: str | None = None,
+                     partials: PartialBatcher | None = None) -> dict[str, Any]:
+    tier = get_tier(quality)
+    tts_backend = get_backend(tts)
     job_id = uuid.uuid4().hex
     job_dir = MEDIA_ROOT / job_id
     audio_d = job_dir / "audio"; audio_d.mkdir(parents=True, exist_ok=True)
     video_d = job_dir / "video"; video_d.mkdir()
     log_d   = job_dir / "logs";  log_d.mkdir()
 
-    api_log  = IDLogger(log_d)
-    clip_log = OutputLogger(log_d)
-
-    sentences, _ = parse_text(text)
-
-    # 2) TTS
-    tasks = []
-    for idx, sent in enumerate(sentences, 1):
-        aid, _ = classify_sentence_structure(None)
-        wav = audio_d / f"{idx:03d}.wav"
-        synthesize_speech(sent, str(wav), voice_gender=gender, lang=lang)
-        tasks.append((str(wav), gender, aid))
-        api_log.add_entry(
-            text_clip_id=idx, orig_voice_id=1000 + idx,
-            avatar_action_id=aid, avatar_gender_id=1 if gender == "m" else 2,
-            voice_gender_id=1 if gender == "m" else 2,
-        )
-
-    # 3) Видео
-    clips_local: list[str] = []
-    if use_avatar:
-        for idx, (sentence, (wav_path, gender, aid)) in enumerate(zip(sentences, tasks), 1):
-            logging.info("🔊 Wav2Lip task %d: text='%s', wav='%s', gender='%s', action_id=%s",
-                         idx, sentence.strip(), wav_path, gender, aid)
-            # если есть риск OOM — снимаем семафор
-            with GPU_SEMAPHORE:
-                clip_path = generate_batch_lip_sync([(str(wav_path), gender, aid)], 1, video_dir=video_d)[0]
-                clips_local.append(clip_path)
-                try:
-                    import torch, gc
-                    gc.collect(); torch.cuda.empty_cache()
-                except Exception:
-                    pass
-    else:
-        for idx, (wav_path, _, _) in enumerate(tasks, 1):
-            out_path = video_d / f"{idx:03d}.mp4"
-            make_video_with_green_background(str(wav_path), str(out_path))
-            clips_local.append(str(out_path))
-
-    # 4) Загрузка
-    clips_remote = [upload_file(mp4) or mp4 for mp4 in clips_local]
-    for (idx, _wav, aid), url in zip(tasks, clips_remote):
-        clip_log.add_entry(text_clip_id=idx, video_path=url, avatar_action_id=aid)
-
-    # 5) Сшивка
-    merged_url = None
-    if merge and clips_local:
-        merged_local = video_d / f"{job_id}.mp4"
-        concat_videos(clips_local, str(merged_local))
-        merged_url = upload_file(str(merged_local)) or str(merged_local)
+    store    = get_store()
+    api_log  = IDLogger(log_d, job_id, store)
+    clip_log = OutputLogger(log_d, job_id, store)
+    tracer   = start_trace(job_id, log_d)
+    if store:
+        store.start_job(job_id, page_id=page_id, content_id=content_id, text_id=text_id,
+                        gender=gender, lang=lang, use_avatar=use_avatar, merge=merge, quality=tier.name,
+                        tts=tts_backend.name)
+
+    tasks: list[tuple[str, str, int]] = []
+    stages: dict[str, float] = {}
+    audio_s = 0.0
+    status = "error"
+    mem: JobMemory | None = None
+    try:
+        # память по этапам (mem.mark) и пик за задачу → result["memory"]; utils/memory_budget.py
+        with MEMORY.job(job_id) as mem, tracer.span("job", page_id=page_id, content_id=content_id,
+                                                    use_avatar=use_avatar, quality=tier.name):
+            with tracer.span("nlp.parse_text"):
+                sentences, _ = parse_text(text)
+            mem.mark("nlp")
+
+            # 2) TTS   (времена этапов → stages: история для модели стоимости utils/cost.py)
+            t0 = time.perf_counter()
+            if tts_backend.batched:       # VITS / edge-stream: все сегменты одним вызовом
+                with tracer.span("tts.batch", backend=tts_backend.name, segments=len(sentences)):
+                    for res in synthesize_many(
+                            [(s, audio_d / f"{i:03d}.wav", gender, lang) for i, s in enumerate(sentences, 1)],
+                            backend=tts_backend.name):
+                        if isinstance(res, BaseException):
+                            raise res
+            for idx, sent in enumerate(sentences, 1):
+                aid, _ = classify_sentence_structure(None, text=sent, allowed=AFFINITY.local_actions(gender))
+                wav = audio_d / f"{idx:03d}.wav"
+                if not tts_backend.batched:
+                    with tracer.span("tts", index=idx, chars=len(sent)):
+                        synthesize_speech(sent, str(wav), voice_gender=gender, lang=lang,
+                                          backend=tts_backend.name)
+                tasks.append((str(wav), gender, aid))
+                api_log.add_entry(
+                    text_clip_id=idx, orig_voice_id=1000 + idx,
+                    avatar_action_id=aid, avatar_gender_id=1 if gender == "m" else 2,
+                    voice_gender_id=1 if gender == "m" else 2,
+                )
+            api_log.flush()                  # граница этапа: лог ID виден сразу
+            audio_s = sum(wav_seconds(w) for w, _, _ in tasks)
+            stages["tts"] = time.perf_counter() - t0
+            mem.mark("tts")
+
+            # 3) Видео
+            t0 = time.perf_counter()
+            clips_local: list[str] = []
+            uploaded: dict[int, str] = {}
+
+            def _clip_ready(idx: int, mp4: str):
+                """Частичные результаты: клип грузим сразу и отдаём сегмент, не дожидаясь остальных."""
+                if partials is None:
+                    return
+                with tracer.span("upload", index=idx):
+                    uploaded[idx] = upload_file(mp4) or mp4
+                wav, _g, aid = tasks[idx - 1]
+                partials.add({"index": idx, "clip": uploaded[idx], "duration": round(wav_seconds(wav), 3),
+                              "action_id": aid}, total=len(tasks))
+
+            if use_avatar and LIPSYNC_BACKEND != "subprocess" and not tier.enhance_face:
+                # движок в процессе сам сериализует доступ к модели и батчит кадры всех сегментов
+                clips_local = generate_batch_lip_sync(tasks, MAX_WORKERS, video_dir=video_d,
+                                                      tracer=tracer, tier=tier, on_clip=_clip_ready)
+            elif use_avatar:
+                for idx, (sentence, (wav_path, gender, aid)) in enumerate(zip(sentences, tasks), 1):
+                    logging.info("🔊 Wav2Lip task %d: text='%s', wav='%s', gender='%s', action_id=%s",
+                                 idx, sentence.strip(), wav_path, gender, aid)
+                    # если есть риск OOM — снимаем семафор
+                    with tracer.span("gpu_semaphore.wait", cat="wait", index=idx):
+                        GPU_SEMAPHORE.acquire()
+                    t_gpu = time.monotonic()
+                    try:
+                        clip_path = generate_batch_lip_sync([(str(wav_path), gender, aid)], 1,
+                                                            video_dir=video_d, tracer=tracer,
+                                                            tier=tier)[0]
+                        clips_local.append(clip_path)
+                    finally:
+                        GPU_SEMAPHORE.release(time.monotonic() - t_gpu, wav_seconds(str(wav_path)))
+                    _clip_ready(idx, clip_path)
+            else:
+                for idx, (wav_path, _, _) in enumerate(tasks, 1):
+                    out_path = video_d / f"{idx:03d}.mp4"
+                    with tracer.span("green_bg.subprocess", cat="subprocess", index=idx):
+                        make_video_with_green_background(str(wav_path), str(out_path))
+                    clips_local.append(str(out_path))
+                    _clip_ready(idx, str(out_path))
+            stages["lipsync"] = time.perf_counter() - t0
+            mem.mark("lipsync")
+
+            # 4) Загрузка
+            t0 = time.perf_counter()
+            clips_remote = []
+            for idx, mp4 in enumerate(clips_local, 1):
+                if idx in uploaded:                 # уже загружен ради частичного результата
+                    clips_remote.append(uploaded[idx])
+                    continue
+                with tracer.span("upload", index=idx):
+                    clips_remote.append(upload_file(mp4) or mp4)
+            for (idx, _wav, aid), url in zip(tasks, clips_remote):
+                clip_log.add_entry(text_clip_id=idx, video_path=url, avatar_action_id=aid)
+            clip_log.flush()
+            stages["upload"] = time.perf_counter() - t0
+            mem.mark("upload")
+
+            # 5) Сшивка
+            t0 = time.perf_counter()
+            merged_url = None
+            if merge and clips_local:
+                merged_local = video_d / f"{job_id}.mp4"
+                with tracer.span("merge", clips=len(clips_local)):
+                    concat_videos(clips_local, str(merged_local))
+                write_merged_peaks([w for w, _, _ in tasks], merged_local)
+                with tracer.span("upload", merged=True):
+                    merged_url = upload_file(str(merged_local)) or str(merged_local)
+            stages["merge"] = time.perf_counter() - t0
+            mem.mark("merge")
+        status = "done"
+    finally:
+        api_log.flush(); clip_log.flush()   # и при ошибке: записи уже начатых этапов не теряются
+        tracer.export()
+        if store:
+            store.finish_job(job_id, status, segments=len(tasks), chars=len(text),
+                             audio_s=round(audio_s, 3),
+                             stages={k: round(v, 3) for k, v in stages.items()},
+                             memory=mem.report() if mem else None)
 
     return {
         "job_id": job_id,
@@ -156,13 +265,34 @@ def lipsync_pipeline(text: str, gender: str, lang: str, use_avatar: bool, merge:
         "merged": merged_url,
         "api_log": api_log.file_path(),
         "clip_log": clip_log.file_path(),
+        "trace": tracer.file_path(),
         "page_id": page_id,
         "content_id": content_id,
         "text_id": text_id,
         "use_avatar": use_avatar,
         "lang": lang,
+        "quality": tier.name,
+        "tts": tts_backend.name,
+        "memory": mem.report(),
     }
 
+_fifo_warned = False
+
+def _warn_fifo_upgrade():
+    """Приоритет апгрейда работает только в режиме RMQ_PRIORITY=1; в FIFO-очереди финальный
+    рендер конкурирует с черновиками на равных — предупреждаем один раз."""
+    global _fifo_warned
+    if PRIORITY_MODE or _fifo_warned:
+        return
+    _fifo_warned = True
+    logging.warning("⚠️ upgrade → %s без RMQ_PRIORITY=1: RMQ_UPGRADE_PRIORITY не действует, "
+                    "финальный рендер идёт в общей FIFO-очереди наравне с черновиками", QUEUE_IN)
+
+def _all_uploaded(result: dict[str, Any]) -> bool:
+    """Кэшируем только результаты, где все файлы уже на файловом сервере."""
+    urls = [*result.get("clips", []), result.get("merged")]
+    return not any(isinstance(u, str) and u.startswith(str(MEDIA_ROOT)) for u in urls)
+
 # ──────────────────── AMQP glue ────────────────────
 POOL = futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
@@ -176,14 +306,28 @@ def conn_params() -> pika.ConnectionParameters:
         retry_delay=5,
     )
 
-def _declare_incoming(ch: pika.BlockingChannel):
-    """Декларируем входную очередь, повторяя DLX-аргументы, если заданы через env."""
+def _incoming_args() -> dict[str, Any]:
     args = {}
     if DLX_NAME:
         args["x-dead-letter-exchange"] = DLX_NAME
     if DLK_NAME:
         args["x-dead-letter-routing-key"] = DLK_NAME
-    ch.queue_declare(queue=QUEUE_IN, durable=True, arguments=args or None)
+    if PRIORITY_MODE:
+        args["x-max-priority"] = MAX_PRIORITY
+    return args
+
+def _declare_incoming(ch: pika.BlockingChannel):
+    """Декларируем входную очередь, повторяя DLX-аргументы, если заданы через env."""
+    ch.queue_declare(queue=QUEUE_IN, durable=True, arguments=_incoming_args() or None)
+    if AFFINITY.enabled:
+        ch.queue_declare(queue=AFFINITY.queue(), durable=True, arguments=_node_queue_args())
+
+def _node_queue_args() -> dict[str, Any]:
+    """Своя очередь узла (utils/affinity.py): протухшие сообщения уходят обратно в общую очередь."""
+    args = AFFINITY.queue_args()
+    if PRIORITY_MODE:
+        args["x-max-priority"] = MAX_PRIORITY
+    return args
 
 def _declare_passive_or_create(ch: pika.BlockingChannel, qname: str):
     """Стараемся не портить чужие аргументы: сначала passive, иначе создаём простую durable."""
@@ -192,49 +336,173 @@ def _declare_passive_or_create(ch: pika.BlockingChannel, qname: str):
     except Exception:
         ch.queue_declare(queue=qname, durable=True)
 
-def _publish(ch: pika.BlockingChannel, routing_key: str, body: dict[str, Any]):
-    """Безопасная публикация: для входной очереди — совместимая декларация, для остальных — passive."""
-    if routing_key == QUEUE_IN:
-        _declare_incoming(ch)
-    else:
-        _declare_passive_or_create(ch, routing_key)
+def _publish(ch: pika.BlockingChannel, routing_key: str, body: dict[str, Any], priority: int | None = None,
+             declared: set[str] | None = None):
+    """Безопасная публикация: для входной очереди — совместимая декларация, для остальных — passive.
+    declared — кэш уже объявленных на этом канале очередей (без лишнего round-trip на каждую публикацию)."""
+    if declared is None or routing_key not in declared:
+        if routing_key == QUEUE_IN:
+            _declare_incoming(ch)
+        else:
+            _declare_passive_or_create(ch, routing_key)
+        if declared is not None:
+            declared.add(routing_key)
 
     ch.basic_publish(
         exchange="",
         routing_key=routing_key,
         body=json.dumps(body).encode(),
-        properties=pika.BasicProperties(content_type="application/json", delivery_mode=2),
+        properties=pika.BasicProperties(content_type="application/json", delivery_mode=2,
+                                        priority=priority),
     )
 
-def worker_job(ch: pika.BlockingChannel, tag: int, payload: dict[str, Any]):
+# ──────────────────── транспорт ────────────────────
+# worker_job не трогает pika напрямую: публикация / ack / prefetch идут через транспорт.
+#   _BlockingTransport — BlockingConnection, замыкания через add_callback_threadsafe
+#                        (I/O и heartbeat только внутри start_consuming);
+#   AsyncAmqp          — RMQ_ASYNC=1, utils/amqp_async.py: отдельный поток с asyncio-циклом,
+#                        publisher confirms, heartbeat не зависит от длинных рендеров.
+#   MemoryBroker       — utils/memory_broker.py: брокер в памяти процесса для нагрузочных
+#                        прогонов без RabbitMQ (benchmarks/loadtest_worker.py, consume_memory).
+# publish() возвращает Future; входное сообщение подтверждаем только после того,
+# как результат (или повтор) принят брокером.
+ASYNC_MODE      = os.getenv("RMQ_ASYNC", "0").strip().lower() in {"1", "true", "yes"}
+CONFIRM_TIMEOUT = float(os.getenv("RMQ_CONFIRM_TIMEOUT", 30))
+
+class _BlockingTransport:
+    def __init__(self, ch: pika.BlockingChannel):
+        self.ch = ch
+        self.declared: set[str] = {QUEUE_IN}        # входную очередь объявляет consume_forever
+        if AFFINITY.enabled:
+            self.declared.add(AFFINITY.queue())
+        self.consumer_tags: list[str] = []
+        self.paused = False
+
+    def publish(self, routing_key: str, body: dict[str, Any], priority: int | None = None) -> futures.Future:
+        fut: futures.Future = futures.Future()
+
+        def _cb():
+            try:
+                _publish(self.ch, routing_key, body, priority, declared=self.declared)
+                fut.set_result(True)
+            except Exception as e:
+                self.declared.discard(routing_key)
+                fut.set_exception(e)
+
+        self.ch.connection.add_callback_threadsafe(_cb)
+        return fut
+
+    def ack(self, tag: int):
+        self.ch.connection.add_callback_threadsafe(lambda: self.ch.basic_ack(tag))
+
+    def set_prefetch(self, n: int):
+        def _qos():
+            try:
+                self.ch.basic_qos(prefetch_count=n)
+            except Exception as e:
+                logging.warning("⚠️ basic_qos(%d) failed: %s", n, e)
+
+        self.ch.connection.add_callback_threadsafe(_qos)
+
+    def consume(self):
+        for queue in [QUEUE_IN] + ([AFFINITY.queue()] if AFFINITY.enabled else []):
+            self.consumer_tags.append(self.ch.basic_consume(
+                queue=queue, on_message_callback=functools.partial(consumer_cb, tx=self)))
+
+    def probe(self, queue: str) -> futures.Future:
+        """(consumers, messages) очереди через passive declare на временном канале; нет очереди → (0, 0)."""
+        fut: futures.Future = futures.Future()
+
+        def _cb():
+            try:
+                ch = self.ch.connection.channel()
+                try:
+                    ok = ch.queue_declare(queue=queue, passive=True)
+                    fut.set_result((ok.method.consumer_count, ok.method.message_count))
+                finally:
+                    if ch.is_open:
+                        ch.close()
+            except pika.exceptions.ChannelClosedByBroker:
+                fut.set_result((0, 0))
+            except Exception as e:
+                fut.set_exception(e)
+
+        self.ch.connection.add_callback_threadsafe(_cb)
+        return fut
+
+    def pause_intake(self, paused: bool):
+        """Пауза: отменяем консьюмер (start_consuming вернётся, неразобранные сообщения
+        pika вернёт брокеру); возобновление делает consume_forever."""
+        if paused == self.paused:
+            return
+        self.paused = paused
+        if paused:
+            def _cancel():
+                while self.consumer_tags:
+                    self.ch.basic_cancel(self.consumer_tags.pop())
+
+            self.ch.connection.add_callback_threadsafe(_cancel)
+
+def worker_job(tx, tag, payload: dict[str, Any],
+               queued_s: float = 0.0, predicted_s: float | None = None, ticket=None):
     start_time = time.time()
     done_q = payload.get("done_queue", QUEUE_DONE_DEF)
+    partials: PartialBatcher | None = None
+    if ticket is not None:
+        ticket.start()
 
     try:
         logging.info("🚀 START processing task: %s", payload)
-        result = lipsync_pipeline(
+        args = dict(
             text=payload["text"],
             gender=payload.get("gender", "m"),
             lang=payload.get("lang", "kk"),
             use_avatar=bool(payload.get("useAvatar", True)),
             merge=bool(payload.get("merge", True)),
-            page_id=payload["page_id"],
-            content_id=payload["content_id"],
-            text_id=payload.get("text_id"),
+            quality=get_tier(payload.get("quality")).name,
+            tts=get_backend(payload.get("tts")).name,
         )
+        ids = dict(page_id=payload["page_id"], content_id=payload["content_id"],
+                   text_id=payload.get("text_id"))
+        # opt-in: сегменты уходят в done-очередь по мере загрузки клипов, финальное сообщение — после
+        if wants_partials(payload):
+            partials = PartialBatcher(lambda body: tx.publish(done_q, body), dict(ids))
+        if payload.get("noCache"):
+            result, cached = lipsync_pipeline(**args, **ids, partials=partials), False
+        else:
+            # одинаковый текст/голос/флаги → готовый результат или ожидание уже идущей задачи
+            result, cached = RESULT_CACHE.get_or_run(
+                job_key(**args), lambda: lipsync_pipeline(**args, **ids, partials=partials),
+                cacheable=_all_uploaded)
+        if partials is not None:
+            partials.close()                  # хвост частичных сообщений — до финального
+        result = {**result, **ids, "cached": cached}
+        if cached:
+            result.pop("memory", None)        # это память исходной задачи, а не этой
         duration = time.time() - start_time
-        logging.info("✅ FINISHED task page_id=%s in %.2f sec", payload.get("page_id"), duration)
+        logging.info("✅ FINISHED task page_id=%s in %.2f sec (cached=%s, waited=%.2f, predicted=%s, "
+                     "peak_rss=%s MB)", payload.get("page_id"), duration, cached, queued_s, predicted_s,
+                     (result.get("memory") or {}).get("peak_rss_mb"))
 
         result["status"] = "done"
 
-        def _ok():
-            _declare_passive_or_create(ch, done_q)
-            _publish(ch, done_q, result)
+        # черновик отдан → финальный рендер той же задачи ставим в очередь с низким приоритетом
+        upgrade = None
+        if payload.get("upgrade") and args["quality"] == "draft":
+            upgrade = {k: v for k, v in payload.items() if k not in ("retry", "last_error")}
+            upgrade.update(quality="final", upgrade=False, upgradeOf=result["job_id"],
+                           priority=UPGRADE_PRIORITY)
 
-        ch.connection.add_callback_threadsafe(_ok)
+        sent = [tx.publish(done_q, result)]
+        if upgrade:
+            _warn_fifo_upgrade()
+            sent.append(tx.publish(QUEUE_IN, upgrade, priority=UPGRADE_PRIORITY))
+        ok = _confirmed(sent)
 
     except Exception as exc:
         logging.exception("❌ Ошибка обработки таска: %s", exc)
+        if partials is not None:
+            partials.close()
 
         attempt = int(payload.get("retry", 0)) + 1
         retry_payload = payload.copy()
@@ -244,27 +512,238 @@ def worker_job(ch: pika.BlockingChannel, tag: int, payload: dict[str, Any]):
         logging.info("🔁 Возврат в исходную очередь %s (попытка %s) для page_id=%s",
                      QUEUE_IN, attempt, payload.get("page_id"))
 
-        def _republish():
-            _publish(ch, QUEUE_IN, retry_payload)
-
-        ch.connection.add_callback_threadsafe(_republish)
+        ok = _confirmed([tx.publish(QUEUE_IN, retry_payload,
+                                    priority=_priority(payload) if PRIORITY_MODE else None)])
         time.sleep(5)
 
-    # Подтверждаем текущее сообщение (копия уже опубликована либо результат отправлен)
-    ch.connection.add_callback_threadsafe(lambda: ch.basic_ack(tag))
+    _settle(tx, tag, ok, ticket)
+
+def bulk_job(tx, tag, payload: dict[str, Any],
+             queued_s: float = 0.0, predicted_s: float | None = None, ticket=None):
+    """Массовое сообщение {"items": [{text, page_id, ...}, ...], общие поля по умолчанию}:
+    один проход NLP/TTS/lip-sync на всю пачку (utils/bulk.py). Результат каждого элемента уходит
+    в done-очередь сразу по готовности; упавшие элементы возвращаются одним bulk-повтором."""
+    start_time = time.time()
+    done_q = payload.get("done_queue", QUEUE_DONE_DEF)
+    if ticket is not None:
+        ticket.start()
+    items = payload["items"]
+    defaults = {k: v for k, v in payload.items() if k not in ("items", "retry", "last_error", "done_queue")}
+    sent: list[futures.Future] = []
+    published: set[int] = set()
+    errors: list[str] = []
+
+    def _on_item(i: int, result: dict[str, Any]):
+        if result["status"] == "done":
+            published.add(i)
+            sent.append(tx.publish(done_q, result))
+        else:
+            errors.append(f"#{i}: {result.get('error')}")
+
+    logging.info("🚀 START bulk: %d items (retry=%s)", len(items), payload.get("retry"))
+    with MEMORY.job(f"bulk-{uuid.uuid4().hex[:8]}") as mem:
+        try:
+            run_bulk(items, MEDIA_ROOT, defaults=defaults, max_workers=MAX_WORKERS,
+                     upload=upload_file, on_item=_on_item, cacheable=_all_uploaded)
+        except Exception as exc:
+            logging.exception("❌ Ошибка bulk-таска: %s", exc)
+            errors.append(str(exc))
+
+    failed = [item for i, item in enumerate(items) if i not in published]
+    logging.info("✅ FINISHED bulk: %d/%d items in %.2f sec (waited=%.2f, predicted=%s, peak_rss=%s MB)",
+                 len(published), len(items), time.time() - start_time, queued_s, predicted_s,
+                 mem.report()["peak_rss_mb"])
+    if failed:
+        attempt = int(payload.get("retry", 0)) + 1
+        logging.info("🔁 Возврат %d элементов bulk в %s (попытка %s)", len(failed), QUEUE_IN, attempt)
+        retry_payload = {**payload, "items": failed, "retry": attempt, "last_error": "; ".join(errors)[:2000]}
+        sent.append(tx.publish(QUEUE_IN, retry_payload,
+                               priority=_priority(payload) if PRIORITY_MODE else None))
+    ok = _confirmed(sent)
+    if failed:
+        time.sleep(5)
+    _settle(tx, tag, ok, ticket)
+
+def _settle(tx, tag, ok: bool, ticket=None):
+    # Подтверждаем текущее сообщение (копия уже опубликована либо результат отправлен).
+    # Если брокер публикацию не подтвердил — не ack'аем: сообщение вернётся после переподключения.
+    if ticket is not None:
+        CAPACITY.leave(ticket)
+    if ok:
+        tx.ack(tag)
+    if ticket is not None:
+        _adjust_prefetch(tx)
+        _check_memory(tx)
+
+def _confirmed(sent: list[futures.Future]) -> bool:
+    """Ждём подтверждения публикаций; False → входное сообщение не подтверждаем."""
+    try:
+        for fut in sent:
+            fut.result(timeout=CONFIRM_TIMEOUT)
+        return True
+    except Exception as e:
+        logging.error("⛔️ publish not confirmed: %s – message will be redelivered", e)
+        return False
+
+# ──────────────────── ёмкость и backpressure ────────────────────
+CAPACITY = Capacity("amqp", MAX_WORKERS)
+_prefetch = PREFETCH
+
+def _adjust_prefetch(tx):
+    """Держим столько неподтверждённых сообщений, сколько успеем обработать в пределах SLA;
+    остальное остаётся в брокере для других консьюмеров.
+    Без SLA (ADMISSION_SLA_S=0) QoS не трогаем: действует RMQ_PREFETCH; и никогда не опускаемся
+    ниже него — окно приоритетной очереди (MAX_WORKERS*4) должно сохраняться."""
+    global _prefetch
+    if not CAPACITY.sla_s:
+        return
+    n = CAPACITY.prefetch(floor=PREFETCH, ceiling=max(PREFETCH_MAX, PREFETCH))
+    if n == _prefetch:
+        return
+    _prefetch = n
+    tx.set_prefetch(n)
+    logging.info("🎚️ prefetch → %d (wait≈%.0fs)", n, CAPACITY.estimated_wait())
 
-def consumer_cb(ch: pika.BlockingChannel, method, props, body: bytes):
+def _estimate(payload: dict[str, Any]) -> dict[str, Any]:
+    try:
+        if payload.get("items"):           # bulk: сумма по элементам
+            ests = [COST_MODEL.estimate(a["text"], a["use_avatar"])
+                    for a in (item_args(it, payload) for it in payload["items"])]
+            return {"predicted_s": round(sum(e["predicted_s"] for e in ests), 2),
+                    "segments": sum(e["segments"] for e in ests)}
+        return COST_MODEL.estimate(str(payload.get("text", "")), bool(payload.get("useAvatar", True)))
+    except Exception as e:                       # прогноз не должен ронять приём сообщений
+        logging.warning("⚠️ cost estimate failed: %s", e)
+        return {"predicted_s": 0.0, "segments": 0}
+
+# ──────────────────── память и перезапуск воркера ────────────────────
+# После каждой задачи (utils/memory_budget.py):
+#   бюджет памяти превышен → приём новых сообщений на паузе, пока работа в руках не освободит память;
+#   N задач / рост RSS → приём останавливаем, дорабатываем всё взятое, процесс завершается
+#   с RECYCLE_EXIT, supervise() в __main__ поднимает свежий.
+_recycling = threading.Event()      # приём остановлен насовсем
+_drained   = threading.Event()      # …и всё взятое доделано и подтверждено
+
+def _held() -> int:
+    snap = CAPACITY.snapshot()
+    return snap["busy_slots"] + snap["queued_jobs"]
+
+def _check_memory(tx):
+    busy = _held()
+    state = MEMORY.check(busy)
+    if state == "recycle":
+        if not _recycling.is_set():
+            _recycling.set()
+            logging.warning("♻️ recycle (%s): приём остановлен, дорабатываем %d задач",
+                            MEMORY.recycle_reason, busy)
+        tx.pause_intake(True)
+        if not busy:
+            _drained.set()
+    else:
+        tx.pause_intake(state == "pause")
+
+# ──────────────────── привязка шаблонов к узлам ────────────────────
+# AFFINITY_NODES (utils/affinity.py): шаблоны {gender}_{action_id} распределены по живым узлам
+# консистентным хешированием; задача из общей очереди уходит в очередь узла-владельца,
+# а узел берёт для сегментов только свои шаблоны — его кэши шаблонов/лиц/клипов остаются тёплыми.
+def _forward(tx, tag, payload: dict[str, Any], props) -> bool:
+    """True — задача переслана другому узлу (ack после подтверждения брокером)."""
+    AFFINITY.refresh(tx.probe)
+    target = AFFINITY.route(payload)
+    if target is None:
+        return False
+    body = {**payload, "affinity_hops": int(payload.get("affinity_hops", 0)) + 1}
+    fut = tx.publish(target, body, priority=_priority(payload, props) if PRIORITY_MODE else None)
+
+    def _done(f: futures.Future):
+        if f.exception() is None:
+            tx.ack(tag)
+        else:
+            logging.error("⛔️ forward to %s failed: %s – message will be redelivered", target, f.exception())
+
+    fut.add_done_callback(_done)
+    logging.info("🧭 page_id=%s → %s", payload.get("page_id"), target)
+    return True
+
+# ──────────────────── приоритетный режим ────────────────────
+JOBS = PriorityJobQueue()
+
+def _priority(payload: dict[str, Any], props=None) -> int:
+    """Явный payload["priority"] (0..MAX_PRIORITY, больше = срочнее), иначе приоритет сообщения."""
+    value = payload.get("priority", getattr(props, "priority", None))
+    try:
+        return max(0, min(MAX_PRIORITY, int(value or 0)))
+    except (TypeError, ValueError):
+        return 0
+
+def _run_next():
+    """Каждый слот пула берёт самую дешёвую/срочную задачу на момент старта, а не первую пришедшую."""
+    (tx, tag, payload, predicted_s, ticket), waited = JOBS.pop()
+    job = bulk_job if payload.get("items") else worker_job
+    job(tx, tag, payload, queued_s=waited, predicted_s=predicted_s, ticket=ticket)
+
+def on_message(tx, tag, props, body: bytes):
+    """Общий приём сообщения для обоих транспортов (вызывается в I/O-потоке — только быстрые действия)."""
     try:
         payload = json.loads(body)
         logging.info("📥 Received task: page_id=%s, content_id=%s, retry=%s",
                      payload.get("page_id"), payload.get("content_id"), payload.get("retry"))
     except Exception as e:
         logging.error("⛔️ Bad JSON: %s", e)
-        ch.basic_ack(method.delivery_tag)
+        tx.ack(tag)
         return
-    POOL.submit(worker_job, ch, method.delivery_tag, payload)
+    if _forward(tx, tag, payload, props):
+        return
+    est = _estimate(payload)
+    predicted_s = est["predicted_s"]
+    # сообщение уже доставлено — не отклоняем (enforce=False), но учитываем атомарно
+    ticket, _ = CAPACITY.admit_and_enter(predicted_s, est["segments"], enforce=False)
+    if not PRIORITY_MODE:
+        job = bulk_job if payload.get("items") else worker_job
+        POOL.submit(job, tx, tag, payload, 0.0, predicted_s, ticket)
+    else:
+        prio, deadline = _priority(payload, props), parse_deadline(payload.get("deadline"))
+        JOBS.put((tx, tag, payload, predicted_s, ticket), predicted_s, prio, deadline)
+        logging.info("🧮 queued page_id=%s predicted=%.1fs priority=%s deadline=%s backlog=%d",
+                     payload.get("page_id"), predicted_s, prio, deadline, len(JOBS))
+        POOL.submit(_run_next)
+    _adjust_prefetch(tx)
+
+def consumer_cb(ch: pika.BlockingChannel, method, props, body: bytes, tx: _BlockingTransport):
+    on_message(tx, method.delivery_tag, props, body)
+
+def consume_async():
+    """RMQ_ASYNC=1: I/O, heartbeat и подтверждения живут в отдельном asyncio-потоке."""
+    from utils.amqp_async import AsyncAmqp
+
+    client = AsyncAmqp(conn_params(), QUEUE_IN, on_message, prefetch=_prefetch,
+                       queue_in_args=_incoming_args(),
+                       extra_queues={AFFINITY.queue(): _node_queue_args()} if AFFINITY.enabled else None).start()
+    logging.info("🔌 Async consumer → %s, слушаю %s", RABBIT_HOST, QUEUE_IN)
+    try:
+        while not _drained.wait(60):
+            logging.info("📊 amqp %s tts %s concurrency %s memory %s affinity %s", client.stats(),
+                         backend_stats(), concurrency_stats(), MEMORY.stats(), AFFINITY.stats())
+    except KeyboardInterrupt:
+        logging.info("👋 Stopped by user")
+        client.stop()
+        return None
+    client.stop()                       # ack'и уже в очереди I/O-цикла, закрытие — после них
+    client.join()
+    return RECYCLE_EXIT
+
+def consume_memory(broker):
+    """Тот же приём сообщений поверх MemoryBroker (нагрузочный тест; брокер и публикации — в памяти)."""
+    broker.set_prefetch(_prefetch)
+    broker.consume(QUEUE_IN, on_message)
+    if AFFINITY.enabled:
+        broker.consume(AFFINITY.queue(), on_message)
+    logging.info("🔌 In-memory consumer, слушаю %s", QUEUE_IN)
 
 def consume_forever():
+    """None — остановлен пользователем; RECYCLE_EXIT — воркер отработал своё и ждёт замены."""
+    if ASYNC_MODE:
+        return consume_async()
     while True:
         try:
             connection = pika.BlockingConnection(conn_params())
@@ -272,16 +751,35 @@ def consume_forever():
 
             _declare_incoming(channel)  # совместимая декларация входной очереди
 
-            channel.basic_qos(prefetch_count=MAX_WORKERS)
-            channel.basic_consume(queue=QUEUE_IN, on_message_callback=consumer_cb)
+            channel.basic_qos(prefetch_count=_prefetch)
+            tx = _BlockingTransport(channel)
+            if not _recycling.is_set():
+                tx.consume()
             logging.info("🔌 Подключён к %s, слушаю %s", RABBIT_HOST, QUEUE_IN)
-            channel.start_consuming()
+            while True:
+                channel.start_consuming()       # возвращается после tx.pause_intake(True)
+                while tx.paused and not _recycling.is_set():
+                    connection.process_data_events(time_limit=1)
+                if _recycling.is_set():
+                    break
+                tx.consume()
+            while not _drained.is_set():        # публикации и ack'и доделанных задач
+                connection.process_data_events(time_limit=1)
+            connection.process_data_events(time_limit=0)
+            connection.close()
+            return RECYCLE_EXIT
         except KeyboardInterrupt:
             logging.info("👋 Stopped by user")
-            break
+            return None
         except Exception as e:
             logging.warning("⚠️ Connection error: %s – retrying in 5 sec", e)
             time.sleep(5)
 
+def _worker_process():
+    sys.exit(consume_forever() or 0)
+
 if __name__ == "__main__":
+    # с бюджетом памяти / лимитами перезапуска воркер живёт в дочернем процессе и заменяется свежим
+    if MEMORY.recycling_enabled:
+        sys.exit(supervise(_worker_process))
     consume_forever()
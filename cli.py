@@ -6,34 +6,53 @@
 # ④ MAX_WORKERS (3) ағынмен:
 #      • Edge-TTS (16 kHz WAV)
 #      • Wav2Lip (ауыз қимылы) — stdout прогрессі префикспен
+#        (сапа деңгейі: CLI_QUALITY=draft|standard|final, әдепкі final)
 #      • clip біткенде OutputLogger-ге жазу
 # ⑤ static/logs/ ішінде екі файл:
 #      session_*_ids.jsonl     — API деңгейіндегі ID-лер
 #      session_*_clips.jsonl   — дайын клип ақпараты
 # ⑥ Клиптер жойылмайды; қаласаңыз ffmpeg біріктіру ұсынылады
+#    (әр сессия өз static/video_output/cli_<уақыт>/ қалтасына жазады — атаулар қақтығыспайды)
+#
+# Пакеттік режим (интерактивсіз, түнгі архив қайта рендері):
+#   python cli.py batch texts/            — *.txt файлдары, id = файл аты
+#   python cli.py batch manifest.jsonl    — {"id", "text", "gender", "lang", "useAvatar"} жолдары
+#       --out DIR        нәтиже: DIR/<id>.mp4 (әдепкі static/video_output/batch)
+#       --workers N      Wav2Lip параллельдігі (CLI_WORKERS, әдепкі 3)
+#       --chunk N        бір bulk өтуіндегі элементтер саны (utils/bulk.py)
+#       --tts edge|vits  TTS бэкенді (vits — желісіз, CPU-да батчпен)
+#       --force          бар нәтижелерді де қайта рендерлеу (әдепкі — өткізіп жіберу)
+#   Соңында қорытынды: дайын / өткізілген / қате, аудио секунд, элемент/мин, нақты уақыт еселігі.
 # --------------------------------------------------------------------
 
-import os, sys, subprocess, pathlib, concurrent.futures
-from typing import List, Optional
+import os, sys, json, time, shutil, argparse, datetime, subprocess, pathlib, concurrent.futures
+from typing import Any, Dict, List, Optional
 
 from utils.nlp import parse_text
 from utils.tts import synthesize_speech
-from utils.video_utils import TEMPLATE_DIR, OUTPUT_DIR, WAV2LIP_DIR
+from utils.video_utils import TEMPLATE_DIR, OUTPUT_DIR, WAV2LIP_DIR, log_backend_notes
 from utils.merge import concat_videos
 from utils.classify import classify_sentence_structure
 from utils.api_id import IDLogger
 from utils.output_id import OutputLogger
+from utils.quality import get_tier, wav2lip_flags, TIERS
+from utils.bulk import run_bulk
 
 AUDIO_DIR = pathlib.Path("static/audio").resolve(); AUDIO_DIR.mkdir(exist_ok=True)
 LOG_DIR   = pathlib.Path("static/logs").resolve();  LOG_DIR.mkdir(exist_ok=True)
-MAX_WORKERS = 3
+MAX_WORKERS = int(os.getenv("CLI_WORKERS", 3))
+QUALITY     = get_tier(os.getenv("CLI_QUALITY", "final"))   # draft / standard / final
+SESSION     = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+SESSION_AUDIO = AUDIO_DIR / f"cli_{SESSION}"
+SESSION_VIDEO = OUTPUT_DIR / f"cli_{SESSION}"
+BATCH_OUT   = OUTPUT_DIR / "batch"
 
 # ------------------------------------------------------------------ helpers
 def assign_actions(sentences: List[str], gender: str):
     """[(idx, sentence, action_id, template)]"""
     mapping = []
     for idx, sent in enumerate(sentences, 1):
-        action_id, _ = classify_sentence_structure(None)
+        action_id, _ = classify_sentence_structure(None, text=sent)
         mapping.append((idx, sent, action_id, f"{gender}_{action_id}.mp4"))
     return mapping
 
@@ -42,24 +61,23 @@ def run_clip(idx: int, sentence: str, gender: str, action_id: int,
              clip_logger: OutputLogger) -> str:
     """TTS + Wav2Lip for single clip; write clip log when ready."""
     # ---------- 1) Edge-TTS
-    audio_path = AUDIO_DIR / f"seg_{idx:03d}.wav"
+    audio_path = SESSION_AUDIO / f"seg_{idx:03d}.wav"
     synthesize_speech(sentence, str(audio_path), voice_gender=gender)
 
     # ---------- 2) Wav2Lip
     template  = TEMPLATE_DIR / f"{gender}_{action_id}.mp4"
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    out_path  = OUTPUT_DIR / f"vid_{idx:03d}.mp4"
+    SESSION_VIDEO.mkdir(parents=True, exist_ok=True)
+    out_path  = SESSION_VIDEO / f"vid_{idx:03d}.mp4"
 
     cmd = [
         "python", str(WAV2LIP_DIR / "inference.py"),
         "--checkpoint_path", str(WAV2LIP_DIR / "checkpoints/wav2lip_gan.pth"),
-        "--segmentation_path", str(WAV2LIP_DIR / "checkpoints/face_segmentation.pth"),
-        "--enhance_face", "gfpgan",
+        *wav2lip_flags(QUALITY, WAV2LIP_DIR),
         "--face", str(template),
         "--audio", str(audio_path),
         "--outfile", str(out_path),
     ]
-    print(f"[{idx:02d}] 🎞️  Lip Sync басталды (action {action_id})")
+    print(f"[{idx:02d}] 🎞️  Lip Sync басталды (action {action_id}, {QUALITY.name})")
     proc = subprocess.Popen(cmd, cwd=str(WAV2LIP_DIR),
                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                             text=True, env={**os.environ, "CUDA_VISIBLE_DEVICES": "0"})
@@ -125,6 +143,7 @@ def main():
             target_voice_id   = None,
             after_voice_id    = None,
         )
+    api_logger.flush()
 
     # 6. Клиптерді параллель генерациялау
     videos: List[Optional[str]] = [None] * len(mapping)
@@ -139,6 +158,7 @@ def main():
                 videos[idx-1] = fut.result()
             except Exception as exc:
                 print(f"[{idx:02d}] ✗ Қате: {exc}")
+            clip_logger.flush()                  # лог файлын нақты уақытта бақылауға болады
 
     # 7. Лог файлдары
     print(f"\nAPI ID логы  → {api_logger.file_path()}")
@@ -150,13 +170,119 @@ def main():
         if not ready:
             print("Біріктіруге жарамды клип жоқ!")
             return
-        final_mp4 = "static/video_output/final_merged.mp4"
+        final_mp4 = str(SESSION_VIDEO / "final_merged.mp4")
         print("🔗 ffmpeg арқылы біріктіру …")
         concat_videos(ready, final_mp4)
         print(f"🎬 Дайын бейне → {final_mp4}")
     else:
-        print("Жеке клиптер static/video_output/ директориясында сақталды.")
+        print(f"Жеке клиптер {SESSION_VIDEO} директориясында сақталды.")
+
+# ------------------------------------------------------------------ batch
+def load_items(source: pathlib.Path) -> List[Dict[str, Any]]:
+    """Қалта (*.txt) немесе JSONL манифест → [{"id", "text", ...}]"""
+    if source.is_dir():
+        return [{"id": p.stem, "text": p.read_text(encoding="utf-8")}
+                for p in sorted(source.glob("*.txt"))]
+    items = []
+    with open(source, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", item.get("page_id") or f"{source.stem}_{n:05d}")
+            items.append(item)
+    return items
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    if args.chunk < 1:
+        print("✗ --chunk кемінде 1 болуы керек", file=sys.stderr)
+        return 2
+    out_dir = pathlib.Path(args.out).resolve(); out_dir.mkdir(parents=True, exist_ok=True)
+    items = load_items(pathlib.Path(args.source))
+    ids = [str(it["id"]) for it in items]
+    if len(set(ids)) != len(ids):
+        print("✗ Манифестте қайталанатын id бар — нәтижелер бір-бірін басып қалады", file=sys.stderr)
+        return 2
+
+    todo = [it for it in items if args.force or not (out_dir / f"{it['id']}.mp4").exists()]
+    skipped = len(items) - len(todo)
+    print(f"Барлығы {len(items)}, өткізілді {skipped} (нәтиже бар), рендер {len(todo)} "
+          f"→ {out_dir} (workers={args.workers}, {args.quality})")
+
+    # Ортақ нәтиже кэші қолданылмайды: CLI нәтижелерінде жергілікті жолдар, сервис/воркер
+    # нәтижелерінде қашықтағы URL бар — бір-біріне жарамайды
+    defaults = {"gender": args.gender, "lang": args.lang, "merge": True, "useAvatar": True,
+                "quality": args.quality, "tts": args.tts}
+    done = failed = segments = 0
+    audio_s = 0.0
+    t0 = time.perf_counter()
+
+    def on_item(i: int, result: Dict[str, Any], chunk: List[Dict[str, Any]]):
+        nonlocal done, failed, segments, audio_s
+        item_id = chunk[i]["id"]
+        clips = result.get("clips") or []
+        # бір сегментті элемент біріктірілмейді — оның жалғыз клипі нәтиже болады
+        src = result.get("merged") or (clips[0] if len(clips) == 1 else None)
+        if result.get("status") != "done" or not src:
+            failed += 1
+            print(f"[{item_id}] ✗ Қате: {result.get('error') or 'нәтиже файлы жоқ'}")
+            return
+        dst = out_dir / f"{item_id}.mp4"
+        tmp = dst.with_suffix(".mp4.part")           # жартылай файл «дайын» болып саналмауы үшін
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+        except Exception as exc:
+            tmp.unlink(missing_ok=True)
+            failed += 1
+            print(f"[{item_id}] ✗ Көшіру қатесі: {exc}")
+            return
+        done += 1
+        segments += result.get("segments", 0)
+        audio_s += result.get("audio_s", 0.0)
+        print(f"[{item_id}] ✓ {dst.name}  ({done + failed}/{len(todo)}, cached={result.get('cached')})")
+
+    for start in range(0, len(todo), args.chunk):
+        # әр элемент бір <id>.mp4 береді: merge манифестте өшірілсе де біріктіреміз
+        chunk = [{**{k: v for k, v in it.items() if k != "id"}, "noCache": True, "merge": True}
+                 for it in todo[start:start + args.chunk]]
+        named = todo[start:start + args.chunk]
+        try:
+            run_bulk(chunk, OUTPUT_DIR, defaults=defaults, max_workers=args.workers,
+                     on_item=lambda i, r, c=named: on_item(i, r, c), cacheable=lambda r: False)
+        except Exception as exc:
+            print(f"✗ Бөлік {start // args.chunk + 1} қатесі: {exc}", file=sys.stderr)
+            failed += len(named) - sum((out_dir / f"{it['id']}.mp4").exists() for it in named)
+
+    wall = time.perf_counter() - t0
+    print("\n=== Қорытынды ===")
+    print(f"дайын {done}, өткізілді {skipped}, қате {failed}, сегмент {segments}")
+    print(f"уақыт {wall:.1f} s, аудио {audio_s:.1f} s, "
+          f"{done / wall * 60 if wall else 0:.2f} элемент/мин, "
+          f"нақты уақыт еселігі ×{audio_s / wall if wall else 0:.2f}")
+    return 1 if failed else 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Edge-TTS + Wav2Lip CLI (аргументсіз — интерактивті режим)")
+    sub = ap.add_subparsers(dest="cmd")
+    b = sub.add_parser("batch", help="қалта (*.txt) немесе JSONL манифест бойынша пакеттік рендер")
+    b.add_argument("source", help="мәтіндер қалтасы немесе manifest.jsonl")
+    b.add_argument("--out", default=str(BATCH_OUT), help="нәтиже қалтасы (<id>.mp4)")
+    b.add_argument("--workers", type=int, default=MAX_WORKERS)
+    b.add_argument("--chunk", type=int, default=50, help="бір bulk өтуіндегі элементтер")
+    b.add_argument("--gender", default="m", help="әдепкі жыныс (элементте gender болмаса)")
+    b.add_argument("--lang", default="kk", help="әдепкі тіл (элементте lang болмаса)")
+    b.add_argument("--quality", default=QUALITY.name, choices=list(TIERS))
+    b.add_argument("--tts", default=None, help="TTS бэкенді: edge / edge-stream / vits (әдепкі TTS_BACKEND)")
+    b.add_argument("--force", action="store_true", help="бар нәтижелерді қайта рендерлеу")
+    return ap.parse_args(argv)
 
 
 if __name__ == "__main__":
+    cli_args = parse_args()
+    log_backend_notes()
+    if cli_args.cmd == "batch":
+        sys.exit(run_batch(cli_args))
     main()
@@ -93,7 +93,7 @@ def lipsync_pipeline(text: str, gender: str = "m", merge: bool = True) -> dict:
 
     tasks = []
     for idx, sent in enumerate(sentences, 1):
-        aid, _ = classify_sentence_structure(None)
+        aid, _ = classify_sentence_structure(None, text=sent)
         wav = audio_d / f"{idx:03d}.wav"
         synthesize_speech(sent, str(wav), voice_gender=gender)
         tasks.append((str(wav), gender, aid))
@@ -0,0 +1,21 @@
+from flask import Blueprint, request, current_app, jsonify, abort
+import os
+
+from werkzeug.utils import safe_join
+
+from utils.peaks import load_level, peaks_path
+
+# Define Blueprint
+peaks_bp = Blueprint('peaks', __name__)
+
+# /peaks/audio/<name>.wav?px=<waveform width> → min/max peaks of a file under static/,
+# read from the <name>.peaks file written next to it at synthesis time.
+@peaks_bp.route('/peaks/<path:filename>')
+def peaks(filename):
+    path = safe_join(os.path.abspath(current_app.static_folder), filename)
+    if path is None or not os.path.isfile(peaks_path(path)):
+        abort(404)
+    response = jsonify(load_level(peaks_path(path), request.args.get('px', 0, type=int)))
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
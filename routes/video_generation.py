@@ -3,6 +3,8 @@ import os
 import subprocess
 import datetime
 
+from utils.merge import faststart
+
 # Define Blueprint
 video_generation_bp = Blueprint('video_generation', __name__)
 
@@ -65,6 +67,7 @@ def generate_video():
 
         # Check the return status code
         if process.returncode == 0:
+            faststart(output_path)  # moov atom first, so the browser can seek before the download ends
             # Video successfully generated
             video_url = f"/static/video_output/{output_filename}"
             print(f"Returning video URL: {video_url}")  
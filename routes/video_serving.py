@@ -0,0 +1,19 @@
+from flask import Blueprint, request, current_app, abort
+import os
+
+from werkzeug.utils import safe_join
+
+from utils.video_serving import wsgi_response
+
+# Define Blueprint
+video_serving_bp = Blueprint('video_serving', __name__)
+
+# More specific than Flask's /static/<path:filename>, so rendered videos are served here:
+# Range requests (seeking), ETag / Last-Modified with 304s, sendfile under gunicorn.
+@video_serving_bp.route('/static/video_output/<path:filename>', methods=['GET', 'HEAD'])
+def video_output(filename):
+    folder = os.path.abspath(current_app.config['VIDEO_OUTPUT_FOLDER'])
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return wsgi_response(path, request.environ)
@@ -1,6 +1,7 @@
 # service.py  —— FastAPI + WebSocket + 全文件上传
 # =========================================================
-import os, uuid, pathlib, threading, asyncio, json
+import os, uuid, time, pathlib, threading, asyncio, json, contextlib, queue
+import concurrent.futures
 from celery_app import start_rabbitmq_listener
 
 from dotenv import load_dotenv
@@ -12,23 +13,39 @@ SUB_FOLDER   = os.getenv("UPLOAD_SUBFOLDER", "avatar_pipe").strip() # 可自定
 AUTH_TOKEN   = os.getenv("FILE_SERVER_TOKEN", "").strip()           # 若需鉴权
 start_rabbitmq_listener()
 import requests, logging
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from utils.nlp      import parse_text
-from utils.tts      import synthesize_speech
+from utils.tts      import synthesize_speech, synthesize_many, get_backend, backend_stats
 from utils.video_utils import generate_batch_lip_sync
 from utils.merge    import concat_videos
+from utils.peaks    import write_merged_peaks, load_level
 from utils.classify import classify_sentence_structure
 from utils.api_id   import IDLogger
 from utils.output_id import OutputLogger
+from utils.trace    import start_trace
+from utils.job_store import get_store
+from utils.result_cache import RESULT_CACHE, job_key
+from utils.quality  import get_tier, UPGRADER
+from utils.cost     import COST_MODEL
+from utils.admission import Capacity, snapshot_all, retry_after_header
+from utils.bulk     import run_bulk
+from utils.video_serving import starlette_response
+from utils.concurrency import limiter, concurrency_stats
+from utils.memory_budget import MEMORY
 
 # ---------- 全局常量 ----------
 MEDIA_ROOT   = pathlib.Path("static").resolve(); MEDIA_ROOT.mkdir(exist_ok=True)
 MAX_WORKERS  = 3
 request_lock = threading.Lock()                  # 串行不同请求
+CAPACITY     = Capacity("http", slots=1)          # request_lock → 同时只跑 1 个任务
+UPLOAD_LIMIT = limiter("upload", 4, 1, 16)        # 上传并发：自适应（utils/concurrency.py）
 progress_queues: dict[str, asyncio.Queue] = {}
+upgrades: dict[str, tuple["concurrent.futures.Future", float]] = {}   # final_job_id → (后台最终渲染, 完成时刻)
+upgrades_lock = threading.Lock()
+UPGRADE_TTL_S = float(os.getenv("UPGRADE_TTL_S", 600))  # 完成后未被查询的结果保留多久
 
 # ---------- FastAPI ----------
 app = FastAPI(title="Edge-TTS + Wav2Lip API")
@@ -37,6 +54,26 @@ class LipReq(BaseModel):
     text  : str
     gender: str = "m"   # 'm' / 'f'
     merge : bool = True
+    no_cache: bool = False   # True → 强制重新渲染
+    quality: str | None = None   # draft / standard / final（默认 QUALITY_TIER）
+    upgrade: bool = False        # draft 返回后在后台低优先级渲染 final
+    tts    : str | None = None   # edge / vits（默认 TTS_BACKEND）
+
+class BulkItem(BaseModel):
+    text      : str
+    page_id   : int | None = None
+    content_id: int | None = None
+    text_id   : int | None = None
+    gender    : str | None = None   # 缺省用 BulkReq.gender
+    merge     : bool | None = None
+
+class BulkReq(BaseModel):
+    items  : list[BulkItem]
+    gender : str = "m"
+    merge  : bool = True
+    no_cache: bool = False
+    quality: str | None = None
+    tts    : str | None = None
 
 # ---------- 上传助手 ----------
 def upload_file(file_path: str) -> str | None:
@@ -44,7 +81,7 @@ def upload_file(file_path: str) -> str | None:
         logging.warning("[UPLOAD] UPLOAD_URL 未配置，跳过上传")
         return None
     try:
-        with open(file_path, "rb") as fp:
+        with open(file_path, "rb") as fp, UPLOAD_LIMIT.slot(size=os.path.getsize(file_path) / 2**20):
             resp = requests.post(
                 UPLOAD_URL,
                 files={"file": (os.path.basename(file_path), fp, "video/mp4")},
@@ -96,89 +133,321 @@ async def ws_lipsync(ws: WebSocket, job_id: str):
 # ---------- 主接口 ----------
 @app.post("/lipsync")
 def lipsync(req: LipReq):
+    return JSONResponse(_submit(req))
+
 
+def _submit(req: LipReq) -> dict:
     if not req.text.strip():
         raise HTTPException(400, "text 不能为空")
+    try:
+        req.quality = get_tier(req.quality).name
+        req.tts = get_backend(req.tts).name
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    # 缓存命中不占算力，直接返回，不参与准入控制
+    if not req.no_cache:
+        hit = RESULT_CACHE.get(job_key(req.text, req.gender, "kk", True, req.merge, quality=req.quality, tts=req.tts))
+        if hit is not None:
+            result = {**hit, "cached": True}
+            if req.upgrade and req.quality == "draft":      # 草稿命中缓存也要排 final，否则编辑器停在草稿
+                result["final_job_id"] = _schedule_upgrade(req)
+            return result
+
+    # 准入控制：预计完成时间超过 SLA → 429 + Retry-After，而不是让客户端无限等待
+    # 判断与登记在同一把锁内完成，并发请求互相可见，不会一起被放行
+    est = COST_MODEL.estimate(req.text, use_avatar=True)
+    ticket, retry = CAPACITY.admit_and_enter(est["predicted_s"], est["segments"])
+    if retry is not None:
+        raise HTTPException(429, f"服务繁忙，预计等待 {CAPACITY.estimated_wait():.0f}s，超过 SLA",
+                            headers=retry_after_header(retry))
+
+    try:
+        with UPGRADER.foreground():
+            result = _cached_job(req, ticket=ticket)   # 前台任务运行时后台升级不启动
+    finally:
+        CAPACITY.leave(ticket)
+    if req.upgrade and req.quality == "draft":
+        result["final_job_id"] = _schedule_upgrade(req)
+    return result
+
+
+def _schedule_upgrade(req: LipReq) -> str:
+    """后台低优先级渲染 final；返回 final_job_id。顺带清理过期条目，避免 upgrades 无限增长。"""
+    final_id = uuid.uuid4().hex
+    final = req.model_copy(update={"quality": "final", "upgrade": False})
+    fut = UPGRADER.submit(_cached_job, final, final_id, contextlib.nullcontext())
+    now = time.monotonic()
+    with upgrades_lock:
+        for k in [k for k, (f, t) in upgrades.items() if f.done() and now - t > UPGRADE_TTL_S]:
+            del upgrades[k]
+        upgrades[final_id] = (fut, now)
+    # 完成时刻从结束时算起，TTL 内未被查询才清理
+    fut.add_done_callback(lambda f: _mark_upgrade_done(final_id, f))
+    return final_id
+
+
+def _mark_upgrade_done(final_id: str, fut) -> None:
+    with upgrades_lock:
+        if final_id in upgrades:
+            upgrades[final_id] = (fut, time.monotonic())
+
+
+def _cached_job(req: LipReq, job_id: str | None = None, lock=request_lock, ticket=None) -> dict:
+    if req.no_cache:
+        return {**_locked_job(req, job_id, lock, ticket), "cached": False}
+    # 相同文本/声音/参数 → 直接返回缓存；并发的相同请求只渲染一次
+    result, cached = RESULT_CACHE.get_or_run(
+        job_key(req.text, req.gender, "kk", True, req.merge, quality=req.quality, tts=req.tts),
+        lambda: _locked_job(req, job_id, lock, ticket),
+        cacheable=lambda r: not any(str(u).startswith(str(MEDIA_ROOT))
+                                    for u in [*r["clips"], r["merged"]] if u),
+    )
+    return {**result, "cached": cached}
+
+
+# ---------- 草稿预览（static/js/video_editor.js） ----------
+@app.post("/preview")
+def preview(req: LipReq):
+    """快速 draft 渲染供编辑器预览；final 在后台低优先级生成，用 GET /preview/{final_job_id} 查询。"""
+    result = _submit(req.model_copy(update={"quality": "draft", "upgrade": True, "merge": True}))
+    return {"status": "success", **result, "video_url": _video_url(result)}
+
+
+@app.get("/preview/{final_job_id}")
+def preview_final(final_job_id: str):
+    with upgrades_lock:
+        fut, _t = upgrades.get(final_job_id, (None, 0.0))
+        if fut is not None and fut.done():
+            del upgrades[final_job_id]        # 已交付的结果不再保留（结果本身在 RESULT_CACHE / JobStore）
+    if fut is None:
+        raise HTTPException(404, "未知的 final_job_id")
+    if not fut.done():
+        return {"status": "pending", **UPGRADER.stats()}
+    if fut.exception() is not None:
+        return {"status": "error", "message": str(fut.exception())}
+    result = fut.result()
+    return {"status": "done", **result, "video_url": _video_url(result)}
+
+
+def _video_url(result: dict) -> str | None:
+    """合并文件（单段时为唯一 clip）的可访问地址：已上传 → 远程 URL；
+    本地 → /video/{job_id}.mp4 或 /video/{job_id}/{clip}.mp4，绝不返回磁盘路径。"""
+    url = result["merged"] or (result["clips"] or [None])[0]
+    if url and str(url).startswith(str(MEDIA_ROOT)):
+        p = pathlib.Path(url)                    # MEDIA_ROOT/<job_id>/video/<name>.mp4
+        job = p.parent.parent.name
+        return f"/video/{job}.mp4" if p.name == f"{job}.mp4" else f"/video/{job}/{p.name}"
+    return url
+
 
-    with request_lock:                   # 保证批次串行
-        job_id = uuid.uuid4().hex
+def _locked_job(req: LipReq, job_id: str | None = None, lock=request_lock, ticket=None) -> dict:
+    job_id = job_id or uuid.uuid4().hex
+    tracer = start_trace(job_id, MEDIA_ROOT / job_id / "logs")
+    t_wait = tracer.now_ns()
 
-        # ---- 目录 / 日志 ----
-        job_dir  = MEDIA_ROOT / job_id
-        audio_d  = job_dir / "audio"; audio_d.mkdir(parents=True, exist_ok=True)
-        video_d  = job_dir / "video"; video_d.mkdir()
-        log_d    = job_dir / "logs" ; log_d.mkdir()
-        api_log  = IDLogger(log_d)
-        clip_log = OutputLogger(log_d)
+    with lock:                           # 保证批次串行（后台 final 升级不占用）
+        tracer.add_span("request_lock.wait", t_wait, tracer.now_ns(), cat="wait")
+        if ticket is not None:
+            ticket.start()
+        store  = get_store()
+        if store:
+            store.start_job(job_id, gender=req.gender, merge=req.merge, quality=req.quality, tts=req.tts)
+        status = "error"
+        try:
+            with tracer.span("job", gender=req.gender, merge=req.merge, quality=req.quality):
+                result = _run_job(job_id, req, tracer, store)
+            status = "done"
+            return result
+        finally:
+            tracer.export()
+            if store:
+                store.finish_job(job_id, status)
 
-        # ---- 1) 文本分句 ----
+
+def _run_job(job_id: str, req: LipReq, tracer, store) -> dict:
+    # ---- 目录 / 日志 ----
+    job_dir  = MEDIA_ROOT / job_id
+    audio_d  = job_dir / "audio"; audio_d.mkdir(parents=True, exist_ok=True)
+    video_d  = job_dir / "video"; video_d.mkdir()
+    log_d    = job_dir / "logs" ; log_d.mkdir()
+    api_log  = IDLogger(log_d, job_id, store)
+    clip_log = OutputLogger(log_d, job_id, store)
+
+    # ---- 1) 文本分句 ----
+    with tracer.span("nlp.parse_text"):
         sentences, _ = parse_text(req.text)
-        total = len(sentences)
-        push(job_id, {"stage":"start","total":total})
-
-        # ---- 2) 动作随机 + API 日志 ----
-        mapping = []
-        for idx, sent in enumerate(sentences, 1):
-            aid, _ = classify_sentence_structure(None)
-            mapping.append((idx, sent, aid))
-            api_log.add_entry(
-                text_clip_id     = idx,
-                orig_voice_id    = 1000+idx,
-                avatar_action_id = aid,
-                avatar_gender_id = 1 if req.gender=="m" else 2,
-                voice_gender_id  = 1 if req.gender=="m" else 2,
-                target_voice_id  = None,
-                after_voice_id   = None,
-            )
+    total = len(sentences)
+    push(job_id, {"stage":"start","total":total})
 
-        # ---- 3) 生成 wav + 任务 ----
-        tasks = []
-        for idx, sent, aid in mapping:
-            wav = audio_d / f"{idx:03d}.wav"
-            synthesize_speech(sent, str(wav), voice_gender=req.gender)
-            push(job_id, {"stage":"tts","index":idx,"total":total})
-            tasks.append((str(wav), req.gender, aid))
-
-        # ---- 4) 并发口型同步 ----
-        clips_local = generate_batch_lip_sync(
-            tasks, MAX_WORKERS, video_dir=video_d,
-            on_done=lambda k: push(job_id, {"stage":"wav2lip","index":k,"total":total})
+    # ---- 2) 动作随机 + API 日志 ----
+    mapping = []
+    for idx, sent in enumerate(sentences, 1):
+        aid, _ = classify_sentence_structure(None, text=sent)
+        mapping.append((idx, sent, aid))
+        api_log.add_entry(
+            text_clip_id     = idx,
+            orig_voice_id    = 1000+idx,
+            avatar_action_id = aid,
+            avatar_gender_id = 1 if req.gender=="m" else 2,
+            voice_gender_id  = 1 if req.gender=="m" else 2,
+            target_voice_id  = None,
+            after_voice_id   = None,
         )
+    api_log.flush()                     # 阶段边界即落盘：前端可实时 tail，失败时也不丢
 
-        # ---- 5) 上传每个 clip ----
-        clips_remote = []
-        for mp4_path in clips_local:
+    # ---- 3) 生成 wav + 任务 ----
+    tts = get_backend(req.tts)
+    if tts.batched:                     # 本地 VITS / edge-stream：全部句子一次合成
+        with tracer.span("tts.batch", backend=tts.name, segments=total):
+            for res in synthesize_many([(sent, audio_d / f"{idx:03d}.wav", req.gender, "kk")
+                                        for idx, sent, _aid in mapping], backend=tts.name):
+                if isinstance(res, BaseException):
+                    raise res
+    tasks = []
+    for idx, sent, aid in mapping:
+        wav = audio_d / f"{idx:03d}.wav"
+        if not tts.batched:
+            with tracer.span("tts", index=idx, chars=len(sent)):
+                synthesize_speech(sent, str(wav), voice_gender=req.gender, backend=tts.name)
+        push(job_id, {"stage":"tts","index":idx,"total":total})
+        tasks.append((str(wav), req.gender, aid))
+
+    # ---- 4) 并发口型同步 ----
+    clips_local = generate_batch_lip_sync(
+        tasks, MAX_WORKERS, video_dir=video_d,
+        on_done=lambda k: push(job_id, {"stage":"wav2lip","index":k,"total":total}),
+        tracer=tracer, tier=req.quality,
+    )
+
+    # ---- 5) 上传每个 clip ----
+    clips_remote = []
+    for idx, mp4_path in enumerate(clips_local, 1):
+        with tracer.span("upload", index=idx):
             remote = upload_file(mp4_path) or mp4_path   # 上传失败则保留本地
-            clips_remote.append(remote)
+        clips_remote.append(remote)
 
-        for (idx, _s, aid), url in zip(mapping, clips_remote):
-            clip_log.add_entry(text_clip_id=idx, video_path=url, avatar_action_id=aid)
+    for (idx, _s, aid), url in zip(mapping, clips_remote):
+        clip_log.add_entry(text_clip_id=idx, video_path=url, avatar_action_id=aid)
+    clip_log.flush()
 
-        # ---- 6) 合并 & 上传 ----
-        merged_url = None
-        if req.merge and len(clips_local) > 1:
-            push(job_id, {"stage":"merge"})
-            merged_local = str(video_d / f"{job_id}.mp4")
+    # ---- 6) 合并 & 上传 ----
+    merged_url = None
+    if req.merge and len(clips_local) > 1:
+        push(job_id, {"stage":"merge"})
+        merged_local = str(video_d / f"{job_id}.mp4")
+        with tracer.span("merge", clips=len(clips_local)):
             concat_videos(clips_local, merged_local)
+        write_merged_peaks([w for w, _, _ in tasks], merged_local)
+        with tracer.span("upload", merged=True):
             filepath = upload_file(merged_local)
-            print(filepath)
-            merged_url = filepath or merged_local
+        print(filepath)
+        merged_url = filepath or merged_local
+
+    # ---- 7) 完成 ----
+    push(job_id, {"stage":"done","merged": merged_url or ""})
+
+    return {
+        "job_id"  : job_id,
+        "quality" : req.quality,
+        "tts"     : req.tts,
+        "clips"   : clips_remote,
+        "merged"  : merged_url,
+        "api_log" : api_log.file_path(),
+        "clip_log": clip_log.file_path()
+    }
+
+# ---------- 批量接口 ----------
+@app.post("/lipsync/bulk")
+def lipsync_bulk(req: BulkReq):
+    """整门课程一次提交：一次分句、跨条目去重相同片段、共享 TTS、整批口型同步（utils/bulk.py）。
+    响应为 NDJSON 流：每个条目完成即输出一行 {index, page_id, status, clips, merged, ...}，最后一行 {"stage":"done"}。"""
+    if not req.items:
+        raise HTTPException(400, "items 不能为空")
+    try:
+        req.quality = get_tier(req.quality).name
+        req.tts = get_backend(req.tts).name
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    items = [{k: v for k, v in it.model_dump().items() if v is not None} for it in req.items]
+    defaults = {"gender": req.gender, "merge": req.merge, "lang": "kk", "useAvatar": True,
+                "quality": req.quality, "tts": req.tts, "noCache": req.no_cache}
+
+    ests = [COST_MODEL.estimate(it["text"], use_avatar=True) for it in items if it["text"].strip()]
+    predicted = sum(e["predicted_s"] for e in ests)
+    ticket, retry = CAPACITY.admit_and_enter(predicted, sum(e["segments"] for e in ests))
+    if retry is not None:
+        raise HTTPException(429, f"服务繁忙，预计等待 {CAPACITY.estimated_wait():.0f}s，超过 SLA",
+                            headers=retry_after_header(retry))
 
-        # ---- 7) 完成 ----
-        push(job_id, {"stage":"done","merged": merged_url or ""})
+    out: "queue.Queue[dict | None]" = queue.Queue()
 
-        return JSONResponse({
-            "job_id"  : job_id,
-            "clips"   : clips_remote,
-            "merged"  : merged_url,
-            "api_log" : api_log.file_path(),
-            "clip_log": clip_log.file_path()
-        })
+    def _run():
+        try:
+            with UPGRADER.foreground():
+                with request_lock:
+                    ticket.start()
+                    run_bulk(items, MEDIA_ROOT, defaults=defaults, max_workers=MAX_WORKERS,
+                             upload=upload_file, on_item=lambda i, r: out.put(r),
+                             cacheable=lambda r: not any(str(u).startswith(str(MEDIA_ROOT))
+                                                         for u in [*r["clips"], r["merged"]] if u))
+        except Exception as e:
+            logging.exception("[BULK] failed")
+            out.put({"stage": "error", "message": str(e)})
+        finally:
+            CAPACITY.leave(ticket)
+            out.put(None)
+
+    threading.Thread(target=_run, name="bulk", daemon=True).start()
+
+    def _stream():
+        done = 0
+        while (r := out.get()) is not None:
+            done += "index" in r
+            yield json.dumps(r, ensure_ascii=False) + "\n"
+        yield json.dumps({"stage": "done", "items": len(items), "finished": done}) + "\n"
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+# ---------- 容量 ----------
+@app.get("/capacity")
+def capacity():
+    """空闲槽位、排队片段数、预计等待（本进程内所有入口：http / amqp）。"""
+    return {"entry_points": snapshot_all(), "upgrades": UPGRADER.stats(),
+            "cost_model": COST_MODEL.stats(), "tts": backend_stats(),
+            "concurrency": concurrency_stats(), "memory": MEMORY.stats()}
+
+# ---------- 波形峰值（utils/peaks.py）：前端直接绘制，无需下载整段 WAV ----------
+@app.get("/peaks/{job_id}")
+def merged_peaks(job_id: str, px: int = 0):
+    """合并音轨的峰值；px = 波形宽度（像素），返回满足该宽度的最粗一级。"""
+    return _peaks(MEDIA_ROOT / job_id / "video" / f"{job_id}.peaks", px)
+
+@app.get("/peaks/{job_id}/{index}")
+def segment_peaks(job_id: str, index: int, px: int = 0):
+    return _peaks(MEDIA_ROOT / job_id / "audio" / f"{index:03d}.peaks", px)
+
+def _peaks(path: pathlib.Path, px: int):
+    if not path.exists():
+        raise HTTPException(404, "未找到波形峰值文件")
+    return JSONResponse(load_level(path, px), headers={"Cache-Control": "public, max-age=3600"})
 
 # ---------- (可选) 下载本地合并文件 ----------
-@app.get("/video/{job_id}.mp4")
-def download(job_id: str):
+# Range / ETag / 304 / sendfile（utils/video_serving.py）：浏览器拖动进度条只取所需字节
+@app.api_route("/video/{job_id}.mp4", methods=["GET", "HEAD"])
+def download(job_id: str, request: Request):
     path = MEDIA_ROOT / job_id / "video" / f"{job_id}.mp4"
     if not path.exists():
         raise HTTPException(404, "未找到本地合并视频")
-    return FileResponse(path, media_type="video/mp4", filename=path.name)
+    return starlette_response(path, request, media_type="video/mp4", filename=path.name)
+
+# 未合并的单段结果（merge=False 或只有一句）：本地 clip
+@app.api_route("/video/{job_id}/{name}", methods=["GET", "HEAD"])
+def download_clip(job_id: str, name: str, request: Request):
+    if not name.endswith(".mp4") or any(s in ("", ".", "..") or "/" in s for s in (job_id, name)):
+        raise HTTPException(404, "未找到本地视频")
+    path = MEDIA_ROOT / job_id / "video" / name
+    if not path.exists():
+        raise HTTPException(404, "未找到本地视频")
+    return starlette_response(path, request, media_type="video/mp4", filename=path.name)
@@ -62,18 +62,40 @@ async function startProcessing() {
 
 /**
  * 🎵 初始化 Wavesurfer
+ * 先取预计算的波形峰值（/peaks/...，合成时生成的 .peaks 文件）立即绘制；
+ * 音频本身由 <audio preload="none"> 按需流式加载，不再整段下载解码 WAV。
+ * 没有峰值文件时退回旧方式。
  */
-function initializeWaveSurfer(audioFile, waveformId) {
+async function initializeWaveSurfer(audioFile, waveformId) {
     const container = document.getElementById(waveformId);
-    audioPlayers[waveformId] = WaveSurfer.create({
+    const options = {
         container: container,
         waveColor: '#66d9ff',
         progressColor: '#ff7eb3',
         barWidth: 2,
         responsive: true,
         height: 60,
-    });
-    audioPlayers[waveformId].load(audioFile);
+    };
+    try {
+        const px = Math.ceil((container.clientWidth || 600) * (window.devicePixelRatio || 1));
+        const response = await fetch(`/peaks/${audioFile.replace(/^\/static\//, '')}?px=${px}`);
+        if (!response.ok) throw new Error(`peaks ${response.status}`);
+        const peaks = await response.json();
+        const scale = peaks.bits === 8 ? 127 : 32767;
+        const media = new Audio();
+        media.preload = 'none';
+        media.src = audioFile;
+        audioPlayers[waveformId] = WaveSurfer.create({
+            ...options,
+            media: media,
+            peaks: [Float32Array.from(peaks.data, v => v / scale)],  // [min0, max0, min1, max1, …]
+            duration: peaks.duration,
+        });
+    } catch (error) {
+        console.warn('Waveform peaks unavailable, decoding audio:', error);
+        audioPlayers[waveformId] = WaveSurfer.create(options);
+        audioPlayers[waveformId].load(audioFile);
+    }
 }
 
 /**
@@ -82,6 +104,7 @@ function initializeWaveSurfer(audioFile, waveformId) {
 function togglePlay(index, button) {
     const waveformId = `waveform-${index}`;
     const player = audioPlayers[waveformId];
+    if (!player) return;  // 波形仍在加载
     if (player.isPlaying()) {
         player.pause();
         button.innerText = '▶️ Play';
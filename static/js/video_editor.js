@@ -10,18 +10,41 @@ function addSegment() {
 }
 
 async function previewVideo() {
+    const textInput = document.getElementById('text-input');
+    const genderInput = document.getElementById('gender-select');
     const response = await fetch('/preview', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ segments })
+        body: JSON.stringify({
+            segments,
+            text: textInput ? textInput.value.trim() : '',
+            gender: genderInput ? genderInput.value : 'm'
+        })
     });
 
     const result = await response.json();
     if (result.status === 'success') {
+        // draft first; swap in the final render once the background upgrade is done
         document.getElementById('preview-video').src = result.video_url;
         document.getElementById('preview-video').play();
+        if (result.final_job_id) {
+            pollFinalRender(result.final_job_id);
+        }
     } else {
-        alert('Error: ' + result.message);
+        alert('Error: ' + (result.message || result.detail));
+    }
+}
+
+async function pollFinalRender(finalJobId, intervalMs = 5000) {
+    const response = await fetch(`/preview/${finalJobId}`);
+    const result = await response.json();
+    if (result.status === 'pending') {
+        setTimeout(() => pollFinalRender(finalJobId, intervalMs), intervalMs);
+    } else if (result.status === 'done') {
+        const player = document.getElementById('preview-video');
+        const position = player.currentTime;
+        player.addEventListener('loadedmetadata', () => { player.currentTime = position; }, { once: true });
+        player.src = result.video_url;
     }
 }
 async function validateVideoLength(selectElement, audioDuration) {
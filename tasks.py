@@ -37,7 +37,7 @@ def lipsync_job(self, req_dict: dict):
     # 2) 记录动作
     mapping = []
     for idx, sent in enumerate(sentences, 1):
-        aid, _ = classify_sentence_structure(None)
+        aid, _ = classify_sentence_structure(None, text=sent)
         mapping.append((idx, sent, aid))
         api_log.add_entry(
             text_clip_id=idx, orig_voice_id=1000+idx,
@@ -0,0 +1,5 @@
+# tests/conftest.py — make `utils.*` importable when pytest runs from anywhere
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,86 @@
+# tests/test_admission.py — Capacity.admit_and_enter, leave, prefetch
+import threading
+
+from utils.admission import Capacity, retry_after_header
+
+
+def test_admits_until_sla_then_rejects():
+    cap = Capacity("t-sla", slots=1, sla_s=25)
+    a, wait_a = cap.admit_and_enter(10)
+    b, wait_b = cap.admit_and_enter(10)
+    assert a is not None and wait_a is None
+    assert b is not None and wait_b is None
+    c, retry = cap.admit_and_enter(10)            # 20 queued + 10 > 25
+    assert c is None and retry == 5
+    assert (cap.admitted, cap.rejected) == (2, 1)
+    assert cap.snapshot()["queued_jobs"] == 2
+
+
+def test_retry_hint_is_at_least_one_second():
+    cap = Capacity("t-min", slots=1, sla_s=10)
+    cap.admit_and_enter(10)
+    _, retry = cap.admit_and_enter(0.2)
+    assert retry == 1.0
+    assert retry_after_header(2.1) == {"Retry-After": "3"}
+
+
+def test_slots_divide_the_backlog():
+    cap = Capacity("t-slots", slots=4, sla_s=25)
+    for _ in range(7):
+        ticket, _ = cap.admit_and_enter(10)       # 10·n / 4 + 10 ≤ 25 up to n = 6
+        assert ticket is not None
+    assert cap.admit_and_enter(10)[0] is None     # 70 / 4 + 10 > 25
+
+
+def test_leave_frees_capacity():
+    cap = Capacity("t-leave", slots=1, sla_s=15)
+    ticket, _ = cap.admit_and_enter(10)
+    assert cap.admit_and_enter(10)[0] is None
+    cap.leave(ticket)
+    assert cap.admit_and_enter(10)[0] is not None
+    cap.leave(ticket)                             # second leave is a no-op
+    assert cap.finished == 1
+
+
+def test_concurrent_burst_cannot_overshoot():
+    cap = Capacity("t-burst", slots=1, sla_s=25)
+    barrier = threading.Barrier(20)
+    results = []
+    lock = threading.Lock()
+
+    def request():
+        barrier.wait()
+        ticket, _ = cap.admit_and_enter(10)
+        with lock:
+            results.append(ticket is not None)
+
+    threads = [threading.Thread(target=request) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert results.count(True) == 2 and results.count(False) == 18
+
+
+def test_not_enforced_always_admits():
+    cap = Capacity("t-amqp", slots=1, sla_s=5)
+    for _ in range(3):
+        ticket, retry = cap.admit_and_enter(10, segments=3, enforce=False)
+        assert ticket is not None and retry is None
+    snap = cap.snapshot()
+    assert snap["queued_jobs"] == 3 and snap["queued_segments"] == 9
+    assert cap.rejected == 0
+
+
+def test_without_sla_everything_is_admitted():
+    cap = Capacity("t-nosla", slots=1, sla_s=0)
+    assert all(cap.admit_and_enter(1000)[0] is not None for _ in range(5))
+
+
+def test_prefetch_follows_sla():
+    cap = Capacity("t-prefetch", slots=2, sla_s=30)
+    cap.admit_and_enter(10, enforce=False)        # avg cost 10 s
+    assert cap.prefetch(floor=1, ceiling=32) == 2 + 6     # 30·2 // 10
+    assert cap.prefetch(floor=1, ceiling=5) == 5
+    assert cap.prefetch(floor=12, ceiling=32) == 12
+    assert Capacity("t-prefetch-nosla", slots=2, sla_s=0).prefetch() == 4
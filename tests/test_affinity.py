@@ -0,0 +1,91 @@
+# tests/test_affinity.py — consistent-hash ring with bounded loads, router
+import collections
+import concurrent.futures as futures
+
+from utils.affinity import AffinityRouter, HashRing, template_key
+from utils.classify import TOTAL_ACTIONS
+
+NODES = ["a", "b", "c", "d"]
+KEYS = [template_key(g, i) for g in ("m", "f") for i in range(1, 201)]
+
+
+def _done(value):
+    fut = futures.Future()
+    fut.set_result(value)
+    return fut
+
+
+def test_owner_is_deterministic_and_order_independent():
+    r1, r2 = HashRing(NODES), HashRing(list(reversed(NODES)) + ["a"])
+    assert all(r1.owner(k) == r2.owner(k) for k in KEYS)
+    assert HashRing([]).owner("m_1") is None
+
+
+def test_keys_spread_over_nodes():
+    counts = collections.Counter(HashRing(NODES).owner(k) for k in KEYS)
+    assert set(counts) == set(NODES)
+    assert min(counts.values()) > len(KEYS) / len(NODES) / 3
+
+
+def test_removing_a_node_moves_only_its_keys():
+    full, rest = HashRing(NODES), HashRing(["a", "b", "d"])
+    for k in KEYS:
+        if full.owner(k) != "c":
+            assert rest.owner(k) == full.owner(k)
+        else:
+            assert rest.owner(k) == next(n for n in full.walk(k) if n != "c")
+
+
+def test_walk_visits_each_node_once():
+    walk = list(HashRing(NODES).walk("m_7"))
+    assert sorted(walk) == NODES
+
+
+def test_bounded_owner_skips_overloaded_node():
+    ring = HashRing(NODES)
+    key = "m_7"
+    first, second = list(ring.walk(key))[:2]
+    assert ring.owner_bounded(key, {}) == first
+    # cap = ⌈1.25 · (10 + 1) / 4⌉ = 4: the owner holds 10, the next one is free
+    assert ring.owner_bounded(key, {first: 10}, factor=1.25) == second
+    # everyone over the cap → plain owner
+    full = {n: 100 for n in NODES}
+    assert ring.owner_bounded(key, full, factor=0.01) == first
+
+
+def test_bounded_load_evens_out_a_skewed_stream():
+    ring = HashRing(NODES)
+    loads = collections.Counter()
+    for _ in range(100):                              # the same hot key every time
+        loads[ring.owner_bounded("m_7", loads, factor=1.25)] += 1
+    assert max(loads.values()) <= 1.25 * (100 + 1) / len(NODES) + 1
+
+
+def test_router_disabled_with_one_node():
+    router = AffinityRouter(node_id="a", nodes=[], queue_in="q")
+    assert not router.enabled
+    assert router.route({"text": "x"}) is None
+    assert router.local_actions("m") is None
+
+
+def test_router_routes_by_membership():
+    router = AffinityRouter(node_id="a", nodes=["a", "b"], queue_in="q", refresh_s=0)
+    payloads = [{"content_id": f"c{i}", "gender": "m"} for i in range(40)]
+    assert all(router.route(p) is None for p in payloads)   # only "a" known alive
+
+    router.refresh(lambda queue: _done((1, 0)))
+    assert router.stats()["alive"] == ["a", "b"] and router.rebalances == 1
+    targets = {router.route(p) for p in payloads}
+    assert targets == {None, "q.node.b"}
+    assert router.route({"content_id": "c1", "affinity_hops": 1}) is None
+    assert router.hops_exhausted == 1
+
+
+def test_local_actions_partition_templates():
+    a = AffinityRouter(node_id="a", nodes=["a", "b"], queue_in="q", refresh_s=0)
+    b = AffinityRouter(node_id="b", nodes=["a", "b"], queue_in="q", refresh_s=0)
+    for r in (a, b):
+        r.refresh(lambda queue: _done((1, 0)))
+    owned_a, owned_b = set(a.local_actions("f") or ()), set(b.local_actions("f") or ())
+    assert owned_a and owned_b and not owned_a & owned_b
+    assert owned_a | owned_b == set(range(1, TOTAL_ACTIONS + 1))
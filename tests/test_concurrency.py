@@ -0,0 +1,123 @@
+# tests/test_concurrency.py — Limiter resize / AIMD step and ResizablePool
+import threading
+import time
+
+import pytest
+
+from utils.concurrency import Limiter, ResizablePool
+
+
+def test_resize_clamps_to_bounds():
+    lim = Limiter("t", init=4, lo=2, hi=8)
+    lim.resize(100)
+    assert lim.limit == 8
+    lim.resize(0)
+    assert lim.limit == 2
+    lim.resize(5)
+    assert lim.limit == 5
+
+
+def test_init_is_clamped():
+    assert Limiter("t", init=0, lo=1, hi=4).limit == 1
+    assert Limiter("t", init=9, lo=1, hi=4).limit == 4
+
+
+def test_try_acquire_respects_limit():
+    lim = Limiter("t", init=2, lo=1, hi=4)
+    assert lim.try_acquire() and lim.try_acquire()
+    assert not lim.try_acquire()
+    lim.resize(3)
+    assert lim.try_acquire()
+    lim.release()
+    assert lim.active == 2
+
+
+def test_resize_up_wakes_waiter():
+    lim = Limiter("t", init=1, lo=1, hi=4)
+    lim.acquire()
+    entered = threading.Event()
+
+    def waiter():
+        lim.acquire()
+        entered.set()
+
+    t = threading.Thread(target=waiter, daemon=True)
+    t.start()
+    deadline = time.monotonic() + 2
+    while lim.waiting == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert lim.waiting == 1 and not entered.is_set()
+    lim.resize(2)
+    assert entered.wait(2)
+    t.join(2)
+    assert lim.active == 2 and lim.waiting == 0
+
+
+def test_resize_down_lets_active_finish():
+    lim = Limiter("t", init=3, lo=1, hi=4)
+    for _ in range(3):
+        lim.acquire()
+    lim.resize(1)
+    assert lim.active == 3
+    lim.release()
+    lim.release()
+    assert not lim.try_acquire()
+    lim.release()
+    assert lim.try_acquire()
+
+
+def test_step_grows_only_when_saturated():
+    lim = Limiter("t", init=1, lo=1, hi=4)
+    with lim.slot():
+        pass
+    lim._step(None, None)
+    assert lim.limit == 1
+
+    lim.acquire()
+    assert not lim.try_acquire()          # refused → saturated
+    lim.release()
+    lim._step(None, None)
+    assert lim.limit == 2 and lim.increases == 1
+    lim._step(None, None)                 # flag is per window
+    assert lim.limit == 2
+
+
+def test_step_backs_off_on_pressure():
+    lim = Limiter("t", init=8, lo=1, hi=16)
+    lim._step(None, 0.01)                 # memory nearly exhausted
+    assert lim.limit < 8 and lim.decreases == 1
+    assert lim.last_reason.startswith("memory")
+
+
+def test_pool_concurrency_follows_limit():
+    lim = Limiter("t", init=2, lo=1, hi=8)
+    pool = ResizablePool(lim)
+    gate = threading.Event()
+    peak = [0]
+    lock = threading.Lock()
+
+    def job():
+        with lock:
+            peak[0] = max(peak[0], lim.active)
+        gate.wait(2)
+
+    futs = [pool.submit(job) for _ in range(6)]
+    time.sleep(0.2)
+    assert lim.active == 2
+    lim.resize(4)
+    time.sleep(0.2)
+    assert lim.active == 4
+    gate.set()
+    for f in futs:
+        f.result(2)
+    assert peak[0] == 4 and lim.active == 0
+
+
+def test_pool_propagates_exceptions():
+    pool = ResizablePool(Limiter("t", init=1, lo=1, hi=2))
+
+    def boom():
+        raise ValueError("x")
+
+    with pytest.raises(ValueError):
+        pool.submit(boom).result(2)
@@ -0,0 +1,115 @@
+# tests/test_cost.py — CostModel fit and the aging/priority/deadline order
+import numpy as np
+import pytest
+
+cost = pytest.importorskip("utils.cost", reason="utils.nlp needs stanza and its kk model")
+from utils.cost import MIN_SAMPLES, CostModel, PriorityJobQueue, parse_deadline  # noqa: E402
+
+# true per-stage coefficients (1, segments, audio_s)
+TRUE = {"tts": (0.4, 0.5, 0.1), "lipsync": (1.5, 2.0, 3.0), "upload": (0.0, 0.2, 0.0),
+        "merge": (0.3, 0.0, 0.04)}
+
+
+def _jobs(n, use_avatar=True, chars_per_sec=10.0, seed=0):
+    rng = np.random.default_rng(seed)
+    jobs = []
+    for _ in range(n):
+        segments = int(rng.integers(1, 40))
+        audio_s = float(rng.uniform(2, 200))
+        stages = {s: a + b * segments + c * audio_s for s, (a, b, c) in TRUE.items()}
+        jobs.append({"status": "done", "meta": {
+            "segments": segments, "audio_s": audio_s, "chars": audio_s * chars_per_sec,
+            "stages": stages, "use_avatar": use_avatar}})
+    return jobs
+
+
+def test_fit_recovers_stage_coefficients():
+    model = CostModel(refit_s=1e9)
+    model.fit(_jobs(30))
+    assert model.samples == 30
+    assert model.chars_per_sec == pytest.approx(10.0)
+    for stage, coef in TRUE.items():
+        np.testing.assert_allclose(model.coef[True][stage], coef, atol=1e-6)
+
+
+def test_fit_is_per_avatar_mode_and_needs_enough_samples():
+    model = CostModel(refit_s=1e9)
+    green_before = {s: c.copy() for s, c in model.coef[False].items()}
+    model.fit(_jobs(20) + _jobs(MIN_SAMPLES - 1, use_avatar=False, seed=1))
+    np.testing.assert_allclose(model.coef[True]["lipsync"], TRUE["lipsync"], atol=1e-6)
+    for stage, c in green_before.items():
+        np.testing.assert_array_equal(model.coef[False][stage], c)
+
+
+def test_fit_ignores_unfinished_and_incomplete_jobs():
+    model = CostModel(refit_s=1e9)
+    noise = [{"status": "error", "meta": {"audio_s": 1, "stages": {"tts": 999}}},
+             {"status": "done", "meta": {"audio_s": 1}},
+             {"status": "done", "meta": None}]
+    model.fit(_jobs(10) + noise)
+    assert model.samples == 10
+    np.testing.assert_allclose(model.coef[True]["tts"], TRUE["tts"], atol=1e-6)
+
+
+def test_negative_coefficients_are_clamped():
+    model = CostModel(refit_s=1e9)
+    jobs = _jobs(20)
+    for j in jobs:
+        m = j["meta"]
+        m["stages"]["upload"] = max(0.0, 5.0 - 0.1 * m["segments"])
+    model.fit(jobs)
+    assert (model.coef[True]["upload"] >= 0).all()
+
+
+def test_estimate_uses_fitted_model():
+    model = CostModel(refit_s=1e9)
+    model.fit(_jobs(30))
+    text = "Бірінші сөйлем осында. Екінші сөйлем де осында."
+    est = model.estimate(text)
+    f = model.features(text)
+    assert est["segments"] == f["segments"] == 2
+    assert f["audio_s"] == pytest.approx(len(text) / 10.0)
+    x = np.array([1.0, f["segments"], f["audio_s"]])
+    expected = sum(float(np.dot(c, x)) for c in TRUE.values())
+    assert est["predicted_s"] == pytest.approx(expected, abs=0.01)
+
+
+def test_short_job_overtakes_but_aging_bounds_it():
+    q = PriorityJobQueue(aging=1.0, step_s=30)
+    long_job = q.key(cost_s=100, arrival=1000)
+    assert q.key(cost_s=5, arrival=1010) < long_job       # 5 s job 10 s later goes first
+    assert q.key(cost_s=5, arrival=1096) > long_job       # …but not after ~95 s of waiting
+
+
+def test_priority_steps_and_aging_weight():
+    q = PriorityJobQueue(aging=1.0, step_s=30)
+    assert q.key(60, priority=2, arrival=0) == q.key(0, arrival=0)
+    slow_aging = PriorityJobQueue(aging=0.5, step_s=30)
+    assert slow_aging.key(10, arrival=100) == 60
+
+
+def test_deadline_becomes_latest_start():
+    q = PriorityJobQueue(aging=1.0, step_s=30)
+    k = q.key(cost_s=20, deadline=1030, arrival=1000)
+    assert k == 1010                                   # deadline − cost < arrival + cost
+    assert q.key(cost_s=20, deadline=5000, arrival=1000) == 1020
+    assert k < q.key(cost_s=1, arrival=1010)           # later arrivals rank behind it
+
+
+def test_queue_pops_lowest_key_first_fifo_on_ties():
+    q = PriorityJobQueue(aging=1.0, step_s=30)
+    q.put("long", cost_s=300)
+    q.put("short", cost_s=1)
+    q.put("urgent", cost_s=300, priority=20)
+    q.put("short2", cost_s=1)
+    order = [q.pop(timeout=1)[0] for _ in range(4)]
+    assert order == ["urgent", "short", "short2", "long"]
+    with pytest.raises(TimeoutError):
+        q.pop(timeout=0.01)
+
+
+def test_parse_deadline():
+    assert parse_deadline(None) is None and parse_deadline("") is None
+    assert parse_deadline(1700000000) == 1700000000.0
+    assert parse_deadline("2023-11-14T22:13:20Z") == 1700000000.0
+    assert parse_deadline("tomorrow") is None
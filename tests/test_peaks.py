@@ -0,0 +1,96 @@
+# tests/test_peaks.py — multi-resolution peaks: levels, file round trip
+import wave
+
+import numpy as np
+import pytest
+
+from utils.peaks import compute_peaks, load_level, peaks_path, write_merged_peaks, write_peaks
+from utils.vad import read_wav
+
+
+def _wav(path, x, sr=16000):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes((np.clip(x, -1, 1) * 32767).astype("<i2").tobytes())
+    return path
+
+
+def _signal(n=10_000, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal(n) * 0.3).astype(np.float32)
+
+
+def test_base_level_is_min_max_per_bucket():
+    x = _signal()
+    (spb, q), *_ = compute_peaks(x, base=64, levels=1, bits=16)
+    assert spb == 64 and q.shape == (-(-len(x) // 64), 2)
+    frames = np.zeros(len(q) * 64, np.float32)
+    frames[:len(x)] = x
+    frames = frames.reshape(-1, 64)
+    expect = lambda v: np.clip(np.round(v * 32767), -32767, 32767)
+    np.testing.assert_array_equal(q[:, 0], expect(frames.min(axis=1)))
+    np.testing.assert_array_equal(q[:, 1], expect(frames.max(axis=1)))
+
+
+@pytest.mark.parametrize("bits", [8, 16])
+def test_coarser_levels_are_exact(bits):
+    levels = compute_peaks(_signal(), base=64, levels=4, bits=bits)
+    assert [spb for spb, _ in levels] == [64, 256, 1024, 4096]
+    for (_, fine), (_, coarse) in zip(levels, levels[1:]):
+        assert len(coarse) == -(-len(fine) // 4)
+        for i, (lo, hi) in enumerate(coarse):
+            group = fine[4 * i:4 * i + 4]
+            assert lo == group[:, 0].min() and hi == group[:, 1].max()
+
+
+def test_levels_stop_at_one_bucket():
+    levels = compute_peaks(_signal(100), base=64, levels=8)
+    assert [len(q) for _, q in levels] == [2, 1]
+
+
+def test_quantisation_range():
+    x = np.array([-1.0, 1.0, 0.5], np.float32)
+    (_, q8), = compute_peaks(x, base=4, levels=1, bits=8)
+    (_, q16), = compute_peaks(x, base=4, levels=1, bits=16)
+    assert q8.dtype == np.int8 and q8.tolist() == [[-127, 127]]
+    assert q16.tolist() == [[-32767, 32767]]
+
+
+def test_file_round_trip_and_level_choice(tmp_path):
+    x = _signal(16000)
+    wav = _wav(tmp_path / "a.wav", x)
+    out = write_peaks(wav)
+    assert out == peaks_path(wav) == tmp_path / "a.peaks"
+    levels = compute_peaks(read_wav(wav)[0])
+
+    finest = load_level(out, 10 ** 9)                 # no level has that many → finest
+    assert finest["sample_rate"] == 16000 and finest["duration"] == pytest.approx(1.0)
+    assert finest["samples_per_bucket"] == levels[0][0]
+    assert finest["data"] == levels[0][1].reshape(-1).tolist()
+    assert load_level(out)["samples_per_bucket"] == levels[-1][0]
+
+    # coarsest level that still has ≥ pixels buckets
+    n_buckets = [len(q) for _, q in levels]
+    pixels = n_buckets[2]
+    picked = load_level(out, pixels)
+    assert picked["samples_per_bucket"] == levels[2][0]
+    assert picked["data"] == levels[2][1].reshape(-1).tolist()
+    assert load_level(out, pixels + 1)["samples_per_bucket"] == levels[1][0]
+
+
+def test_merged_peaks_cover_all_segments(tmp_path):
+    a, b = _signal(3000, 1), _signal(5000, 2)
+    wavs = [_wav(tmp_path / "a.wav", a), _wav(tmp_path / "b.wav", b)]
+    out = write_merged_peaks(wavs, tmp_path / "merged.mp4")
+    assert out == tmp_path / "merged.peaks"
+    assert load_level(out)["duration"] == pytest.approx(8000 / 16000)
+
+
+def test_bad_file_is_rejected(tmp_path):
+    p = tmp_path / "x.peaks"
+    p.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        load_level(p)
+    assert write_peaks(tmp_path / "missing.wav") is None
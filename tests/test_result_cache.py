@@ -0,0 +1,126 @@
+# tests/test_result_cache.py — job keys and single-flight get_or_run
+import threading
+import time
+import unicodedata
+
+import pytest
+
+rc = pytest.importorskip("utils.result_cache", reason="needs the TTS dependencies (edge_tts, pydub)")
+from utils.job_store import JobStore  # noqa: E402
+
+BASE = dict(gender="m", lang="kk", use_avatar=True, merge=True)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr(rc, "get_store", lambda: store)
+    monkeypatch.setattr(rc, "version_tag", lambda: "test")
+    yield rc.ResultCache(enabled=True, ttl=None)
+    store.close()
+
+
+def test_key_ignores_whitespace_and_normal_form():
+    k = rc.job_key("Қайырлы  таң", **BASE)
+    assert rc.job_key("  Қайырлы\n\tтаң ", **BASE) == k
+    assert rc.job_key(unicodedata.normalize("NFD", "Қайырлы таң"), **BASE) == k  # й = и + U+0306
+    assert rc.job_key("Қайырлы таң", **{**BASE, "gender": "M", "lang": "KK"}) == k
+
+
+def test_key_keeps_case_and_output_options():
+    k = rc.job_key("Сәлем әлем", **BASE)
+    assert rc.job_key("сәлем әлем", **BASE) != k
+    for change in ({"gender": "f"}, {"lang": "ru"}, {"use_avatar": False}, {"merge": False}):
+        assert rc.job_key("Сәлем әлем", **{**BASE, **change}) != k
+    assert rc.job_key("x", **BASE, templates="3,7,1") != rc.job_key("x", **BASE, templates="hash")
+
+
+def test_key_by_quality_and_tts():
+    k = rc.job_key("x", **BASE, quality="draft")
+    assert k != rc.job_key("x", **BASE, quality="final")
+    assert rc.job_key("x", **BASE, tts="vits") != rc.job_key("x", **BASE, tts="edge")
+    assert rc.job_key("x", **BASE, tts=" EDGE ") == rc.job_key("x", **BASE, tts="edge")
+    with pytest.raises(ValueError):
+        rc.job_key("x", **BASE, quality="ultra")
+
+
+def test_miss_then_hit(cache):
+    calls = []
+    fn = lambda: calls.append(1) or {"merged": "/x.mp4"}
+    assert cache.get_or_run("k", fn) == ({"merged": "/x.mp4"}, False)
+    assert cache.get_or_run("k", fn) == ({"merged": "/x.mp4"}, True)
+    assert len(calls) == 1 and (cache.hits, cache.misses) == (1, 1)
+
+
+def test_uncacheable_results_are_not_stored(cache):
+    cache.get_or_run("k", lambda: {"error": "x"}, cacheable=lambda r: "error" not in r)
+    assert cache.get("k") is None
+
+
+def test_concurrent_calls_share_one_run(cache):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def render():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"merged": "/x.mp4"}
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_run("k", render)))
+    owner.start()
+    assert started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(cache.get_or_run("k", render)))
+               for _ in range(4)]
+    for t in waiters:
+        t.start()
+    deadline = time.monotonic() + 5
+    while cache.coalesced < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in [owner, *waiters]:
+        t.join(5)
+    assert len(calls) == 1 and cache.coalesced == 4
+    assert sorted(hit for _, hit in results) == [False, True, True, True, True]
+    assert all(r == {"merged": "/x.mp4"} for r, _ in results)
+    assert cache.stats()["inflight"] == 0
+
+
+def test_concurrent_callers_see_the_exception(cache):
+    started, release = threading.Event(), threading.Event()
+
+    def render():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_run("k", render)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    owner = threading.Thread(target=call)
+    owner.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=call)
+    waiter.start()
+    deadline = time.monotonic() + 5
+    while cache.coalesced < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert errors == ["boom", "boom"]
+    assert cache.get("k") is None and not cache._inflight
+
+
+def test_disabled_cache_always_runs():
+    cache = rc.ResultCache(enabled=False)
+    calls = []
+    for _ in range(2):
+        assert cache.get_or_run("k", lambda: calls.append(1) or {})[1] is False
+    assert len(calls) == 2
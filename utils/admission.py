@@ -0,0 +1,187 @@
+# utils/admission.py — Capacity model, admission control, dynamic prefetch
+# -----------------------------------------------------------------------
+# Under a burst the service and the consumers used to accept everything
+# and then time out. A Capacity tracks, per entry point, the jobs it holds:
+#
+#   queued   — accepted, waiting for a worker slot (predicted cost, segments)
+#   running  — holding a slot since `started`
+#
+# and turns that into
+#
+#   estimated_wait_s = (Σ remaining running cost + Σ queued cost) / slots
+#
+# where costs come from utils.cost.COST_MODEL and are scaled by an EWMA of
+# actual/predicted durations of finished jobs (the model's running bias).
+#
+# Admission: a new job is rejected with a retry hint when
+#   estimated_wait_s + its own cost > ADMISSION_SLA_S
+# (service.py → 429 + Retry-After). admit_and_enter() checks and registers
+# the job in one step, so concurrent requests see each other's work.
+# The RabbitMQ consumer cannot reject, so it applies backpressure instead:
+# prefetch() says how many unacked messages to hold so that the work held
+# locally stays within the SLA; the rest stays in the broker for other
+# consumers. Only with an SLA: without one the consumer keeps its
+# configured RMQ_PREFETCH, which is also the floor.
+#
+# Every Capacity registers itself in CAPACITIES; /capacity reports them all.
+#
+# Env:
+#   ADMISSION_SLA_S=0     target completion time in seconds (0 = admit everything)
+#   RMQ_PREFETCH_MAX=32   upper bound for the dynamic prefetch
+
+from __future__ import annotations
+
+import os
+import math
+import time
+import threading
+import contextlib
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+ADMISSION_SLA_S  = float(os.getenv("ADMISSION_SLA_S", 0))
+PREFETCH_MAX     = int(os.getenv("RMQ_PREFETCH_MAX", 32))
+EWMA_ALPHA       = 0.2
+
+__all__ = ["Capacity", "Ticket", "CAPACITIES", "snapshot_all", "retry_after_header"]
+
+CAPACITIES: Dict[str, "Capacity"] = {}
+
+
+class Ticket:
+    """One job's place in a Capacity: queued on creation, running after start()."""
+
+    def __init__(self, cap: "Capacity", predicted_s: float, segments: int):
+        self.cap = cap
+        self.predicted_s = predicted_s
+        self.segments = segments
+        self.created = time.monotonic()
+        self.started: Optional[float] = None
+
+    def start(self) -> None:
+        with self.cap._lock:
+            self.started = time.monotonic()
+
+
+class Capacity:
+    """Queued/running work of one entry point (HTTP service, AMQP consumer)."""
+
+    def __init__(self, name: str, slots: int, sla_s: float = ADMISSION_SLA_S):
+        self.name = name
+        self.slots = max(1, slots)
+        self.sla_s = sla_s
+        self._lock = threading.Lock()
+        self._tickets: Dict[int, Ticket] = {}
+        self.bias = 1.0                     # EWMA of actual / predicted
+        self.avg_cost_s = 0.0               # EWMA of predicted cost per job
+        self.admitted = self.rejected = self.finished = 0
+        CAPACITIES[name] = self
+
+    # ------------------------------------------------------------------
+    # model
+    # ------------------------------------------------------------------
+
+    def _remaining_locked(self, now: float, running_only: bool = False) -> float:
+        total = 0.0
+        for t in self._tickets.values():
+            cost = t.predicted_s * self.bias
+            if t.started is not None:
+                total += max(0.0, cost - (now - t.started))
+            elif not running_only:
+                total += cost
+        return total
+
+    def estimated_wait(self) -> float:
+        with self._lock:
+            return self._remaining_locked(time.monotonic()) / self.slots
+
+    def admit_and_enter(self, predicted_s: float, segments: int = 0,
+                        enforce: bool = True) -> Tuple[Optional[Ticket], Optional[float]]:
+        """(ticket, None) if the job fits the SLA, else (None, suggested Retry-After seconds).
+
+        The check and the registration happen under one lock, so a burst of
+        concurrent requests cannot all see the same backlog and all get in.
+        enforce=False always admits (AMQP: the message is already delivered).
+        """
+        ticket = Ticket(self, predicted_s, segments)
+        with self._lock:
+            done_in = self._remaining_locked(time.monotonic()) / self.slots + predicted_s * self.bias
+            if enforce and self.sla_s and done_in > self.sla_s:
+                self.rejected += 1
+                return None, max(1.0, done_in - self.sla_s)
+            self.admitted += 1
+            self._add_locked(ticket)
+        return ticket, None
+
+    # ------------------------------------------------------------------
+    # tracking
+    # ------------------------------------------------------------------
+
+    def enter(self, predicted_s: float, segments: int = 0) -> Ticket:
+        """Register an accepted job (queued until ticket.start())."""
+        ticket = Ticket(self, predicted_s, segments)
+        with self._lock:
+            self._add_locked(ticket)
+        return ticket
+
+    def _add_locked(self, ticket: Ticket) -> None:
+        self._tickets[id(ticket)] = ticket
+        self.avg_cost_s = ticket.predicted_s if not self.avg_cost_s \
+            else (1 - EWMA_ALPHA) * self.avg_cost_s + EWMA_ALPHA * ticket.predicted_s
+
+    def leave(self, ticket: Ticket) -> None:
+        """Job finished (or failed); updates the actual/predicted bias."""
+        with self._lock:
+            if self._tickets.pop(id(ticket), None) is None:
+                return
+            self.finished += 1
+            if ticket.started is not None and ticket.predicted_s > 0:
+                ratio = (time.monotonic() - ticket.started) / ticket.predicted_s
+                self.bias = (1 - EWMA_ALPHA) * self.bias + EWMA_ALPHA * min(ratio, 10.0)
+
+    @contextlib.contextmanager
+    def track(self, predicted_s: float, segments: int = 0) -> Iterator[Ticket]:
+        """enter() … leave() around a job; call ticket.start() when it gets a slot."""
+        ticket = self.enter(predicted_s, segments)
+        try:
+            yield ticket
+        finally:
+            self.leave(ticket)
+
+    def prefetch(self, floor: int = 1, ceiling: int = PREFETCH_MAX) -> int:
+        """Unacked messages worth holding: one per slot + the queued jobs that still
+        finish within the SLA after the running ones (one extra per slot without SLA)."""
+        with self._lock:
+            running = self._remaining_locked(time.monotonic(), running_only=True)
+        if not self.sla_s or not self.avg_cost_s:
+            extra = self.slots
+        else:
+            extra = int(max(0.0, self.sla_s * self.slots - running) // max(self.avg_cost_s * self.bias, 1e-3))
+        return max(floor, min(ceiling, self.slots + extra))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            tickets = list(self._tickets.values())
+            remaining = self._remaining_locked(now)
+        running = [t for t in tickets if t.started is not None]
+        queued = [t for t in tickets if t.started is None]
+        return {
+            "slots": self.slots,
+            "busy_slots": len(running),
+            "free_slots": max(0, self.slots - len(running)),
+            "queued_jobs": len(queued),
+            "queued_segments": sum(t.segments for t in queued),
+            "running_segments": sum(t.segments for t in running),
+            "estimated_wait_s": round(remaining / self.slots, 1),
+            "sla_s": self.sla_s or None,
+            "model_bias": round(self.bias, 3),
+            "admitted": self.admitted, "rejected": self.rejected, "finished": self.finished,
+        }
+
+
+def snapshot_all() -> Dict[str, Dict[str, Any]]:
+    return {name: cap.snapshot() for name, cap in CAPACITIES.items()}
+
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(int(math.ceil(seconds)))}
@@ -0,0 +1,212 @@
+# utils/affinity.py — Template-affinity routing of jobs across worker nodes
+# -------------------------------------------------------------------------
+# With several worker nodes every node used to warm its template / face /
+# clip caches for all {gender}_{action_id} templates. With AFFINITY_NODES
+# set, the templates are spread over the live nodes by consistent hashing:
+#
+#   ring      AFFINITY_VNODES points per node on a 64-bit ring (blake2b);
+#             template "m_7" belongs to the first node clockwise of its hash,
+#             so a node joining or failing moves only the templates on its arcs
+#   segments  a node draws action IDs only from the templates it owns
+#             (local_actions(gender) → classify_sentence_structure(allowed=…)),
+#             so it renders, caches and keeps warm only its share
+#   jobs      route(payload): a job's key is one template of its gender, stable
+#             per job (content_id / page_id / text) → its owner on the ring,
+#             with bounded load: a node holding more than AFFINITY_LOAD_FACTOR ×
+#             the average is skipped for the next one clockwise
+#
+# Transport: every node consumes the shared input queue and its own
+# "<RMQ_QUEUE_IN>.node.<AFFINITY_NODE_ID>". A job taken from the shared queue
+# that belongs to another node is forwarded to that node's queue
+# (payload["affinity_hops"] + 1; after AFFINITY_MAX_HOPS it runs wherever it
+# is). Membership and load come from passive declares of the node queues
+# (consumers > 0 = alive, messages = load), refreshed every AFFINITY_REFRESH_S.
+# Node queues dead-letter messages older than AFFINITY_TTL_S back to the
+# shared queue, so work parked on a failed node is picked up elsewhere.
+#
+# Env:
+#   AFFINITY_NODES=            comma-separated node ids (empty / one node = off)
+#   AFFINITY_NODE_ID=          this node (default: host name)
+#   AFFINITY_VNODES=64
+#   AFFINITY_LOAD_FACTOR=1.25
+#   AFFINITY_REFRESH_S=10
+#   AFFINITY_MAX_HOPS=1
+#   AFFINITY_TTL_S=300
+
+from __future__ import annotations
+
+import os
+import math
+import time
+import bisect
+import socket
+import hashlib
+import logging
+import threading
+import concurrent.futures as futures
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence
+
+from utils.classify import TOTAL_ACTIONS
+
+AFFINITY_NODES       = [n.strip() for n in os.getenv("AFFINITY_NODES", "").split(",") if n.strip()]
+AFFINITY_NODE_ID     = os.getenv("AFFINITY_NODE_ID", "").strip() or socket.gethostname()
+AFFINITY_VNODES      = int(os.getenv("AFFINITY_VNODES", 64))
+AFFINITY_LOAD_FACTOR = float(os.getenv("AFFINITY_LOAD_FACTOR", 1.25))
+AFFINITY_REFRESH_S   = float(os.getenv("AFFINITY_REFRESH_S", 10))
+AFFINITY_MAX_HOPS    = int(os.getenv("AFFINITY_MAX_HOPS", 1))
+AFFINITY_TTL_S       = float(os.getenv("AFFINITY_TTL_S", 300))
+
+__all__ = ["HashRing", "AffinityRouter", "AFFINITY", "template_key"]
+
+
+def _h(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def template_key(gender: str, action_id: int) -> str:
+    """Same name as the template file static/video_templates/{gender}_{action_id}.mp4."""
+    return f"{gender}_{action_id}"
+
+
+class HashRing:
+    """Consistent hashing with virtual nodes; owner_bounded() adds bounded loads."""
+
+    def __init__(self, nodes: Sequence[str], vnodes: int = AFFINITY_VNODES):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_h(f"{n}#{i}"), n) for n in self.nodes for i in range(vnodes))
+        self._hashes = [p for p, _ in points]
+        self._owners = [n for _, n in points]
+
+    def walk(self, key: str) -> Iterator[str]:
+        """Distinct nodes clockwise from the key's position."""
+        if not self._hashes:
+            return
+        start = bisect.bisect(self._hashes, _h(key))
+        seen = set()
+        for i in range(len(self._hashes)):
+            node = self._owners[(start + i) % len(self._hashes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+    def owner(self, key: str) -> Optional[str]:
+        return next(self.walk(key), None)
+
+    def owner_bounded(self, key: str, loads: Mapping[str, float],
+                      factor: float = AFFINITY_LOAD_FACTOR) -> Optional[str]:
+        """First node clockwise whose load is below ⌈factor × (total + 1) / nodes⌉."""
+        if not self.nodes:
+            return None
+        cap = math.ceil(factor * (sum(loads.get(n, 0) for n in self.nodes) + 1) / len(self.nodes))
+        for node in self.walk(key):
+            if loads.get(node, 0) < cap:
+                return node
+        return self.owner(key)
+
+
+class AffinityRouter:
+    """Membership, ring and routing decisions of one worker node."""
+
+    def __init__(self, node_id: str = AFFINITY_NODE_ID, nodes: Sequence[str] = AFFINITY_NODES,
+                 queue_in: str = "", refresh_s: float = AFFINITY_REFRESH_S):
+        self.node_id = node_id
+        self.nodes = sorted(set(nodes) | ({node_id} if nodes else set()))
+        self.queue_in = queue_in
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._alive = {node_id}
+        self._ring = HashRing(sorted(self._alive))
+        self._load: Dict[str, float] = {}
+        self._assigned: Dict[str, int] = {}          # jobs sent to a node since its last probe
+        self._refreshed = 0.0
+        self.local = self.routed = self.hops_exhausted = self.rebalances = 0
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.nodes) > 1
+
+    def queue(self, node: Optional[str] = None) -> str:
+        return f"{self.queue_in}.node.{node or self.node_id}"
+
+    def queue_args(self) -> Dict[str, Any]:
+        """Arguments of a node queue: stale messages return to the shared queue."""
+        return {"x-message-ttl": int(AFFINITY_TTL_S * 1000), "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": self.queue_in}
+
+    # ------------------------------------------------------------------
+    # membership
+    # ------------------------------------------------------------------
+
+    def refresh(self, probe: Callable[[str], futures.Future]) -> None:
+        """Probe the node queues if the view is older than refresh_s. probe(queue) →
+        Future[(consumers, messages)]; results are applied when they arrive."""
+        now = time.monotonic()
+        if not self.enabled or now - self._refreshed < self.refresh_s:
+            return
+        self._refreshed = now
+        for node in self.nodes:
+            try:
+                probe(self.queue(node)).add_done_callback(lambda f, n=node: self._update(n, f))
+            except Exception as e:
+                logging.warning("[AFFINITY] probe %s: %s", node, e)
+
+    def _update(self, node: str, fut: futures.Future) -> None:
+        try:
+            consumers, messages = fut.result()
+        except Exception as e:
+            logging.warning("[AFFINITY] probe %s failed: %s", node, e)
+            return
+        with self._lock:
+            self._load[node] = messages
+            self._assigned[node] = 0
+            alive = consumers > 0 or node == self.node_id
+            if alive == (node in self._alive):
+                return
+            (self._alive.add if alive else self._alive.discard)(node)
+            self._ring = HashRing(sorted(self._alive))
+            self.rebalances += 1
+        logging.warning("[AFFINITY] node %s %s → ring %s", node, "joined" if alive else "left",
+                        sorted(self._alive))
+
+    # ------------------------------------------------------------------
+    # routing
+    # ------------------------------------------------------------------
+
+    def local_actions(self, gender: str) -> Optional[List[int]]:
+        """Action IDs whose {gender}_{id} template this node owns (None = all)."""
+        if not self.enabled:
+            return None
+        ring = self._ring
+        owned = [a for a in range(1, TOTAL_ACTIONS + 1) if ring.owner(template_key(gender, a)) == self.node_id]
+        return owned or None
+
+    def route(self, payload: Dict[str, Any]) -> Optional[str]:
+        """Queue of the node that should run this job, or None to run it here."""
+        if not self.enabled:
+            return None
+        if int(payload.get("affinity_hops", 0)) >= AFFINITY_MAX_HOPS:
+            self.hops_exhausted += 1
+            return None
+        seed = str(payload.get("content_id") or payload.get("page_id") or payload.get("text", ""))
+        key = template_key(str(payload.get("gender", "m")), _h(seed) % TOTAL_ACTIONS + 1)
+        with self._lock:
+            loads = {n: self._load.get(n, 0) + self._assigned.get(n, 0) for n in self._alive}
+            node = self._ring.owner_bounded(key, loads) or self.node_id
+            self._assigned[node] = self._assigned.get(node, 0) + 1
+            if node == self.node_id:
+                self.local += 1
+                return None
+            self.routed += 1
+        return self.queue(node)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"node": self.node_id, "enabled": self.enabled, "alive": sorted(self._alive),
+                    "load": dict(self._load), "local": self.local, "routed": self.routed,
+                    "hops_exhausted": self.hops_exhausted, "rebalances": self.rebalances,
+                    "templates": {g: self.local_actions(g) for g in ("m", "f")} if self.enabled else None}
+
+
+AFFINITY = AffinityRouter(queue_in=os.getenv("RMQ_QUEUE_IN", "avatar_generated_tasks"))
@@ -0,0 +1,326 @@
+# utils/amqp_async.py — asyncio AMQP client on its own I/O thread
+# --------------------------------------------------------------
+# The BlockingConnection consumer runs its I/O only inside start_consuming();
+# worker threads reach it through add_callback_threadsafe closures, every
+# publish re-declares its queue, and a stalled I/O loop during a long render
+# misses heartbeats → the broker drops the connection → work is redelivered.
+#
+# AsyncAmqp keeps one pika AsyncioConnection on a dedicated event-loop
+# thread that never runs jobs, so heartbeats are always answered:
+#
+#   worker threads ──publish()/ack()/set_prefetch()──► call_soon_threadsafe ──► I/O loop
+#   I/O loop ──on_message(client, tag, props, body)──► caller (must return fast)
+#
+# • Queue declarations are cached per connection: the input queue is
+#   declared once with its arguments, other queues are declared passively
+#   once (created durable on a fresh channel if missing, as _declare_passive_or_create).
+# • The publish channel runs in confirm mode; publish() returns a
+#   concurrent Future resolved by the broker's ack (exception on nack or
+#   connection loss), so a worker can ack its input only after the result
+#   is safely stored.
+# • Delivery tags are tagged with the connection generation; acks for
+#   deliveries of a dropped connection are discarded (the broker redelivers).
+# • Reconnects with a fixed delay; pending confirms fail on disconnect.
+# • pause_intake(True) cancels the consumer (deliveries already received stay
+#   unacked and are worked off); False consumes again, also after a reconnect.
+# • extra_queues {name: arguments} are declared and consumed on the same
+#   channel as the input queue (a worker node's own queue, utils/affinity.py);
+#   probe(queue) → Future[(consumers, messages)] via a passive declare.
+
+from __future__ import annotations
+
+import json
+import asyncio
+import logging
+import threading
+import concurrent.futures as futures
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+RECONNECT_DELAY = 5.0
+
+__all__ = ["AsyncAmqp"]
+
+Tag = Tuple[int, int]          # (connection generation, delivery tag)
+
+
+class AsyncAmqp:
+    def __init__(self, params: pika.ConnectionParameters, queue_in: str,
+                 on_message: Callable[["AsyncAmqp", Tag, Any, bytes], None],
+                 prefetch: int = 1, queue_in_args: Optional[Dict[str, Any]] = None,
+                 extra_queues: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.params = params
+        self.queue_in = queue_in
+        self.queue_in_args = queue_in_args or None
+        self.extra_queues = dict(extra_queues or {})
+        self.on_message = on_message
+        self.prefetch = prefetch
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="amqp-io", daemon=True)
+        self._conn: Optional[AsyncioConnection] = None
+        self._consume_ch = None
+        self._publish_ch = None
+        self._gen = 0
+        self._declared: Set[str] = set()
+        self._declaring: Dict[str, list] = {}
+        self._confirm_seq = 0
+        self._confirms: Dict[int, futures.Future] = {}
+        self._stopping = False
+        self._consumer_tags: Dict[str, str] = {}
+        self.paused = False
+        self.ready = threading.Event()
+        self.published = self.confirmed = self.nacked = self.stale_acks = 0
+
+    # ------------------------------------------------------------------
+    # thread-safe API
+    # ------------------------------------------------------------------
+
+    def start(self) -> "AsyncAmqp":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopping = True
+        self.loop.call_soon_threadsafe(self._close)
+
+    def publish(self, routing_key: str, body: Dict[str, Any], priority: Optional[int] = None) -> futures.Future:
+        """Publish persistently; the future resolves when the broker confirms."""
+        fut: futures.Future = futures.Future()
+        self.loop.call_soon_threadsafe(self._publish, routing_key, body, priority, fut)
+        return fut
+
+    def ack(self, tag: Tag) -> None:
+        self.loop.call_soon_threadsafe(self._ack, tag)
+
+    def set_prefetch(self, n: int) -> None:
+        self.prefetch = n
+        self.loop.call_soon_threadsafe(self._qos)
+
+    def pause_intake(self, paused: bool) -> None:
+        if paused != self.paused:
+            self.paused = paused
+            self.loop.call_soon_threadsafe(self._intake)
+
+    def probe(self, queue: str) -> futures.Future:
+        """(consumer count, message count) of a queue; (0, 0) if it does not exist."""
+        fut: futures.Future = futures.Future()
+        self.loop.call_soon_threadsafe(self._probe, queue, fut)
+        return fut
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """Wait for the I/O thread to finish after stop()."""
+        self._thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    # I/O loop (everything below runs on self.loop)
+    # ------------------------------------------------------------------
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self._connect()
+        self.loop.run_forever()
+
+    def _connect(self) -> None:
+        self._gen += 1
+        self._declared.clear()
+        self._conn = AsyncioConnection(
+            self.params, on_open_callback=self._on_open,
+            on_open_error_callback=self._on_open_error,
+            on_close_callback=self._on_closed, custom_ioloop=self.loop,
+        )
+
+    def _reconnect_later(self) -> None:
+        if not self._stopping:
+            self.loop.call_later(RECONNECT_DELAY, self._connect)
+
+    def _on_open_error(self, _conn, err) -> None:
+        logging.warning("[AMQP] connect failed: %s – retrying in %.0fs", err, RECONNECT_DELAY)
+        self._reconnect_later()
+
+    def _on_closed(self, _conn, reason) -> None:
+        self.ready.clear()
+        self._consume_ch = self._publish_ch = None
+        self._consumer_tags.clear()
+        for fut in self._confirms.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError(f"connection closed before confirm: {reason}"))
+        self._confirms.clear()
+        for waiters in self._declaring.values():
+            for w in waiters:
+                w(False)
+        self._declaring.clear()
+        if self._stopping:
+            self.loop.stop()
+            return
+        logging.warning("[AMQP] connection closed: %s – reconnecting in %.0fs", reason, RECONNECT_DELAY)
+        self._reconnect_later()
+
+    def _close(self) -> None:
+        if self._conn is not None and not self._conn.is_closed:
+            self._conn.close()
+        else:
+            self.loop.stop()
+
+    def _on_open(self, conn) -> None:
+        conn.channel(on_open_callback=self._on_publish_channel)
+        conn.channel(on_open_callback=self._on_consume_channel)
+
+    def _on_publish_channel(self, ch) -> None:
+        self._publish_ch = ch
+        self._confirm_seq = 0
+        ch.add_on_close_callback(self._on_channel_closed)
+        ch.confirm_delivery(ack_nack_callback=self._on_confirm)
+
+    def _on_consume_channel(self, ch) -> None:
+        self._consume_ch = ch
+        ch.add_on_close_callback(self._on_channel_closed)
+        ch.queue_declare(self.queue_in, durable=True, arguments=self.queue_in_args,
+                         callback=lambda _f: self._declare_extra(ch, list(self.extra_queues)))
+
+    def _declare_extra(self, ch, pending: list) -> None:
+        if not pending:
+            self._on_input_declared(ch)
+            return
+        name = pending.pop(0)
+        ch.queue_declare(name, durable=True, arguments=self.extra_queues[name] or None,
+                         callback=lambda _f: self._declare_extra(ch, pending))
+
+    def _on_input_declared(self, ch) -> None:
+        self._declared.update([self.queue_in, *self.extra_queues])
+        ch.basic_qos(prefetch_count=self.prefetch, callback=lambda _f: self._intake())
+        self.ready.set()
+        logging.info("[AMQP] consuming %s (prefetch=%d)", ", ".join([self.queue_in, *self.extra_queues]),
+                     self.prefetch)
+
+    def _on_channel_closed(self, ch, reason) -> None:
+        # a channel error (e.g. 406 on declare) closes only that channel; start over cleanly
+        if self._conn is not None and self._conn.is_open and not self._stopping:
+            logging.warning("[AMQP] channel %s closed: %s", ch.channel_number, reason)
+            self._conn.close()
+
+    def _on_deliver(self, _ch, method, props, body) -> None:
+        self.on_message(self, (self._gen, method.delivery_tag), props, body)
+
+    def _ack(self, tag: Tag) -> None:
+        gen, delivery_tag = tag
+        if gen != self._gen or self._consume_ch is None or not self._consume_ch.is_open:
+            self.stale_acks += 1          # delivery of a dropped connection: broker redelivers it
+            return
+        self._consume_ch.basic_ack(delivery_tag)
+
+    def _intake(self) -> None:
+        ch = self._consume_ch
+        if ch is None or not ch.is_open:
+            return
+        for queue in (self.queue_in, *self.extra_queues):
+            tag = self._consumer_tags.get(queue)
+            if self.paused and tag:
+                ch.basic_cancel(tag)
+                del self._consumer_tags[queue]
+            elif not self.paused and not tag:
+                self._consumer_tags[queue] = ch.basic_consume(queue, self._on_deliver)
+
+    def _probe(self, queue: str, fut: futures.Future) -> None:
+        if self._conn is None or not self._conn.is_open:
+            fut.set_exception(ConnectionError("AMQP connection is not open"))
+            return
+
+        def declared(c, frame) -> None:
+            if not fut.done():
+                fut.set_result((frame.method.consumer_count, frame.method.message_count))
+            c.close()
+
+        def opened(c) -> None:
+            # 404 closes the channel: the queue does not exist
+            c.add_on_close_callback(lambda _ch, _reason: fut.done() or fut.set_result((0, 0)))
+            c.queue_declare(queue, passive=True, callback=lambda f: declared(c, f))
+
+        self._conn.channel(on_open_callback=opened)
+
+    def _qos(self) -> None:
+        if self._consume_ch is not None and self._consume_ch.is_open:
+            self._consume_ch.basic_qos(prefetch_count=self.prefetch)
+
+    # ---------------- declarations (cached) ----------------
+
+    def _ensure_declared(self, queue: str, then: Callable[[bool], None]) -> None:
+        if queue in self._declared:
+            then(True)
+            return
+        waiters = self._declaring.setdefault(queue, [])
+        waiters.append(then)
+        if len(waiters) > 1:
+            return                        # a declaration is already in flight
+
+        def done(ok: bool) -> None:
+            if ok:
+                self._declared.add(queue)
+            for w in self._declaring.pop(queue, []):
+                w(ok)
+
+        def create(_ch=None, _reason=None) -> None:
+            # passive declare failed (404 closes its channel) → create on a fresh one
+            if self._conn is None or not self._conn.is_open:
+                return
+
+            def declare(c) -> None:
+                c.add_on_close_callback(lambda ch, reason: queue not in self._declared and done(False))
+                c.queue_declare(queue, durable=True, callback=lambda _f: (done(True), c.close()))
+
+            self._conn.channel(on_open_callback=declare)
+
+        def passive(c) -> None:
+            c.add_on_close_callback(lambda ch, reason: queue not in self._declared and create())
+            c.queue_declare(queue, passive=True, callback=lambda _f: (done(True), c.close()))
+
+        self._conn.channel(on_open_callback=passive)
+
+    # ---------------- publishing with confirms ----------------
+
+    def _publish(self, routing_key: str, body: Dict[str, Any], priority: Optional[int],
+                 fut: futures.Future) -> None:
+        if self._publish_ch is None or not self._publish_ch.is_open:
+            fut.set_exception(ConnectionError("AMQP publish channel is not open"))
+            return
+
+        def send(ok: bool) -> None:
+            if not ok:
+                fut.set_exception(ConnectionError(f"cannot declare queue {routing_key}"))
+                return
+            if self._publish_ch is None or not self._publish_ch.is_open:
+                fut.set_exception(ConnectionError("AMQP publish channel is not open"))
+                return
+            self._publish_ch.basic_publish(
+                exchange="", routing_key=routing_key, body=json.dumps(body).encode(),
+                properties=pika.BasicProperties(content_type="application/json",
+                                                delivery_mode=2, priority=priority),
+            )
+            self._confirm_seq += 1
+            self._confirms[self._confirm_seq] = fut
+            self.published += 1
+
+        self._ensure_declared(routing_key, send)
+
+    def _on_confirm(self, frame) -> None:
+        method = frame.method
+        nack = isinstance(method, pika.spec.Basic.Nack)
+        tags = [t for t in self._confirms if t <= method.delivery_tag] if method.multiple \
+            else [method.delivery_tag]
+        for t in tags:
+            fut = self._confirms.pop(t, None)
+            if fut is None or fut.done():
+                continue
+            if nack:
+                self.nacked += 1
+                fut.set_exception(RuntimeError(f"broker nacked publish #{t}"))
+            else:
+                self.confirmed += 1
+                fut.set_result(True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"published": self.published, "confirmed": self.confirmed, "nacked": self.nacked,
+                "pending_confirms": len(self._confirms), "stale_acks": self.stale_acks,
+                "connection": self._gen}
@@ -3,23 +3,34 @@
 # Provides an `IDLogger` to collect per‑segment metadata and stream it to
 # a JSON‑lines file (one JSON object per line). Front‑end can tail or fetch the
 # file to monitor progress.
+#
+# Entries are buffered and written in batches (see utils.job_store); the
+# pipelines call flush() at each stage boundary and when a job ends (also on
+# failure), so a tail sees every stage's entries as soon as the stage is done.
+# When a JobStore and job_id are given they are also recorded there (kind="ids").
 
 from __future__ import annotations
 
-import json
+import uuid
 import datetime
 from pathlib import Path
 from typing import Optional, Dict, Any, List
 
+from utils.job_store import JobStore, JSONLBuffer
+
 
 class IDLogger:
     """Log segment‑level IDs to a JSONL file (no external dependencies)."""
 
-    def __init__(self, output_dir: Path):
+    def __init__(self, output_dir: Path, job_id: Optional[str] = None,
+                 store: Optional[JobStore] = None):
         timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        self._path = output_dir / f"session_{timestamp}_ids.jsonl"
+        suffix = (job_id or uuid.uuid4().hex)[:8]          # unique per session
+        self._path = output_dir / f"session_{timestamp}_{suffix}_ids.jsonl"
         output_dir.mkdir(parents=True, exist_ok=True)
-        self._entries: List[Dict[str, Any]] = []
+        self._buf = JSONLBuffer(self._path)
+        self._job_id = job_id
+        self._store = store if job_id else None
 
     # ------------------------------------------------------------------
     # Public API
@@ -36,7 +47,7 @@ class IDLogger:
         target_voice_id: Optional[int] = None,
         after_voice_id: Optional[int] = None,
     ) -> None:
-        """Append a new entry and write it immediately to disk."""
+        """Append a new entry (written to disk with the next batch)."""
         entry: Dict[str, Any] = {
             "text_clip_id": text_clip_id,
             "orig_voice_id": orig_voice_id,
@@ -46,16 +57,20 @@ class IDLogger:
             "after_voice_id": after_voice_id,
             "voice_gender_id": voice_gender_id,
         }
-        self._entries.append(entry)
-        with self._path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._buf.append(entry)
+        if self._store:
+            self._store.add_event(self._job_id, "ids", entry)
+
+    def flush(self) -> None:
+        self._buf.flush()
 
     # ------------------------------------------------------------------
     # Convenience getters
     # ------------------------------------------------------------------
 
     def entries(self) -> List[Dict[str, Any]]:
-        return self._entries
+        return self._buf.read()
 
     def file_path(self) -> str:
+        self._buf.flush()
         return str(self._path)
@@ -0,0 +1,327 @@
+# utils/bulk.py — Bulk jobs: many texts (a whole course) in one submission
+# -----------------------------------------------------------------------
+# The CMS used to send one message / one /lipsync call per page, and every
+# page ran its own NLP, TTS and lip-sync in isolation. run_bulk() takes all
+# items at once:
+#
+#   1. cache     items whose job_key is in RESULT_CACHE are emitted at once
+#   2. NLP       one pass over all texts (utils.nlp.parse_texts)
+#   3. dedup     identical segments with the same voice and tier become one "unit":
+#                one WAV, one clip (per avatar / green background), one
+#                upload, shared by every item that contains it
+#   4. TTS       all units in one synthesize_many call per TTS backend
+#                (Edge-TTS: one event loop; VITS: padded CPU batches)
+#   5. lip-sync  all avatar units queued together (submit_batch_lip_sync),
+#                so the engine packs frames of the whole batch into its
+#                forward passes; green-background clips run meanwhile
+#   6. finish    as soon as all clips of an item are ready: upload, logs,
+#                merge, JobStore, RESULT_CACHE → on_item(index, result)
+#
+# Items use the AMQP payload field names (text, gender, lang, useAvatar,
+# merge, quality, tts, page_id, content_id, text_id, noCache); results have the same
+# shape as celery_app.lipsync_pipeline plus index / bulk_id / cached /
+# status ("done" or "error" with "error").
+#
+# Env:
+#   BULK_FINISH_WORKERS=4   threads for upload / merge of finished items
+
+from __future__ import annotations
+
+import os
+import uuid
+import logging
+import threading
+import concurrent.futures as futures
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.nlp import parse_texts
+from utils.tts import synthesize_many, get_backend
+from utils.video_utils import submit_batch_lip_sync, make_video_with_green_background
+from utils.merge import concat_videos
+from utils.peaks import write_merged_peaks
+from utils.api_id import IDLogger
+from utils.output_id import OutputLogger
+from utils.trace import start_trace
+from utils.job_store import get_store
+from utils.result_cache import RESULT_CACHE, job_key, normalize_text
+from utils.quality import get_tier
+from utils.cost import wav_seconds
+
+BULK_FINISH_WORKERS = int(os.getenv("BULK_FINISH_WORKERS", 4))
+
+__all__ = ["run_bulk", "item_args", "BULK_FINISH_WORKERS"]
+
+Uploader = Callable[[str], Optional[str]]
+
+
+def item_args(item: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None,
+              quality: Optional[str] = None) -> Dict[str, Any]:
+    """job_key() arguments of one item; missing fields come from *defaults*."""
+    d = {**(defaults or {}), **item}
+    return dict(
+        text=str(d["text"]),
+        gender=d.get("gender", "m"),
+        lang=d.get("lang", "kk"),
+        use_avatar=bool(d.get("useAvatar", True)),
+        merge=bool(d.get("merge", True)),
+        quality=get_tier(d.get("quality", quality)).name,
+        tts=get_backend(d.get("tts")).name,
+    )
+
+
+class _Unit:
+    """One distinct (segment, voice, tier, TTS backend): a WAV and up to two clips."""
+
+    def __init__(self, idx: int, text: str, gender: str, lang: str, quality: str, tts: str,
+                 action_id: int):
+        self.idx = idx
+        self.text = text
+        self.gender = gender
+        self.lang = lang
+        self.quality = quality
+        self.tts = tts
+        self.action_id = action_id
+        self.wav: Optional[str] = None
+        self.clips: Dict[bool, futures.Future] = {}      # use_avatar → mp4 path
+
+
+class _Uploads:
+    """Upload each distinct file once, however many items contain it."""
+
+    def __init__(self, upload: Optional[Uploader]):
+        self.upload = upload
+        self._lock = threading.Lock()
+        self._done: Dict[str, futures.Future] = {}
+
+    def url(self, path: str) -> str:
+        if self.upload is None:
+            return path
+        with self._lock:
+            fut = self._done.get(path)
+            owner = fut is None
+            if owner:
+                fut = self._done[path] = futures.Future()
+        if owner:
+            try:
+                fut.set_result(self.upload(path) or path)
+            except Exception as e:
+                logging.warning("[BULK] upload %s failed: %s", path, e)
+                fut.set_result(path)
+        return fut.result()
+
+
+def run_bulk(items: List[Dict[str, Any]], media_root: Path, *,
+             defaults: Optional[Dict[str, Any]] = None, quality: Optional[str] = None,
+             max_workers: int = 1, upload: Optional[Uploader] = None,
+             on_item: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+             cacheable: Callable[[Dict[str, Any]], bool] = lambda r: True,
+             bulk_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Render all *items* as one batch; on_item(index, result) fires as each one finishes."""
+    bulk_id = bulk_id or uuid.uuid4().hex
+    bulk_dir = Path(media_root) / f"bulk_{bulk_id}"
+    audio_d = bulk_dir / "audio"; audio_d.mkdir(parents=True, exist_ok=True)
+    video_d = bulk_dir / "video"; video_d.mkdir(exist_ok=True)
+    tracer = start_trace(bulk_id, bulk_dir / "logs")
+    store = get_store()
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    emit_lock = threading.Lock()
+
+    def emit(i: int, result: Dict[str, Any]) -> None:
+        results[i] = result
+        if on_item:
+            with emit_lock:                    # callers may publish / write a stream
+                try:
+                    on_item(i, result)
+                except Exception as e:
+                    logging.warning("[BULK] on_item(%d) failed: %s", i, e)
+
+    def ids(i: int) -> Dict[str, Any]:
+        d = {**(defaults or {}), **items[i]}
+        return {"page_id": d.get("page_id"), "content_id": d.get("content_id"),
+                "text_id": d.get("text_id"), "index": i, "bulk_id": bulk_id}
+
+    # ---- 1) cache ----
+    args: List[Dict[str, Any]] = []
+    no_cache: List[bool] = []
+    pending: List[int] = []
+    for i, item in enumerate(items):
+        try:
+            a = item_args(item, defaults, quality)
+            if not a["text"].strip():
+                raise ValueError("empty text")
+        except (KeyError, ValueError) as e:
+            args.append({})
+            no_cache.append(True)
+            emit(i, {**ids(i), "status": "error", "error": f"bad item: {e}"})
+            continue
+        args.append(a)
+        no_cache.append(bool({**(defaults or {}), **item}.get("noCache")))
+        hit = None if no_cache[i] else RESULT_CACHE.get(job_key(**a))
+        if hit is not None:
+            emit(i, {**hit, **ids(i), "cached": True, "status": "done"})
+        else:
+            pending.append(i)
+
+    try:
+        with tracer.span("bulk", items=len(items), pending=len(pending)):
+            if pending:
+                _render(pending, args, no_cache, ids, emit, cacheable, audio_d, video_d,
+                        tracer, store, max_workers, _Uploads(upload), media_root)
+    finally:
+        tracer.export()
+    return results  # type: ignore
+
+
+def _render(pending, args, no_cache, ids, emit, cacheable, audio_d, video_d,
+            tracer, store, max_workers, uploads: _Uploads, media_root) -> None:
+    # ---- 2) one NLP pass ----
+    with tracer.span("nlp.parse_texts", texts=len(pending)):
+        split, analysis = parse_texts([args[i]["text"] for i in pending])
+    segments = dict(zip(pending, split))
+
+    # ---- 3) dedup ----
+    units: Dict[Tuple[str, str, str, str, str], _Unit] = {}
+    item_units: Dict[int, List[_Unit]] = {}
+    for i in pending:
+        a, lst = args[i], []
+        for seg in segments[i]:
+            # case-sensitive: casing can change what TTS says (acronyms, sentence starts)
+            key = (normalize_text(seg), str(a["gender"]).lower(), str(a["lang"]).lower(),
+                   a["quality"], a["tts"])
+            u = units.get(key)
+            if u is None:
+                u = units[key] = _Unit(len(units) + 1, seg, a["gender"], a["lang"], a["quality"],
+                                       a["tts"], analysis[seg]["classification"])
+            lst.append(u)
+        item_units[i] = lst
+    n_segments = sum(len(v) for v in item_units.values())
+    logging.info("[BULK] %d items, %d segments → %d distinct", len(pending), n_segments, len(units))
+
+    # ---- 4) TTS ----
+    for tts in dict.fromkeys(u.tts for u in units.values()):
+        group = [u for u in units.values() if u.tts == tts]
+        with tracer.span("tts.batch", backend=tts, utterances=len(group), segments=n_segments):
+            wavs = synthesize_many([(u.text, audio_d / f"{u.idx:04d}.wav", u.gender, u.lang)
+                                    for u in group], backend=tts)
+        for u, wav in zip(group, wavs):
+            if isinstance(wav, BaseException):
+                fut: futures.Future = futures.Future()
+                fut.set_exception(wav)
+                u.clips = {True: fut, False: fut}
+            else:
+                u.wav = wav
+
+    # ---- 5) lip-sync for the whole batch ----
+    need: Dict[Tuple[int, bool], _Unit] = {}
+    for i in pending:
+        for u in item_units[i]:
+            if u.wav is not None:
+                need[(u.idx, args[i]["use_avatar"])] = u
+    avatar_units = [u for (_, avatar), u in need.items() if avatar]
+    green_units = [u for (_, avatar), u in need.items() if not avatar]
+
+    for quality in dict.fromkeys(u.quality for u in avatar_units):
+        group = [u for u in avatar_units if u.quality == quality]
+        for u, fut in zip(group, submit_batch_lip_sync(
+                [(u.wav, u.gender, u.action_id) for u in group], max_workers,
+                video_dir=video_d, tracer=tracer, tier=get_tier(quality))):
+            u.clips[True] = fut
+
+    green_pool = futures.ThreadPoolExecutor(max_workers=max(1, max_workers))
+    for u in green_units:
+        u.clips[False] = green_pool.submit(_green, u.wav, str(video_d / f"{u.idx:04d}_green.mp4"))
+    green_pool.shutdown(wait=False)
+
+    # ---- 6) finish each item once its clips are ready ----
+    finish_pool = futures.ThreadPoolExecutor(max_workers=BULK_FINISH_WORKERS)
+    lock = threading.Lock()
+    all_submitted = threading.Event()
+    remaining = {i: len(item_units[i]) for i in pending if item_units[i]}
+    open_items = [len(remaining)]
+
+    def clip_done(i: int) -> None:
+        # submit under the lock: the last item's set() must not let the main
+        # thread shut the pool down before another item's submit() got in
+        with lock:
+            remaining[i] -= 1
+            if remaining[i]:
+                return
+            open_items[0] -= 1
+            finish_pool.submit(_finish_item, i, args[i], ids(i), no_cache[i], item_units[i],
+                               emit, cacheable, uploads, store, media_root)
+            if not open_items[0]:
+                all_submitted.set()
+
+    if not remaining:
+        all_submitted.set()
+    for i in pending:
+        if not item_units[i]:
+            emit(i, {**ids(i), "status": "error", "error": "no segments"})
+            continue
+        for u in item_units[i]:
+            u.clips[args[i]["use_avatar"]].add_done_callback(lambda _f, i=i: clip_done(i))
+
+    all_submitted.wait()
+    finish_pool.shutdown(wait=True)
+
+
+def _green(wav: str, out: str) -> str:
+    make_video_with_green_background(wav, out)
+    return out
+
+
+def _finish_item(i: int, a: Dict[str, Any], ids: Dict[str, Any], no_cache: bool, units: List[_Unit],
+                 emit, cacheable, uploads: _Uploads, store, media_root) -> None:
+    job_id = uuid.uuid4().hex
+    log_d = Path(media_root) / job_id / "logs"; log_d.mkdir(parents=True, exist_ok=True)
+    video_d = Path(media_root) / job_id / "video"; video_d.mkdir(exist_ok=True)
+    if store:
+        store.start_job(job_id, page_id=ids["page_id"], content_id=ids["content_id"],
+                        text_id=ids["text_id"], gender=a["gender"], lang=a["lang"],
+                        use_avatar=a["use_avatar"], merge=a["merge"], quality=a["quality"],
+                        tts=a["tts"], bulk_id=ids["bulk_id"])
+    status, audio_s = "error", 0.0
+    api_log = IDLogger(log_d, job_id, store)
+    clip_log = OutputLogger(log_d, job_id, store)
+    try:
+        clips_local = [u.clips[a["use_avatar"]].result() for u in units]
+        clips_remote = [uploads.url(p) for p in clips_local]
+        for idx, (u, url) in enumerate(zip(units, clips_remote), 1):
+            api_log.add_entry(
+                text_clip_id=idx, orig_voice_id=1000 + idx,
+                avatar_action_id=u.action_id, avatar_gender_id=1 if a["gender"] == "m" else 2,
+                voice_gender_id=1 if a["gender"] == "m" else 2,
+            )
+            clip_log.add_entry(text_clip_id=idx, video_path=url, avatar_action_id=u.action_id)
+
+        merged_url = None
+        if a["merge"] and clips_local:
+            merged_local = video_d / f"{job_id}.mp4"
+            concat_videos(clips_local, str(merged_local))
+            write_merged_peaks([u.wav for u in units], merged_local)
+            merged_url = uploads.url(str(merged_local))
+
+        audio_s = round(sum(wav_seconds(u.wav) for u in units), 3)
+        result = {
+            "job_id": job_id, "clips": clips_remote, "merged": merged_url,
+            "api_log": api_log.file_path(), "clip_log": clip_log.file_path(),
+            "use_avatar": a["use_avatar"], "lang": a["lang"], "quality": a["quality"], "tts": a["tts"],
+            "segments": len(units), "audio_s": audio_s,
+        }
+        if not no_cache and cacheable(result):
+            try:
+                RESULT_CACHE.put(job_key(**a), result)
+            except Exception as e:
+                logging.warning("[BULK] cache store failed: %s", e)
+        status = "done"
+        emit(i, {**result, **ids, "cached": False, "status": "done"})
+    except Exception as e:
+        logging.exception("[BULK] item %d failed", i)
+        emit(i, {**ids, "job_id": job_id, "status": "error", "error": str(e)})
+    finally:
+        api_log.flush(); clip_log.flush()
+        if store:
+            store.finish_job(job_id, status, segments=len(units), chars=len(a["text"]),
+                             audio_s=audio_s)
@@ -5,29 +5,57 @@ Thread‑safe random action selector — no repeats until all 20 IDs are used.
 * Each call pops one ID; when bag is empty it refills with a new random shuffle.
 * Lock ensures parallel threads never get the same ID.
 * The incoming `doc` parameter is ignored (kept for API compatibility).
+* DETERMINISTIC_ACTIONS=1: the ID is derived from the segment text instead,
+  so the same phrase always gets the same template (needed for the clip
+  cache in utils/clip_cache.py to hit across jobs).
+* `allowed` restricts the choice to a subset of IDs (the templates this
+  worker node owns, utils/affinity.py); each subset has its own bag.
 """
 
+import os
 import random
+import hashlib
 import threading
-from typing import Tuple
+from typing import Dict, Optional, Sequence, Tuple
 
 TOTAL_ACTIONS = 20
-__all__ = ["classify_sentence_structure"]
+DETERMINISTIC = os.getenv("DETERMINISTIC_ACTIONS", "0").strip().lower() in {"1", "true", "yes"}
+ASSIGNMENT_POLICY = "hash" if DETERMINISTIC else "random"
+__all__ = ["classify_sentence_structure", "action_for_text", "ASSIGNMENT_POLICY"]
 
 _pool: list[int] = []              # remaining unique IDs
+_subset_pools: Dict[Tuple[int, ...], list[int]] = {}
 _lock = threading.Lock()
 
-def _next_action_id() -> int:
+def _next_action_id(allowed: Optional[Sequence[int]] = None) -> int:
     """Return a unique action ID, thread‑safe."""
     global _pool
     with _lock:
+        if allowed:
+            ids = tuple(sorted(allowed))
+            pool = _subset_pools.setdefault(ids, [])
+            if not pool:
+                pool.extend(random.sample(ids, len(ids)))
+            return pool.pop()
         if not _pool:
             _pool = random.sample(range(1, TOTAL_ACTIONS + 1), TOTAL_ACTIONS)
         return _pool.pop()
 
-def classify_sentence_structure(doc) -> Tuple[int, str]:
+def action_for_text(text: str, allowed: Optional[Sequence[int]] = None) -> int:
+    """Stable action ID for a segment (whitespace/case-insensitive)."""
+    norm = " ".join(text.lower().split())
+    digest = hashlib.blake2b(norm.encode("utf-8"), digest_size=8).digest()
+    if allowed:
+        ids = sorted(allowed)
+        return ids[int.from_bytes(digest, "big") % len(ids)]
+    return int.from_bytes(digest, "big") % TOTAL_ACTIONS + 1
+
+def classify_sentence_structure(doc, text: Optional[str] = None,
+                                allowed: Optional[Sequence[int]] = None) -> Tuple[int, str]:
     """Public API used by pipeline and CLI."""
-    return _next_action_id(), "N/A"
+    if DETERMINISTIC and text:
+        return action_for_text(text, allowed), "N/A"
+    return _next_action_id(allowed), "N/A"
 
 # def classify_sentence_structure(doc):
 #     components = set()
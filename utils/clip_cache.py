@@ -0,0 +1,186 @@
+# utils/clip_cache.py — Content-addressed cache of rendered Wav2Lip clips
+# ----------------------------------------------------------------------
+# Wav2Lip output is a pure function of (audio, template, checkpoint, flags),
+# so generate_lip_sync() looks the clip up here before rendering:
+#
+#   key  = sha256(audio digest, template digest, checkpoint digest, flags)
+#   file = CLIP_CACHE_DIR/<key[:2]>/<key>.mp4
+#
+# Hits are hard-linked into the job's video/ dir (reflink / copy as
+# fallbacks), so a hit costs no extra disk space and no data copy. Clips in
+# job dirs are only ever read, never modified in place.
+#
+# Eviction is LRU by mtime (touched on every hit) once the total size of
+# the cache entries exceeds CLIP_CACHE_MAX_MB, whatever their link count
+# (job dirs are never cleaned, so a budget of cache-only bytes would rarely
+# apply). Entries no job dir links to (st_nlink == 1) go first, since
+# removing them frees disk now; shared ones follow in LRU order. Removing a
+# cache entry never affects job dirs that hold a hard link to it.
+#
+# File digests are memoised by (path, size, mtime), so templates and the
+# checkpoint are hashed once per process.
+#
+# Env:
+#   CLIP_CACHE=0            disable
+#   CLIP_CACHE_DIR=path     default static/clip_cache
+#   CLIP_CACHE_MAX_MB=N     default 2048
+
+from __future__ import annotations
+
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+CLIP_CACHE_ENABLED = os.getenv("CLIP_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+CLIP_CACHE_DIR     = Path(os.getenv("CLIP_CACHE_DIR", "static/clip_cache")).resolve()
+CLIP_CACHE_MAX_MB  = int(os.getenv("CLIP_CACHE_MAX_MB", 2048))
+
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+__all__ = ["file_digest", "clip_key", "ClipCache", "CLIP_CACHE"]
+
+_digests: Dict[Tuple[str, int, int], str] = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path: str | Path) -> str:
+    """sha256 of a file, memoised on (path, size, mtime_ns)."""
+    st = os.stat(path)
+    sig = (str(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        hit = _digests.get(sig)
+    if hit:
+        return hit
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digests[sig] = digest
+    return digest
+
+
+def clip_key(audio: str | Path, template: str | Path, checkpoint: str | Path,
+             flags: Sequence[str] = ()) -> str:
+    ckpt = file_digest(checkpoint) if os.path.exists(checkpoint) else str(checkpoint)
+    parts = [file_digest(audio), file_digest(template), ckpt, *map(str, flags)]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def _place(src: Path, dst: Path) -> str:
+    """Make *dst* refer to *src*'s data: hardlink → reflink → copy."""
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        return "reflink"
+    except OSError:
+        dst.unlink(missing_ok=True)
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+class ClipCache:
+    """Size-bounded, LRU-evicted clip store on the local filesystem."""
+
+    def __init__(self, root: Path = CLIP_CACHE_DIR, max_bytes: int = CLIP_CACHE_MAX_MB << 20,
+                 enabled: bool = CLIP_CACHE_ENABLED):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self.hits = self.misses = self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.mp4"
+
+    def fetch(self, key: str, dest: str | Path) -> bool:
+        """Place the cached clip at *dest*; False on miss."""
+        if not self.enabled:
+            return False
+        src = self._path(key)
+        if not src.exists():
+            self.misses += 1
+            return False
+        try:
+            _place(src, Path(dest))
+            os.utime(src)                      # LRU touch
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key: str, src: str | Path) -> None:
+        """Add a freshly rendered clip (linked, not copied, when possible)."""
+        if not self.enabled:
+            return
+        dst = self._path(key)
+        if dst.exists():
+            return
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            _place(Path(src), tmp)
+            os.replace(tmp, dst)
+        except OSError as e:
+            tmp.unlink(missing_ok=True)
+            logging.warning("[CLIP_CACHE] store failed: %s", e)
+            return
+        try:
+            size = dst.stat().st_size
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+        self._evict()
+
+    def _entries(self):
+        """(shared, mtime, size, path): sorted, unshared entries come first, LRU within."""
+        for p in self.root.glob("*/*.mp4"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            yield st.st_nlink > 1, st.st_mtime, st.st_size, p
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(sz for _, _, sz, _ in self._entries())
+            if self._size <= self.max_bytes:
+                return
+            for _shared, _mtime, size, p in sorted(self._entries()):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    p.unlink()
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        continue
+                self._size -= size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "bytes": self._size or 0, "max_bytes": self.max_bytes}
+
+
+CLIP_CACHE = ClipCache()
@@ -0,0 +1,333 @@
+# utils/concurrency.py — Adaptive (AIMD) per-stage concurrency limits
+# -------------------------------------------------------------------
+# Concurrency used to be fixed per process (MAX_WORKERS, GPU_SEMAPHORE,
+# TTS_CONCURRENCY) and _get_executor rebuilt the lip-sync pool whenever
+# max_workers changed. Now every stage has one shared, resizable limit:
+#
+#   tts      Edge-TTS requests in flight (network)
+#   lipsync  inference.py runs (subprocess path)
+#   gpu      per-segment GPU renders (face-enhancement path in celery_app)
+#   upload   uploads to the file server
+#
+# Limiter — counting gate whose limit can change at any time:
+#   with LIMIT.slot(size=...):      blocking;  size = work units (chars,
+#                                   audio seconds, MB) so latency is
+#                                   compared per unit, not per call
+#   async with LIMIT.aslot(...):    asyncio code (polls, no thread held)
+#
+# ResizablePool — persistent FIFO worker pool gated by a Limiter; threads
+# are started as the limit grows and idle above it, never recreated.
+#
+# Controller (thread, every CONC_TICK_S), per stage, AIMD:
+#   decrease  limit × CONC_BACKOFF    if p50 latency per unit > CONC_LATENCY_TOLERANCE
+#                                     × baseline, or the stage's resource (CPU / GPU)
+#                                     is above CONC_MAX_UTIL, or free memory (RAM,
+#                                     GPU memory for gpu stages) < CONC_MIN_MEM_FREE
+#   increase  limit + 1               if callers waited for a slot (or were turned
+#                                     away by try_acquire) in the window and none of
+#                                     the above; a full limit without waiters is not
+#                                     demand for more
+#   baseline = lowest window p50, drifting up CONC_BASELINE_DRIFT per tick
+#              so one lucky window does not pin it forever
+#
+# stats() of all stages → GET /capacity and the consumer's periodic log.
+#
+# Env:
+#   CONC_ADAPTIVE=1              0 = fixed limits (initial values)
+#   CONC_TICK_S=5
+#   CONC_LATENCY_TOLERANCE=2.0
+#   CONC_BACKOFF=0.7
+#   CONC_MAX_UTIL=0.9
+#   CONC_MIN_MEM_FREE=0.1
+#   CONC_BASELINE_DRIFT=0.01
+#   CONC_<STAGE>_INIT / _MIN / _MAX   per-stage bounds, e.g. CONC_LIPSYNC_MAX=6
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+import collections
+import concurrent.futures as futures
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+CONC_ADAPTIVE          = os.getenv("CONC_ADAPTIVE", "1").strip().lower() not in {"0", "false", "no"}
+CONC_TICK_S            = float(os.getenv("CONC_TICK_S", 5))
+CONC_LATENCY_TOLERANCE = float(os.getenv("CONC_LATENCY_TOLERANCE", 2.0))
+CONC_BACKOFF           = float(os.getenv("CONC_BACKOFF", 0.7))
+CONC_MAX_UTIL          = float(os.getenv("CONC_MAX_UTIL", 0.9))
+CONC_MIN_MEM_FREE      = float(os.getenv("CONC_MIN_MEM_FREE", 0.1))
+CONC_BASELINE_DRIFT    = float(os.getenv("CONC_BASELINE_DRIFT", 0.01))
+
+MIN_SAMPLES = 3          # completed calls in a window before latency is judged
+
+__all__ = ["Limiter", "ResizablePool", "limiter", "concurrency_stats", "STAGES"]
+
+STAGES: Dict[str, "Limiter"] = {}
+_stages_lock = threading.Lock()
+
+
+class Limiter:
+    """Counting gate with a resizable limit plus the signals AIMD needs."""
+
+    def __init__(self, name: str, init: int, lo: int = 1, hi: int = 64, resource: Optional[str] = None):
+        self.name = name
+        self.lo, self.hi = max(1, lo), max(lo, hi)
+        self.limit = max(self.lo, min(self.hi, init))
+        self.resource = resource                     # "cpu" / "gpu" / None (network)
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        self._window: Deque[float] = collections.deque(maxlen=512)   # seconds per unit
+        self._saturated = False                      # someone waited / was refused this window
+        self.baseline: Optional[float] = None
+        self.calls = self.increases = self.decreases = 0
+        self.last_reason = ""
+
+    # ------------------------------------------------------------------
+    # gate
+    # ------------------------------------------------------------------
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            self._saturated = True
+            return False
+
+    def acquire(self) -> None:
+        with self._cond:
+            if self.active >= self.limit:
+                self._saturated = True
+                self.waiting += 1
+                try:
+                    while self.active >= self.limit:
+                        self._cond.wait()
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+
+    async def acquire_async(self, poll_s: float = 0.02) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(poll_s)
+
+    def release(self, elapsed_s: Optional[float] = None, size: float = 1.0) -> None:
+        with self._cond:
+            self.active -= 1
+            self.calls += 1
+            if elapsed_s is not None:
+                self._window.append(elapsed_s / max(size, 1e-6))
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def slot(self, size: float = 1.0) -> Iterator[None]:
+        self.acquire()
+        t0 = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release(time.monotonic() - t0 if ok else None, size)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, size: float = 1.0):
+        await self.acquire_async()
+        t0 = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release(time.monotonic() - t0 if ok else None, size)
+
+    def resize(self, n: int) -> None:
+        with self._cond:
+            self.limit = max(self.lo, min(self.hi, int(n)))
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # AIMD step
+    # ------------------------------------------------------------------
+
+    def _step(self, util: Optional[float], mem_free: Optional[float]) -> None:
+        with self._cond:
+            samples = list(self._window)
+            self._window.clear()
+            saturated = self._saturated or self.waiting > 0
+            self._saturated = False
+        p50 = float(np.median(samples)) if len(samples) >= MIN_SAMPLES else None
+        if p50 is not None:
+            self.baseline = p50 if self.baseline is None \
+                else min(self.baseline * (1 + CONC_BASELINE_DRIFT), p50)
+
+        reason = ""
+        if mem_free is not None and mem_free < CONC_MIN_MEM_FREE:
+            reason = f"memory free {mem_free:.0%}"
+        elif util is not None and util > CONC_MAX_UTIL:
+            reason = f"{self.resource} {util:.0%}"
+        elif p50 is not None and self.baseline and p50 > CONC_LATENCY_TOLERANCE * self.baseline:
+            reason = f"latency ×{p50 / self.baseline:.1f}"
+        old = self.limit
+        if reason:
+            self.resize(int(old * CONC_BACKOFF))
+            if self.limit < old:
+                self.decreases += 1
+        elif saturated:
+            self.resize(old + 1)
+            if self.limit > old:
+                self.increases += 1
+                reason = "saturated"
+        if self.limit != old:
+            self.last_reason = reason
+            logging.info("[CONC] %s limit %d → %d (%s)", self.name, old, self.limit, reason)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "min": self.lo, "max": self.hi, "active": self.active,
+                "waiting": self.waiting, "calls": self.calls, "increases": self.increases,
+                "decreases": self.decreases, "last_reason": self.last_reason,
+                "baseline_s_per_unit": round(self.baseline, 4) if self.baseline else None}
+
+
+class ResizablePool:
+    """Persistent FIFO thread pool whose concurrency follows a Limiter."""
+
+    def __init__(self, lim: Limiter):
+        self.lim = lim
+        self._queue: Deque[Tuple[futures.Future, Callable, tuple, dict, float]] = collections.deque()
+        self._cond = threading.Condition()
+        self._threads = 0
+        self._idle = 0
+
+    def submit(self, fn: Callable, *args, size: float = 1.0, **kwargs) -> futures.Future:
+        fut: futures.Future = futures.Future()
+        with self._cond:
+            self._queue.append((fut, fn, args, kwargs, size))
+            if self._idle == 0 and self._threads < self.lim.hi:
+                self._threads += 1
+                threading.Thread(target=self._work, name=f"{self.lim.name}-{self._threads}",
+                                 daemon=True).start()
+            self._cond.notify()
+        return fut
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                self._idle += 1
+                while not self._queue:
+                    self._cond.wait()
+                self._idle -= 1
+                fut, fn, args, kwargs, size = self._queue.popleft()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            with self.lim.slot(size):
+                try:
+                    fut.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    fut.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.lim.stats(), "queued": len(self._queue), "threads": self._threads}
+
+
+# ----------------------------------------------------------------------
+# registry + controller
+# ----------------------------------------------------------------------
+
+def limiter(name: str, init: int, lo: int = 1, hi: int = 64, resource: Optional[str] = None) -> Limiter:
+    """Shared Limiter of a stage; CONC_<NAME>_INIT / _MIN / _MAX override the defaults."""
+    env = lambda k, d: int(os.getenv(f"CONC_{name.upper()}_{k}", d))
+    with _stages_lock:
+        if name not in STAGES:
+            STAGES[name] = Limiter(name, env("INIT", init), env("MIN", lo), env("MAX", hi), resource)
+            if CONC_ADAPTIVE:
+                _Controller.ensure()
+        return STAGES[name]
+
+
+class _CpuMeter:
+    def __init__(self):
+        self._last: Optional[Tuple[int, int]] = None
+
+    def utilization(self) -> Optional[float]:
+        try:
+            with open("/proc/stat") as f:
+                vals = [int(v) for v in f.readline().split()[1:]]
+        except OSError:
+            return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1)) if hasattr(os, "getloadavg") else None
+        idle, total = vals[3] + vals[4], sum(vals)
+        last, self._last = self._last, (idle, total)
+        if last is None or total == last[1]:
+            return None
+        return 1.0 - (idle - last[0]) / (total - last[1])
+
+
+def _mem_free() -> Optional[float]:
+    try:
+        info = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                k, v = line.split(":", 1)
+                info[k] = int(v.split()[0])
+        return info["MemAvailable"] / info["MemTotal"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _gpu() -> Tuple[Optional[float], Optional[float]]:
+    """(utilization, free memory fraction) of GPU 0 if torch already uses CUDA."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None, None
+    util = None
+    try:
+        util = torch.cuda.utilization() / 100.0          # needs pynvml
+    except Exception:
+        pass
+    try:
+        free, total = torch.cuda.mem_get_info()
+        return util, free / total
+    except Exception:
+        return util, None
+
+
+class _Controller(threading.Thread):
+    _instance: Optional["_Controller"] = None
+
+    def __init__(self):
+        super().__init__(name="conc-aimd", daemon=True)
+        self.cpu = _CpuMeter()
+
+    @classmethod
+    def ensure(cls) -> None:
+        if cls._instance is None:
+            cls._instance = cls()
+            cls._instance.start()
+
+    def run(self) -> None:
+        self.cpu.utilization()
+        while True:
+            time.sleep(CONC_TICK_S)
+            cpu, mem = self.cpu.utilization(), _mem_free()
+            gpu_util, gpu_mem = _gpu()
+            for lim in list(STAGES.values()):
+                try:
+                    if lim.resource == "gpu" and (gpu_util is not None or gpu_mem is not None):
+                        lim._step(gpu_util, min(x for x in (mem, gpu_mem) if x is not None))
+                    elif lim.resource in ("cpu", "gpu"):       # no CUDA → GPU stages run on CPU
+                        lim._step(cpu, mem)
+                    else:
+                        lim._step(None, mem)
+                except Exception as e:
+                    logging.warning("[CONC] %s step failed: %s", lim.name, e)
+
+
+def concurrency_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: lim.stats() for name, lim in STAGES.items()}
@@ -0,0 +1,185 @@
+# utils/cost.py — Predicted job cost + cost-aware priority queue
+# -------------------------------------------------------------
+# The RabbitMQ consumer used to run QUEUE_IN strictly FIFO, so a 2-sentence
+# interactive request waited behind a 60-segment course page. In priority
+# mode (RMQ_PRIORITY=1, see celery_app.py) every message is ranked by
+#
+#   key = aging·arrival + predicted_cost − PRIORITY_STEP_S·priority
+#   key = min(key, aging·(deadline − predicted_cost))      if a deadline is set
+#
+# and the lowest key runs next. `aging·arrival` is what prevents starvation:
+# every second a job waits is worth PRIORITY_AGING seconds of predicted
+# cost, so a long job is overtaken by at most a bounded amount of short work.
+# A deadline turns into a latest start time; once it is reached the job
+# ranks ahead of anything that arrives later. Keys never change after
+# insertion, so a plain heap is enough.
+#
+# predicted_cost comes from CostModel:
+#   segments  — utils.nlp._smart_split (no stanza)
+#   audio_s   — characters / chars-per-second (calibrated from history)
+#   per-stage seconds ≈ a + b·segments + c·audio_s, fitted by least squares on
+#   the stage timings of recent finished jobs in the JobStore (tts, lipsync,
+#   upload, merge), separately for avatar / green-background jobs.
+#
+# Env:
+#   PRIORITY_AGING=1.0       cost-seconds credited per second of waiting
+#   PRIORITY_STEP_S=30       cost-seconds per explicit priority level
+#   COST_CHARS_PER_SEC=14    TTS speed before history is available
+#   COST_HISTORY=500         finished jobs used for the fit
+#   COST_REFIT_S=300         refit interval
+
+from __future__ import annotations
+
+import os
+import time
+import wave
+import heapq
+import logging
+import itertools
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.nlp import _smart_split
+from utils.job_store import get_store
+
+PRIORITY_AGING   = float(os.getenv("PRIORITY_AGING", 1.0))
+PRIORITY_STEP_S  = float(os.getenv("PRIORITY_STEP_S", 30))
+CHARS_PER_SEC    = float(os.getenv("COST_CHARS_PER_SEC", 14))
+COST_HISTORY     = int(os.getenv("COST_HISTORY", 500))
+COST_REFIT_S     = float(os.getenv("COST_REFIT_S", 300))
+
+STAGES = ("tts", "lipsync", "upload", "merge")
+MIN_SAMPLES = 8
+
+# seconds per (1, segment, audio second) before any history exists
+_DEFAULTS: Dict[bool, Dict[str, Tuple[float, float, float]]] = {
+    True:  {"tts": (0.5, 0.8, 0.0), "lipsync": (2.0, 3.0, 2.5),
+            "upload": (0.0, 0.3, 0.0), "merge": (0.5, 0.0, 0.05)},
+    False: {"tts": (0.5, 0.8, 0.0), "lipsync": (0.0, 0.4, 0.1),
+            "upload": (0.0, 0.3, 0.0), "merge": (0.5, 0.0, 0.05)},
+}
+
+__all__ = ["CostModel", "COST_MODEL", "PriorityJobQueue", "parse_deadline", "wav_seconds"]
+
+
+def wav_seconds(path: str) -> float:
+    with wave.open(str(path), "rb") as w:
+        return w.getnframes() / float(w.getframerate() or 1)
+
+
+def parse_deadline(value: Any) -> Optional[float]:
+    """Epoch seconds (number) or ISO-8601 string → epoch seconds; None if absent/invalid."""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        logging.warning("[COST] bad deadline %r ignored", value)
+        return None
+
+
+class CostModel:
+    """Per-stage linear cost model, refitted periodically from JobStore history."""
+
+    def __init__(self, refit_s: float = COST_REFIT_S):
+        self.refit_s = refit_s
+        self.coef = {k: {s: np.array(v) for s, v in d.items()} for k, d in _DEFAULTS.items()}
+        self.chars_per_sec = CHARS_PER_SEC
+        self.samples = 0
+        self._fitted_at = 0.0
+        self._lock = threading.Lock()
+
+    def features(self, text: str) -> Dict[str, float]:
+        segments = max(1, len(_smart_split(text)))
+        chars = len(text)
+        return {"segments": segments, "chars": chars, "audio_s": chars / self.chars_per_sec}
+
+    def estimate(self, text: str, use_avatar: bool = True) -> Dict[str, Any]:
+        self._maybe_refit()
+        f = self.features(text)
+        x = np.array([1.0, f["segments"], f["audio_s"]])
+        stages = {s: max(0.0, float(c @ x)) for s, c in self.coef[bool(use_avatar)].items()}
+        return {**f, "stages": stages, "predicted_s": round(sum(stages.values()), 2)}
+
+    def _maybe_refit(self) -> None:
+        if time.monotonic() - self._fitted_at < self.refit_s or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._fitted_at = time.monotonic()
+            store = get_store()
+            if store is not None:
+                self.fit(store.recent_jobs(COST_HISTORY))
+        except Exception as e:
+            logging.warning("[COST] refit failed: %s", e)
+        finally:
+            self._lock.release()
+
+    def fit(self, jobs: List[Dict[str, Any]]) -> None:
+        """Refit from finished jobs whose meta has segments / chars / audio_s / stages."""
+        rows = [j["meta"] for j in jobs
+                if j.get("status") == "done" and isinstance(j.get("meta"), dict)
+                and j["meta"].get("stages") and j["meta"].get("audio_s")]
+        self.samples = len(rows)
+        chars = sum(m.get("chars", 0) for m in rows)
+        audio = sum(m["audio_s"] for m in rows)
+        if chars and audio:
+            self.chars_per_sec = chars / audio
+        for avatar in (True, False):
+            sub = [m for m in rows if bool(m.get("use_avatar", True)) is avatar]
+            if len(sub) < MIN_SAMPLES:
+                continue
+            X = np.array([[1.0, m.get("segments", 1), m["audio_s"]] for m in sub])
+            for stage in STAGES:
+                y = np.array([m["stages"].get(stage, 0.0) for m in sub])
+                coef, *_ = np.linalg.lstsq(X, y, rcond=None)
+                self.coef[avatar][stage] = np.maximum(coef, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"samples": self.samples, "chars_per_sec": round(self.chars_per_sec, 2),
+                "coef": {("avatar" if k else "green"): {s: np.round(c, 3).tolist() for s, c in d.items()}
+                         for k, d in self.coef.items()}}
+
+
+COST_MODEL = CostModel()
+
+
+class PriorityJobQueue:
+    """Thread-safe heap ordered by the aging/cost/priority/deadline key above."""
+
+    def __init__(self, aging: float = PRIORITY_AGING, step_s: float = PRIORITY_STEP_S):
+        self.aging = aging
+        self.step_s = step_s
+        self._heap: List[Tuple[float, int, float, Any]] = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+
+    def key(self, cost_s: float, priority: int = 0, deadline: Optional[float] = None,
+            arrival: Optional[float] = None) -> float:
+        arrival = time.time() if arrival is None else arrival
+        k = self.aging * arrival + cost_s - self.step_s * priority
+        if deadline is not None:
+            k = min(k, self.aging * (deadline - cost_s))
+        return k
+
+    def put(self, item: Any, cost_s: float, priority: int = 0, deadline: Optional[float] = None) -> float:
+        k = self.key(cost_s, priority, deadline)
+        with self._cv:
+            heapq.heappush(self._heap, (k, next(self._seq), time.time(), item))
+            self._cv.notify()
+        return k
+
+    def pop(self, timeout: Optional[float] = None) -> Tuple[Any, float]:
+        """(item, seconds waited); blocks until an item is available."""
+        with self._cv:
+            if not self._cv.wait_for(lambda: self._heap, timeout):
+                raise TimeoutError("priority queue empty")
+            _k, _seq, t_in, item = heapq.heappop(self._heap)
+        return item, time.time() - t_in
+
+    def __len__(self) -> int:
+        return len(self._heap)
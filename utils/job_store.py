@@ -0,0 +1,313 @@
+# utils/job_store.py — Buffered, queryable job/event store (SQLite WAL)
+# --------------------------------------------------------------------
+# One process-wide SQLite database (WAL mode) that replaces scanning the
+# per-job `logs/` directories:
+#
+#   jobs   — one row per job: ids, status, start/finish time, duration
+#   events — one row per logger entry (kind = "ids" | "clips" | ...)
+#
+# Writes are buffered in memory and committed in one transaction per batch
+# (every STORE_FLUSH_EVERY events, on finish_job() and on flush()), so a
+# batch is either fully visible or not at all.
+#
+# IDLogger / OutputLogger keep writing their JSONL files for compatibility;
+# they use JSONLBuffer below so those files are written in batches, too.
+#
+# Queries:
+#   get_store().clips_for_page(page_id)
+#   get_store().jobs_slower_than(seconds)
+#   get_store().export_jsonl(job_id, "clips", path)
+#   get_store().recent_jobs(500)          # history for utils.cost
+#
+# job_results holds finished job results keyed by utils.result_cache.job_key.
+#
+# Env:
+#   JOB_STORE_PATH      database file (default logs/jobs.sqlite3, "" = off)
+#   STORE_FLUSH_EVERY   events per batch (default 64)
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "logs/jobs.sqlite3").strip()
+FLUSH_EVERY    = int(os.getenv("STORE_FLUSH_EVERY", 64))
+
+__all__ = ["JobStore", "JSONLBuffer", "get_store"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id     TEXT PRIMARY KEY,
+    page_id    INTEGER,
+    content_id INTEGER,
+    text_id    INTEGER,
+    status     TEXT,
+    started    REAL,
+    finished   REAL,
+    duration   REAL,
+    meta       TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_page     ON jobs(page_id);
+CREATE INDEX IF NOT EXISTS jobs_duration ON jobs(duration);
+
+CREATE TABLE IF NOT EXISTS events (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id       TEXT NOT NULL,
+    kind         TEXT NOT NULL,
+    text_clip_id INTEGER,
+    ts           REAL,
+    payload      TEXT
+);
+CREATE INDEX IF NOT EXISTS events_job ON events(job_id, kind);
+
+CREATE TABLE IF NOT EXISTS job_results (
+    key     TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    result  TEXT NOT NULL,
+    created REAL,
+    hits    INTEGER DEFAULT 0
+);
+"""
+
+
+class JobStore:
+    """Thread-safe SQLite store with batched event inserts."""
+
+    def __init__(self, path: str | Path, flush_every: int = FLUSH_EVERY):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._flush_every = max(1, flush_every)
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False,
+                                   isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def start_job(self, job_id: str, *, page_id: Optional[int] = None,
+                  content_id: Optional[int] = None, text_id: Optional[int] = None,
+                  **meta: Any) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs(job_id, page_id, content_id, text_id, status, started, meta)"
+                " VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                (job_id, page_id, content_id, text_id, time.time(),
+                 json.dumps(meta, ensure_ascii=False)),
+            )
+
+    def add_event(self, job_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        """Queue one event; committed with the next batch."""
+        row = (job_id, kind, payload.get("text_clip_id"), time.time(),
+               json.dumps(payload, ensure_ascii=False))
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self._flush_every:
+                self._flush_locked()
+
+    def finish_job(self, job_id: str, status: str = "done", **meta: Any) -> None:
+        """Flush pending events and close the job row in the same transaction."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._insert_pending()
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, finished = ?, duration = ? - started,"
+                    " meta = json_patch(COALESCE(meta, '{}'), ?) WHERE job_id = ?",
+                    (status, now, now, json.dumps(meta, ensure_ascii=False), job_id),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        self._db.execute("BEGIN")
+        try:
+            self._insert_pending()
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _insert_pending(self) -> None:
+        if self._pending:
+            self._db.executemany(
+                "INSERT INTO events(job_id, kind, text_clip_id, ts, payload) VALUES (?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            self._pending = []
+
+    def put_result(self, key: str, version: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO job_results(key, version, result, created, hits)"
+                " VALUES (?, ?, ?, ?, 0)",
+                (key, version, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+
+    def get_result(self, key: str, version: str,
+                   max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Cached result for *key*, or None if missing, stale or of another version."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, created FROM job_results WHERE key = ? AND version = ?",
+                (key, version),
+            ).fetchone()
+            if row is None or (max_age and time.time() - row[1] > max_age):
+                return None
+            self._db.execute("UPDATE job_results SET hits = hits + 1 WHERE key = ?", (key,))
+        return json.loads(row[0])
+
+    def purge_results(self, keep_version: str) -> int:
+        """Drop cached results of every other version; returns rows deleted."""
+        with self._lock:
+            cur = self._db.execute("DELETE FROM job_results WHERE version != ?", (keep_version,))
+            return cur.rowcount
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._flush_locked()
+            cur = self._db.execute(sql, params)
+            cols = [c[0] for c in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def events(self, job_id: str, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Payloads of one job's events, in insertion order."""
+        if kind is None:
+            rows = self._query("SELECT payload FROM events WHERE job_id = ? ORDER BY id", (job_id,))
+        else:
+            rows = self._query("SELECT payload FROM events WHERE job_id = ? AND kind = ? ORDER BY id",
+                               (job_id, kind))
+        return [json.loads(r["payload"]) for r in rows]
+
+    def clips_for_page(self, page_id: int) -> List[Dict[str, Any]]:
+        """All clip entries of every job for *page_id*, newest job first."""
+        rows = self._query(
+            "SELECT e.job_id, j.content_id, j.text_id, e.payload FROM events e"
+            " JOIN jobs j ON j.job_id = e.job_id"
+            " WHERE j.page_id = ? AND e.kind = 'clips'"
+            " ORDER BY j.started DESC, e.text_clip_id",
+            (page_id,),
+        )
+        return [{"job_id": r["job_id"], "content_id": r["content_id"],
+                 "text_id": r["text_id"], **json.loads(r["payload"])} for r in rows]
+
+    def jobs_slower_than(self, seconds: float, limit: int = 100) -> List[Dict[str, Any]]:
+        return self._query(
+            "SELECT * FROM jobs WHERE duration > ? ORDER BY duration DESC LIMIT ?",
+            (seconds, limit),
+        )
+
+    def recent_jobs(self, limit: int = 500, status: Optional[str] = "done") -> List[Dict[str, Any]]:
+        """Newest finished jobs with `meta` decoded (cost-model history)."""
+        if status is None:
+            rows = self._query("SELECT * FROM jobs ORDER BY started DESC LIMIT ?", (limit,))
+        else:
+            rows = self._query("SELECT * FROM jobs WHERE status = ? ORDER BY started DESC LIMIT ?",
+                               (status, limit))
+        for r in rows:
+            r["meta"] = json.loads(r["meta"]) if r.get("meta") else {}
+        return rows
+
+    def export_jsonl(self, job_id: str, kind: str, path: str | Path) -> str:
+        """Rewrite one job's events as a JSONL file (same format as the loggers)."""
+        path = Path(path)
+        lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in self.events(job_id, kind))
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(lines, encoding="utf-8")
+        os.replace(tmp, path)
+        return str(path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            self._db.close()
+
+
+class JSONLBuffer:
+    """Append-only JSONL file written in batches with one write() per batch."""
+
+    def __init__(self, path: Path, flush_every: int = FLUSH_EVERY):
+        self._path = path
+        self._flush_every = max(1, flush_every)
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            if len(self._pending) >= self._flush_every:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        data = "".join(self._pending).encode("utf-8")
+        fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        self._pending = []
+
+    def read(self) -> List[Dict[str, Any]]:
+        self.flush()
+        if not self._path.exists():
+            return []
+        with self._path.open(encoding="utf-8") as fp:
+            return [json.loads(ln) for ln in fp if ln.strip()]
+
+
+# ---------------------------------------------------------------------------
+# process-wide instance
+# ---------------------------------------------------------------------------
+
+_store: Optional[JobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[JobStore]:
+    """Shared JobStore, or None when JOB_STORE_PATH is empty / unusable."""
+    global _store
+    if not JOB_STORE_PATH:
+        return None
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = JobStore(JOB_STORE_PATH)
+                atexit.register(_store.close)
+            except sqlite3.Error as e:
+                logging.error("[STORE] cannot open %s: %s", JOB_STORE_PATH, e)
+                return None
+    return _store
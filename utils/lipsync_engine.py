@@ -0,0 +1,659 @@
+# utils/lipsync_engine.py — In-process Wav2Lip engine with cross-job batching
+# --------------------------------------------------------------------------
+# The subprocess path (inference.py per clip) reloads the model, re-detects
+# faces and runs one under-filled batch per short segment. This engine keeps
+# the model resident and feeds it from a single scheduler thread:
+#
+#   submit(audio, template, out) ─┐
+#   submit(audio, template, out) ─┼─► window queue ─► BatchScheduler ─► backend(img, mel)
+#   submit(...)  (other jobs)    ─┘        (max_batch / max_wait_ms)        │
+#                                                                           ▼
+#                        per-clip pipeline (decoder → encoder → ffmpeg) ◄── scatter predictions
+#
+# • A "window" is one output frame: a 96×96 face crop + a 16-column mel chunk.
+# • Windows from every pending clip (any job in this process) are packed into
+#   one forward pass of up to `max_batch`, waiting at most `max_wait_ms` for
+#   the batch to fill once the first window is there.
+# • Face boxes are detected once per template and resize factor and persisted
+#   under static/video_templates/.faces/; only the 96×96 crops stay in memory.
+# • Each clip runs its own overlapped pipeline: a decoder thread streams
+#   template frames into a bounded ring of preallocated frames, the encoder
+#   thread pastes mouths as predictions arrive and writes raw frames to
+#   ffmpeg's stdin, which muxes the audio in the same pass (no temp files).
+# • Mel spectrograms come from utils/mel.py (NumPy, one pass per job, cached
+#   by audio digest); Wav2Lip's audio module is only the fallback.
+# • Only voiced frames are inferred (utils/vad.py); silent spans keep the
+#   template frame. Frames inferred / time saved are logged per clip and
+#   summed in stats().
+#
+# Backends are plain callables  backend(img[B,96,96,6], mel[B,80,16,1]) →
+# pred[B,96,96,3] (0‥255); see BACKENDS.
+#
+# Wav2Lip's own modules (models, audio, face_detection) are imported from
+# wav2lip/, the same checkout inference.py runs from.
+#
+# Env:
+#   LIPSYNC_MAX_BATCH=128      windows per forward pass
+#   LIPSYNC_MAX_WAIT_MS=20     how long a partial batch may wait for more
+#   LIPSYNC_TEMPLATE_CACHE=4   templates (boxes + crops) kept in memory
+#   LIPSYNC_RING_SLOTS=16      decoded frames buffered per clip
+#   LIPSYNC_X264_PRESET=medium default x264 preset (quality tiers override it)
+#   LIPSYNC_ONNX_MODEL=path    ONNX generator for backend "onnx"
+#                              (default .assets/models/wav2lip_gan.onnx;
+#                               "onnx-int8" uses <model>.int8.onnx)
+#   ORT_INTRA_THREADS / ORT_INTER_THREADS   ONNX Runtime thread pools (0 = ORT default)
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import importlib
+import subprocess
+import collections
+import concurrent.futures as futures
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.clip_cache import file_digest
+from utils.mel import MELS, MEL_FAST
+from utils.vad import VAD_ENABLED, voiced_mask, spans as vad_spans
+from utils.video_utils import TEMPLATE_DIR, WAV2LIP_DIR
+
+CHECKPOINT   = WAV2LIP_DIR / "checkpoints/wav2lip_gan.pth"
+FACES_DIR    = TEMPLATE_DIR / ".faces"
+ONNX_MODEL   = Path(os.getenv("LIPSYNC_ONNX_MODEL", ".assets/models/wav2lip_gan.onnx")).resolve()
+ONNX_INT8    = ONNX_MODEL.with_suffix(".int8.onnx")
+
+MAX_BATCH       = int(os.getenv("LIPSYNC_MAX_BATCH", 128))
+MAX_WAIT_MS     = float(os.getenv("LIPSYNC_MAX_WAIT_MS", 20))
+TEMPLATE_CACHE  = int(os.getenv("LIPSYNC_TEMPLATE_CACHE", 4))
+RING_SLOTS      = int(os.getenv("LIPSYNC_RING_SLOTS", 16))
+X264_PRESET     = os.getenv("LIPSYNC_X264_PRESET", "medium")
+ORT_INTRA       = int(os.getenv("ORT_INTRA_THREADS", 0))
+ORT_INTER       = int(os.getenv("ORT_INTER_THREADS", 0))
+
+IMG_SIZE       = 96
+MEL_STEP       = 16
+SAMPLE_RATE    = 16000
+FACE_PADS      = (0, 10, 0, 0)     # top, bottom, left, right (inference.py defaults)
+FACE_DET_BATCH = 16
+SMOOTH_T       = 5
+
+Backend = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+__all__ = ["LipSyncEngine", "get_engine", "BACKENDS", "load_template", "mel_chunks"]
+
+
+def _wav2lip_module(name: str):
+    """Import a module from the wav2lip/ checkout (models, audio, face_detection)."""
+    if str(WAV2LIP_DIR) not in sys.path:
+        sys.path.insert(0, str(WAV2LIP_DIR))
+    return importlib.import_module(name)
+
+
+def _device() -> str:
+    try:
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except ImportError:
+        return "cpu"
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class TorchBackend:
+    """Wav2Lip generator in PyTorch (same weights/layout as inference.py)."""
+
+    name = "torch"
+
+    def __init__(self, checkpoint: Path = CHECKPOINT, device: Optional[str] = None):
+        import torch
+        self._torch = torch
+        self.device = device or _device()
+        Wav2Lip = _wav2lip_module("models").Wav2Lip
+        ckpt = torch.load(str(checkpoint), map_location=self.device)
+        state = {k.replace("module.", ""): v for k, v in ckpt["state_dict"].items()}
+        model = Wav2Lip()
+        model.load_state_dict(state)
+        self.model = model.to(self.device).eval()
+
+    def __call__(self, img: np.ndarray, mel: np.ndarray) -> np.ndarray:
+        torch = self._torch
+        with torch.no_grad():
+            img_t = torch.from_numpy(np.ascontiguousarray(img.transpose(0, 3, 1, 2))).to(self.device)
+            mel_t = torch.from_numpy(np.ascontiguousarray(mel.transpose(0, 3, 1, 2))).to(self.device)
+            pred = self.model(mel_t, img_t)
+        return pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.0
+
+
+class OnnxBackend:
+    """Wav2Lip generator exported to ONNX (utils/wav2lip_onnx.py), run by ONNX Runtime.
+
+    Inputs are matched by channel count (6 = faces, 1 = mel), so both NCHW
+    exports and NHWC third-party models work.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: Path = ONNX_MODEL, intra_threads: int = ORT_INTRA,
+                 inter_threads: int = ORT_INTER, device: Optional[str] = None):
+        import onnxruntime as ort
+        if not Path(model_path).exists():
+            raise FileNotFoundError(f"{model_path} (export it: python -m utils.wav2lip_onnx export)")
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.intra_op_num_threads = intra_threads
+        opts.inter_op_num_threads = inter_threads
+        if inter_threads > 1:
+            opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        providers = ["CPUExecutionProvider"]
+        if (device or _device()) == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(str(model_path), opts, providers=providers)
+
+        self._face = self._mel = None
+        for inp in self.session.get_inputs():
+            nhwc = inp.shape[-1] in (1, 6)
+            channels = inp.shape[-1] if nhwc else inp.shape[1]
+            if channels == 6:
+                self._face, self._face_nhwc = inp.name, nhwc
+            else:
+                self._mel, self._mel_nhwc = inp.name, nhwc
+        out = self.session.get_outputs()[0]
+        self._out_nhwc = out.shape[-1] == 3
+
+    def __call__(self, img: np.ndarray, mel: np.ndarray) -> np.ndarray:
+        feeds = {
+            self._face: img if self._face_nhwc else np.ascontiguousarray(img.transpose(0, 3, 1, 2)),
+            self._mel: mel if self._mel_nhwc else np.ascontiguousarray(mel.transpose(0, 3, 1, 2)),
+        }
+        pred = self.session.run(None, feeds)[0]
+        return (pred if self._out_nhwc else pred.transpose(0, 2, 3, 1)) * 255.0
+
+
+BACKENDS: Dict[str, Callable[..., Backend]] = {
+    "torch": TorchBackend,
+    "onnx": OnnxBackend,
+    "onnx-int8": lambda **kw: OnnxBackend(ONNX_INT8, **kw),
+}
+
+
+# ---------------------------------------------------------------------------
+# Templates (face boxes + pre-resized face crops)
+# ---------------------------------------------------------------------------
+
+class Template:
+    """Face boxes and 96×96 crops of a template; full frames are not kept —
+    each clip's decoder streams them from `path` again."""
+
+    def __init__(self, path: Path, frames: List[np.ndarray], fps: float, boxes: np.ndarray):
+        self.path = path
+        self.size = frames[0].shape[:2]      # (h, w) after resize_factor
+        self.n = len(frames)
+        self.fps = fps
+        self.boxes = boxes                   # (N, 4) y1, y2, x1, x2
+        # every clip using this template needs the same 96×96 crops
+        self.faces = np.stack([
+            cv2.resize(f[y1:y2, x1:x2], (IMG_SIZE, IMG_SIZE))
+            for f, (y1, y2, x1, x2) in zip(frames, boxes)
+        ])
+
+    def __len__(self) -> int:
+        return self.n
+
+
+_templates: "collections.OrderedDict[Tuple[str, int], Template]" = collections.OrderedDict()
+_templates_lock = threading.Lock()
+
+
+def _read_frames(path: Path, resize_factor: int) -> Tuple[List[np.ndarray], float]:
+    cap = cv2.VideoCapture(str(path))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        if resize_factor > 1:
+            frame = cv2.resize(frame, (frame.shape[1] // resize_factor, frame.shape[0] // resize_factor))
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise ValueError(f"cannot decode template {path}")
+    return frames, fps
+
+
+def _detect_boxes(frames: List[np.ndarray]) -> np.ndarray:
+    fd = _wav2lip_module("face_detection")
+    detector = fd.FaceAlignment(fd.LandmarksType._2D, flip_input=False, device=_device())
+    rects = []
+    for i in range(0, len(frames), FACE_DET_BATCH):
+        rects.extend(detector.get_detections_for_batch(np.array(frames[i:i + FACE_DET_BATCH])))
+    del detector
+
+    top, bottom, left, right = FACE_PADS
+    boxes = []
+    for rect, img in zip(rects, frames):
+        if rect is None:
+            raise ValueError("Face not detected in template frame")
+        h, w = img.shape[:2]
+        boxes.append([max(0, rect[0] - left), max(0, rect[1] - top),
+                      min(w, rect[2] + right), min(h, rect[3] + bottom)])
+    boxes = np.array(boxes, dtype=np.float64)
+    # temporal smoothing (inference.py get_smoothened_boxes)
+    smooth = boxes.copy()
+    for i in range(len(boxes)):
+        smooth[i] = boxes[i:i + SMOOTH_T].mean(axis=0) if i + SMOOTH_T <= len(boxes) \
+            else boxes[max(0, len(boxes) - SMOOTH_T):].mean(axis=0)
+    x1, y1, x2, y2 = smooth.astype(int).T
+    return np.stack([y1, y2, x1, x2], axis=1)
+
+
+def load_template(path: str | Path, resize_factor: int = 1) -> Template:
+    """Decoded template with face boxes; LRU-cached in memory, boxes on disk."""
+    path = Path(path)
+    key = (str(path), resize_factor)
+    with _templates_lock:
+        tpl = _templates.get(key)
+        if tpl is not None:
+            _templates.move_to_end(key)
+            return tpl
+
+    frames, fps = _read_frames(path, resize_factor)
+    boxes_path = FACES_DIR / f"{file_digest(path)[:16]}_rf{resize_factor}.npy"
+    if boxes_path.exists():
+        boxes = np.load(boxes_path)
+    else:
+        boxes = _detect_boxes(frames)
+        FACES_DIR.mkdir(parents=True, exist_ok=True)
+        np.save(boxes_path, boxes)
+    tpl = Template(path, frames, fps, boxes)
+
+    with _templates_lock:
+        _templates[key] = tpl
+        while len(_templates) > TEMPLATE_CACHE:
+            _templates.popitem(last=False)
+    return tpl
+
+
+# ---------------------------------------------------------------------------
+# Audio → mel windows
+# ---------------------------------------------------------------------------
+
+def mel_chunks(audio_path: str | Path, fps: float, mel: Optional[np.ndarray] = None) -> np.ndarray:
+    """(N, 80, 16) mel windows, one per output video frame (inference.py layout).
+
+    mel: the clip's (80, T) spectrogram if the caller already has it (MELS.get_many).
+    """
+    if mel is None and MEL_FAST:
+        mel = MELS.get(audio_path)
+    if mel is None:
+        audio = _wav2lip_module("audio")
+        mel = audio.melspectrogram(audio.load_wav(str(audio_path), SAMPLE_RATE))
+    if np.isnan(mel).any():
+        raise ValueError("Mel contains nan! Add a small epsilon noise to the wav file")
+    return _windows(mel, fps)
+
+
+def _windows(mel: np.ndarray, fps: float) -> np.ndarray:
+    step = 80.0 / fps
+    starts = []
+    i = 0
+    while True:
+        s = int(i * step)
+        if s + MEL_STEP > mel.shape[1]:
+            starts.append(mel.shape[1] - MEL_STEP)   # last window clamped to the end
+            break
+        starts.append(s)
+        i += 1
+    idx = np.asarray(starts)[:, None] + np.arange(MEL_STEP)
+    return np.ascontiguousarray(mel[:, idx].transpose(1, 0, 2), dtype=np.float32)
+
+
+# ---------------------------------------------------------------------------
+# Per-clip frame pipeline:  decoder ─ring─► encoder ─stdin─► ffmpeg (+audio)
+# ---------------------------------------------------------------------------
+
+class FrameRing:
+    """Fixed pool of preallocated frames handed from one stage to the next.
+
+    The producer acquire()s a free slot, fills buf[slot] and publish()es it;
+    the consumer take()s it and release()s it when done. With `slots` frames
+    in total the producer can never run more than `slots` frames ahead.
+    """
+
+    def __init__(self, slots: int, shape: Tuple[int, ...], dtype=np.uint8):
+        self.buf = np.empty((slots, *shape), dtype)
+        self._free: "queue.Queue[int]" = queue.Queue()
+        self._full: "queue.Queue[Tuple[int, Any]]" = queue.Queue()
+        for i in range(slots):
+            self._free.put(i)
+        self.aborted = False
+
+    def acquire(self) -> Optional[int]:
+        """Free slot index, or None once the ring was aborted."""
+        while not self.aborted:
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def publish(self, slot: int, tag: Any = None) -> None:
+        self._full.put((slot, tag))
+
+    def take(self) -> Tuple[int, Any]:
+        return self._full.get()
+
+    def release(self, slot: int) -> None:
+        self._free.put(slot)
+
+    def abort(self) -> None:
+        self.aborted = True
+
+
+class _Decoder(threading.Thread):
+    """Streams template frames (looped, resized) into the ring."""
+
+    def __init__(self, clip: "_Clip"):
+        super().__init__(name=f"lipsync-decode-{clip.out_path.stem[:8]}", daemon=True)
+        self.clip = clip
+
+    def run(self) -> None:
+        clip, tpl, ring = self.clip, self.clip.template, self.clip.ring
+        h, w = tpl.size
+        cap = cv2.VideoCapture(str(tpl.path))
+        try:
+            read = 0
+            for i in range(clip.n):
+                ok, frame = cap.read()
+                if not ok or read == len(tpl):           # loop the template
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    read = 0
+                    ok, frame = cap.read()
+                if not ok:
+                    raise ValueError(f"cannot decode template {tpl.path}")
+                read += 1
+                slot = ring.acquire()
+                if slot is None:
+                    return
+                if frame.shape[:2] == (h, w):
+                    np.copyto(ring.buf[slot], frame)
+                else:
+                    cv2.resize(frame, (w, h), dst=ring.buf[slot])
+                ring.publish(slot, i)
+        except BaseException as exc:
+            ring.publish(-1, exc)
+        finally:
+            cap.release()
+
+
+class _Encoder(threading.Thread):
+    """Pastes predicted mouths into decoded frames and pipes them to ffmpeg.
+
+    ffmpeg reads raw BGR frames from stdin and muxes the clip's audio in the
+    same pass, so no intermediate video file is written.
+    """
+
+    def __init__(self, clip: "_Clip"):
+        super().__init__(name=f"lipsync-encode-{clip.out_path.stem[:8]}", daemon=True)
+        self.clip = clip
+
+    def _ffmpeg(self) -> subprocess.Popen:
+        clip, (h, w) = self.clip, self.clip.template.size
+        scale = ["-vf", f"scale=-2:min(ih\\,{clip.max_height})"] if clip.max_height else []
+        return subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "error",
+             "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{w}x{h}", "-r", f"{clip.template.fps}",
+             "-i", "pipe:0", "-i", str(clip.audio_path),
+             "-map", "0:v:0", "-map", "1:a:0",
+             "-c:v", "libx264", "-preset", clip.preset, *scale, "-pix_fmt", "yuv420p",
+             "-c:a", "aac", "-shortest", "-movflags", "+faststart", str(clip.out_path)],
+            stdin=subprocess.PIPE,
+        )
+
+    def run(self) -> None:
+        clip, tpl, ring = self.clip, self.clip.template, self.clip.ring
+        proc = None
+        try:
+            proc = self._ffmpeg()
+            for _ in range(clip.n):
+                slot, tag = ring.take()
+                if slot < 0:
+                    raise tag
+                frame = ring.buf[slot]
+                if clip.voiced[tag]:                     # silent frames stay as in the template
+                    clip.wait_ready(tag + 1)
+                    y1, y2, x1, x2 = tpl.boxes[tag % len(tpl)]
+                    frame[y1:y2, x1:x2] = cv2.resize(clip.mouths[tag], (x2 - x1, y2 - y1))
+                proc.stdin.write(frame.data)
+                ring.release(slot)
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with {proc.returncode} for {clip.out_path}")
+            clip.future.set_result(str(clip.out_path))
+        except BaseException as exc:
+            ring.abort()
+            if proc is not None:
+                proc.kill()
+                proc.wait()
+            clip.out_path.unlink(missing_ok=True)
+            clip.future.set_exception(exc)
+
+
+class _Clip:
+    def __init__(self, template: Template, mels: np.ndarray, audio_path: Path, out_path: Path,
+                 preset: str = X264_PRESET, max_height: int = 0, voiced: Optional[np.ndarray] = None):
+        self.template = template
+        self.mels = mels
+        self.audio_path = audio_path
+        self.out_path = out_path
+        self.preset = preset
+        self.max_height = max_height
+        self.n = len(mels)
+        # frames that need inference (utils.vad); the scheduler only sees these spans
+        self.voiced = np.ones(self.n, bool) if voiced is None else voiced
+        self.spans = vad_spans(self.voiced)
+        self.inferred = int(self.voiced.sum())
+        self.error: Optional[BaseException] = None
+        self.future: futures.Future = futures.Future()
+        # predictions land here in order; `ready` = windows delivered so far
+        self.mouths = np.empty((self.n, IMG_SIZE, IMG_SIZE, 3), np.uint8)
+        self.ready = 0
+        self._cond = threading.Condition()
+        self.ring = FrameRing(min(RING_SLOTS, self.n) or 1, (*template.size, 3))
+        self.decoder = _Decoder(self)
+        self.encoder = _Encoder(self)
+        self.decoder.start()
+        self.encoder.start()
+
+    def inputs(self, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Network inputs for windows [start, stop): masked+reference faces, mels."""
+        faces = self.template.faces[np.arange(start, stop) % len(self.template)]
+        masked = faces.copy()
+        masked[:, IMG_SIZE // 2:] = 0
+        img = np.concatenate([masked, faces], axis=3).astype(np.float32) / 255.0
+        return img, self.mels[start:stop, :, :, None]
+
+    def deliver(self, start: int, preds: np.ndarray) -> None:
+        np.clip(preds, 0, 255, out=preds)
+        self.mouths[start:start + len(preds)] = preds
+        with self._cond:
+            self.ready = max(self.ready, start + len(preds))
+            self._cond.notify_all()
+
+    def fail(self, exc: BaseException) -> None:
+        with self._cond:
+            self.error = exc
+            self._cond.notify_all()
+
+    def wait_ready(self, count: int) -> None:
+        with self._cond:
+            while self.ready < count and self.error is None:
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+
+
+# ---------------------------------------------------------------------------
+# Scheduler
+# ---------------------------------------------------------------------------
+
+class BatchScheduler(threading.Thread):
+    """Packs windows from all pending clips into forward passes."""
+
+    def __init__(self, backend: Backend, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        super().__init__(name="lipsync-scheduler", daemon=True)
+        self.backend = backend
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._q: "queue.Queue[Tuple[_Clip, int, int]]" = queue.Queue()
+        self._carry: "collections.deque[Tuple[_Clip, int, int]]" = collections.deque()
+        self.batches = self.windows = 0
+        self.busy_s = 0.0
+
+    def enqueue(self, clip: _Clip) -> None:
+        for start, stop in clip.spans:
+            self._q.put((clip, start, stop))
+
+    def cost_per_window(self) -> float:
+        return self.busy_s / self.windows if self.windows else 0.0
+
+    def _next(self, timeout: Optional[float]):
+        if self._carry:
+            return self._carry.popleft()
+        return self._q.get(timeout=timeout) if timeout is None or timeout > 0 else self._q.get_nowait()
+
+    def _gather(self) -> List[Tuple[_Clip, int, int]]:
+        parts: List[Tuple[_Clip, int, int]] = []
+        room = self.max_batch
+        deadline = None
+        while room > 0:
+            try:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                clip, start, stop = self._next(timeout)
+            except queue.Empty:
+                break
+            if clip.error is not None or clip.future.done():
+                continue                          # failed clip: its queued spans are not inferred
+            if deadline is None:
+                deadline = time.monotonic() + self.max_wait
+            take = min(room, stop - start)
+            parts.append((clip, start, start + take))
+            if start + take < stop:
+                self._carry.appendleft((clip, start + take, stop))
+            room -= take
+        return parts
+
+    def run(self) -> None:
+        while True:
+            parts = self._gather()
+            try:
+                inputs = [clip.inputs(a, b) for clip, a, b in parts]
+                img = np.concatenate([i for i, _ in inputs])
+                mel = np.concatenate([m for _, m in inputs])
+                t0 = time.perf_counter()
+                pred = self.backend(img, mel)
+                self.busy_s += time.perf_counter() - t0
+            except BaseException as exc:          # fail only the clips in this batch
+                logging.exception("[LIPSYNC] batch failed")
+                for clip, _a, _b in parts:
+                    clip.fail(exc)
+                self._drop_failed({id(c) for c, _, _ in parts})
+                continue
+            self.batches += 1
+            self.windows += len(pred)
+            off = 0
+            for clip, a, b in parts:
+                clip.deliver(a, pred[off:off + (b - a)])
+                off += b - a
+
+    def _drop_failed(self, ids: set) -> None:
+        # spans still in _q are skipped by _gather() once their clip has failed
+        self._carry = collections.deque(p for p in self._carry if id(p[0]) not in ids)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"batches": self.batches, "windows": self.windows,
+                "avg_fill": round(self.windows / self.batches / self.max_batch, 3) if self.batches else 0.0,
+                "busy_s": round(self.busy_s, 3), "pending": self._q.qsize() + len(self._carry)}
+
+
+# ---------------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------------
+
+class LipSyncEngine:
+    """Resident model + scheduler shared by every job in the process."""
+
+    def __init__(self, backend: str = "torch", max_batch: int = MAX_BATCH,
+                 max_wait_ms: float = MAX_WAIT_MS, **backend_kw: Any):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown lip-sync backend {backend!r} (have {sorted(BACKENDS)})")
+        self.backend_name = backend
+        self.scheduler = BatchScheduler(BACKENDS[backend](**backend_kw), max_batch, max_wait_ms)
+        self.scheduler.start()
+        self.frames = self.inferred = 0
+        self.saved_s = 0.0
+
+    def submit(self, audio_path: str | Path, template_path: str | Path, out_path: str | Path,
+               resize_factor: int = 3, preset: str = X264_PRESET, max_height: int = 0,
+               vad: bool = VAD_ENABLED, mel: Optional[np.ndarray] = None,
+               on_stats: Optional[Callable[[Dict[str, Any]], None]] = None) -> futures.Future:
+        """Prepare one clip in the calling thread and queue its windows.
+
+        preset / max_height: x264 preset and output height cap (0 = none).
+        vad: infer only voiced frames (utils.vad); silent ones keep the template.
+        mel: precomputed (80, T) spectrogram of *audio_path* (default: computed here).
+        on_stats: called on success with {"frames", "inferred", "saved_s"}.
+        """
+        tpl = load_template(template_path, resize_factor)
+        mels = mel_chunks(audio_path, tpl.fps, mel)
+        voiced = voiced_mask(audio_path, tpl.fps, len(mels)) if vad else None
+        clip = _Clip(tpl, mels, Path(audio_path), Path(out_path), preset, max_height, voiced)
+        clip.future.add_done_callback(lambda f: f.exception() is None and self._report(clip, on_stats))
+        self.scheduler.enqueue(clip)
+        return clip.future
+
+    def _report(self, clip: _Clip, on_stats) -> None:
+        # saved time = skipped windows × current average forward cost per window
+        st = {"frames": clip.n, "inferred": clip.inferred,
+              "saved_s": round((clip.n - clip.inferred) * self.scheduler.cost_per_window(), 3)}
+        self.frames += st["frames"]
+        self.inferred += st["inferred"]
+        self.saved_s += st["saved_s"]
+        logging.info("[LIPSYNC] %s: %d/%d frames inferred, ~%.2fs saved",
+                     clip.out_path.name, st["inferred"], st["frames"], st["saved_s"])
+        if on_stats:
+            on_stats(st)
+
+    def render(self, *args: Any, **kw: Any) -> str:
+        return self.submit(*args, **kw).result()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend_name, **self.scheduler.stats(),
+                "frames": self.frames, "frames_inferred": self.inferred,
+                "vad_saved_s": round(self.saved_s, 3)}
+
+
+_engines: Dict[Tuple, LipSyncEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(backend: str = "torch", max_batch: Optional[int] = None,
+               max_wait_ms: Optional[float] = None) -> LipSyncEngine:
+    """Process-wide engine per (backend, batch settings); created on first use."""
+    key = (backend, max_batch or MAX_BATCH, MAX_WAIT_MS if max_wait_ms is None else max_wait_ms)
+    with _engines_lock:
+        eng = _engines.get(key)
+        if eng is None:
+            eng = _engines[key] = LipSyncEngine(backend, key[1], key[2])
+    return eng
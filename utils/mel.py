@@ -0,0 +1,237 @@
+# utils/mel.py — Vectorised, cached mel spectrograms for the lip-sync engine
+# --------------------------------------------------------------------------
+# The engine used to call Wav2Lip's audio.melspectrogram() per clip: librosa
+# load + resample, a fresh STFT setup and the mel filterbank rebuilt on every
+# call, and all of it again when a job is retried. This module computes the
+# same spectrogram with plain NumPy:
+#
+#   • Wav2Lip's hparams are fixed here (16 kHz, n_fft = win = 800, hop 200,
+#     80 mels 55‥7600 Hz, pre-emphasis 0.97, ref 20 dB, min −100 dB,
+#     symmetric ±4 normalisation); the periodic Hann window and the Slaney
+#     mel filterbank (librosa.filters.mel) are built once at import
+#   • melspectrograms(wavs) frames every segment of a job (centre padding,
+#     reflect — librosa.stft) into one frame matrix, so the FFT, the filterbank
+#     product and the dB / normalisation steps run once per job, not per clip
+#   • MelStore keeps results by audio digest (utils.clip_cache.file_digest) as
+#     raw float16 (80, T) files under MEL_CACHE_DIR; hits are memory-mapped,
+#     not read. Fresh results are rounded through float16 too, so a clip is
+#     rendered from identical inputs whether its mel came from the cache or not
+#
+# Only 16 kHz PCM WAVs are handled (everything utils/tts.py writes); for
+# anything else get_many() returns None and the caller falls back to
+# Wav2Lip's own audio module.
+#
+# Env:
+#   MEL_FAST=1              NumPy extractor (0 = wav2lip/audio.py per clip)
+#   MEL_CACHE=1             keep spectrograms by audio digest (0 = off)
+#   MEL_CACHE_DIR=path      default static/mel_cache
+#   MEL_CACHE_MAX_MB=256    LRU by mtime above this size
+
+from __future__ import annotations
+
+import os
+import errno
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.clip_cache import file_digest
+from utils.vad import read_wav
+
+MEL_FAST          = os.getenv("MEL_FAST", "1").strip().lower() not in {"0", "false", "no"}
+MEL_CACHE_ENABLED = os.getenv("MEL_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+MEL_CACHE_DIR     = Path(os.getenv("MEL_CACHE_DIR", "static/mel_cache")).resolve()
+MEL_CACHE_MAX_MB  = int(os.getenv("MEL_CACHE_MAX_MB", 256))
+
+# Wav2Lip hparams.py
+SAMPLE_RATE  = 16000
+N_FFT        = 800
+HOP          = 200
+WIN          = 800
+NUM_MELS     = 80
+FMIN, FMAX   = 55.0, 7600.0
+PREEMPHASIS  = 0.97
+REF_LEVEL_DB = 20.0
+MIN_LEVEL_DB = -100.0
+MAX_ABS      = 4.0
+
+FRAME_BLOCK = 4096        # STFT frames per FFT call (bounds peak memory of long jobs)
+
+__all__ = ["melspectrogram", "melspectrograms", "MelStore", "MELS", "MEL_FAST"]
+
+
+def _hz_to_mel(f: np.ndarray) -> np.ndarray:
+    """Slaney scale: linear below 1 kHz, logarithmic above (librosa, htk=False)."""
+    f = np.asanyarray(f, dtype=np.float64)
+    mel = f / (200.0 / 3)
+    log = f >= 1000.0
+    return np.where(log, 15.0 + np.log(np.maximum(f, 1e-10) / 1000.0) / (np.log(6.4) / 27.0), mel)
+
+
+def _mel_to_hz(m: np.ndarray) -> np.ndarray:
+    m = np.asanyarray(m, dtype=np.float64)
+    hz = m * (200.0 / 3)
+    log = m >= 15.0
+    return np.where(log, 1000.0 * np.exp((np.log(6.4) / 27.0) * (m - 15.0)), hz)
+
+
+def _mel_basis() -> np.ndarray:
+    """(NUM_MELS, N_FFT // 2 + 1) triangular filters, Slaney area-normalised."""
+    fft_hz = np.linspace(0, SAMPLE_RATE / 2, N_FFT // 2 + 1)
+    mel_hz = _mel_to_hz(np.linspace(_hz_to_mel(FMIN), _hz_to_mel(FMAX), NUM_MELS + 2))
+    fdiff = np.diff(mel_hz)
+    ramps = mel_hz[:, None] - fft_hz[None, :]
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    return weights * (2.0 / (mel_hz[2:] - mel_hz[:-2]))[:, None]
+
+
+_BASIS_T = np.ascontiguousarray(_mel_basis().T)                      # (401, 80)
+_WINDOW  = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(WIN) / WIN)     # periodic Hann
+_MIN_AMP = 10.0 ** (MIN_LEVEL_DB / 20.0)
+
+
+def _frames(wav: np.ndarray) -> np.ndarray:
+    """Pre-emphasised, centre-padded (T, N_FFT) frames, T = 1 + len // HOP."""
+    x = np.asarray(wav, dtype=np.float64)
+    y = x.copy()
+    y[1:] -= PREEMPHASIS * x[:-1]
+    y = np.pad(y, N_FFT // 2, mode="reflect")
+    return np.lib.stride_tricks.sliding_window_view(y, N_FFT)[::HOP]
+
+
+def _normalised(mag: np.ndarray) -> np.ndarray:
+    """(T, 401) magnitudes → (T, 80) Wav2Lip-normalised mel."""
+    db = 20.0 * np.log10(np.maximum(_MIN_AMP, mag @ _BASIS_T)) - REF_LEVEL_DB
+    return np.clip(2 * MAX_ABS * (db - MIN_LEVEL_DB) / -MIN_LEVEL_DB - MAX_ABS, -MAX_ABS, MAX_ABS)
+
+
+def melspectrograms(wavs: Sequence[np.ndarray]) -> List[np.ndarray]:
+    """16 kHz mono signals → [(80, T_i) float32], all segments in one pass."""
+    frames = [_frames(w) for w in wavs]
+    counts = [len(f) for f in frames]
+    if not counts:
+        return []
+    flat = np.concatenate(frames)
+    out = np.empty((len(flat), NUM_MELS), dtype=np.float32)
+    for s in range(0, len(flat), FRAME_BLOCK):
+        block = flat[s:s + FRAME_BLOCK] * _WINDOW
+        out[s:s + len(block)] = _normalised(np.abs(np.fft.rfft(block, n=N_FFT, axis=1)))
+    return [m.T for m in np.split(out, np.cumsum(counts)[:-1])]
+
+
+def melspectrogram(wav: np.ndarray) -> np.ndarray:
+    return melspectrograms([wav])[0]
+
+
+class MelStore:
+    """Mel spectrograms by audio digest: float16 files, memory-mapped on hit."""
+
+    def __init__(self, root: Path = MEL_CACHE_DIR, max_bytes: int = MEL_CACHE_MAX_MB << 20,
+                 enabled: bool = MEL_CACHE_ENABLED):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self.hits = self.misses = self.evictions = self.unsupported = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.mel"
+
+    def _load(self, key: str) -> Optional[np.ndarray]:
+        p = self._path(key)
+        try:
+            size = p.stat().st_size
+            if size == 0 or size % (2 * NUM_MELS):
+                return None
+            mel = np.memmap(p, dtype=np.float16, mode="r", shape=(NUM_MELS, size // (2 * NUM_MELS)))
+            os.utime(p)                        # LRU touch
+            return mel
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _store(self, key: str, mel: np.ndarray) -> None:
+        dst = self._path(key)
+        tmp = dst.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            np.ascontiguousarray(mel, dtype=np.float16).tofile(tmp)
+            os.replace(tmp, dst)
+        except OSError as e:
+            tmp.unlink(missing_ok=True)
+            logging.warning("[MEL] store failed: %s", e)
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += mel.size * 2
+        self._evict()
+
+    def get_many(self, paths: Sequence[str | Path]) -> List[Optional[np.ndarray]]:
+        """(80, T) spectrograms in the order of *paths*; misses are computed in one
+        batch. None for audio this module cannot reproduce (not 16 kHz)."""
+        out: List[Optional[np.ndarray]] = [None] * len(paths)
+        todo: Dict[str, List[int]] = {}
+        for i, p in enumerate(paths):
+            key = file_digest(p)
+            mel = self._load(key) if self.enabled else None
+            if mel is not None:
+                self.hits += 1
+                out[i] = mel
+            else:
+                todo.setdefault(key, []).append(i)
+        keys, wavs = [], []
+        for key, idx in todo.items():
+            x, sr = read_wav(paths[idx[0]])
+            if sr != SAMPLE_RATE:
+                self.unsupported += 1
+                continue
+            keys.append(key)
+            wavs.append(x)
+        for key, mel in zip(keys, melspectrograms(wavs)):
+            self.misses += 1
+            mel = mel.astype(np.float16)
+            if self.enabled:
+                self._store(key, mel)
+            for i in todo[key]:
+                out[i] = mel
+        return out
+
+    def get(self, path: str | Path) -> Optional[np.ndarray]:
+        return self.get_many([path])[0]
+
+    def _entries(self):
+        for p in self.root.glob("*/*.mel"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            yield st.st_mtime, st.st_size, p
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(sz for _, sz, _ in self._entries())
+            if self._size <= self.max_bytes:
+                return
+            for _mtime, size, p in sorted(self._entries()):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    p.unlink()
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        continue
+                self._size -= size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "unsupported": self.unsupported,
+                "evictions": self.evictions, "bytes": self._size or 0, "max_bytes": self.max_bytes}
+
+
+MELS = MelStore()
@@ -0,0 +1,155 @@
+# utils/memory_broker.py — in-process stand-in for RabbitMQ (load tests)
+# ---------------------------------------------------------------------
+# Same transport interface as celery_app._BlockingTransport and AsyncAmqp,
+# so on_message / worker_job / bulk_job run unchanged without a broker:
+#
+#   publish(routing_key, body, priority=None) → Future   (confirmed at once)
+#   ack(tag)          set_prefetch(n)          pause_intake(paused)
+#   probe(queue) → Future[(consumers, messages)]
+#   consume(queue, on_message)   on_message(broker, tag, props, body) on a
+#                                dispatcher thread, at most `prefetch`
+#                                unacknowledged deliveries (basic_qos)
+#
+# Bodies are JSON-encoded on publish, as on the wire (a result that does not
+# serialize fails here too). Queues are FIFO; with max_priority > 0 they
+# behave like x-max-priority queues (higher first, FIFO within a priority).
+#
+# subscribe(queue, callback) hands every message published to that queue
+# to callback(body: dict, props) instead of storing it — the load generator
+# watches the done queue this way. stats(): depth / max depth / published /
+# delivered per queue, unacked, prefetch, broker-side wait of deliveries.
+
+from __future__ import annotations
+
+import json
+import time
+import heapq
+import itertools
+import threading
+import concurrent.futures as futures
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+__all__ = ["MemoryBroker"]
+
+
+class _Queue:
+    def __init__(self):
+        self.heap: List[Tuple[int, int, float, Any, bytes]] = []   # (-priority, seq, t_pub, props, body)
+        self.max_depth = 0
+        self.published = 0
+        self.delivered = 0
+
+
+class MemoryBroker:
+    def __init__(self, max_priority: int = 0, prefetch: int = 1):
+        self.max_priority = max_priority
+        self.prefetch = prefetch
+        self._queues: Dict[str, _Queue] = {}
+        self._subs: Dict[str, Callable[[Dict[str, Any], Any], None]] = {}
+        self._unacked: Dict[int, str] = {}
+        self._seq = itertools.count()
+        self._tags = itertools.count(1)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self.paused = False
+        self._threads: List[threading.Thread] = []
+        self._consumers: Dict[str, int] = {}
+        self.waits: List[float] = []            # publish → delivery, seconds
+
+    def _queue(self, name: str) -> _Queue:
+        if name not in self._queues:
+            self._queues[name] = _Queue()
+        return self._queues[name]
+
+    # ------------------------------------------------------------------
+    # transport interface
+    # ------------------------------------------------------------------
+
+    def publish(self, routing_key: str, body: Dict[str, Any], priority: Optional[int] = None) -> futures.Future:
+        fut: futures.Future = futures.Future()
+        try:
+            raw = json.dumps(body).encode()
+        except Exception as e:
+            fut.set_exception(e)
+            return fut
+        prio = max(0, min(self.max_priority, int(priority or 0)))
+        props = SimpleNamespace(priority=priority, content_type="application/json", timestamp=time.time())
+        sub = self._subs.get(routing_key)
+        if sub is not None:
+            sub(json.loads(raw), props)
+        else:
+            with self._cond:
+                q = self._queue(routing_key)
+                heapq.heappush(q.heap, (-prio, next(self._seq), time.monotonic(), props, raw))
+                q.published += 1
+                q.max_depth = max(q.max_depth, len(q.heap))
+                self._cond.notify_all()
+        fut.set_result(True)
+        return fut
+
+    def ack(self, tag: int) -> None:
+        with self._cond:
+            self._unacked.pop(tag, None)
+            self._cond.notify_all()
+
+    def set_prefetch(self, n: int) -> None:
+        with self._cond:
+            self.prefetch = max(1, n)
+            self._cond.notify_all()
+
+    def probe(self, queue: str) -> futures.Future:
+        fut: futures.Future = futures.Future()
+        with self._cond:
+            q = self._queues.get(queue)
+            fut.set_result((self._consumers.get(queue, 0), len(q.heap) if q else 0))
+        return fut
+
+    def pause_intake(self, paused: bool) -> None:
+        with self._cond:
+            self.paused = paused
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # consuming
+    # ------------------------------------------------------------------
+
+    def subscribe(self, queue: str, callback: Callable[[Dict[str, Any], Any], None]) -> None:
+        self._subs[queue] = callback
+
+    def consume(self, queue: str, on_message: Callable[["MemoryBroker", int, Any, bytes], None]) -> None:
+        t = threading.Thread(target=self._dispatch, args=(queue, on_message),
+                             name=f"membroker-{queue}", daemon=True)
+        self._consumers[queue] = self._consumers.get(queue, 0) + 1
+        self._threads.append(t)
+        t.start()
+
+    def _dispatch(self, queue: str, on_message) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                q = self._queue(queue)
+                while not self._stop.is_set() and (not q.heap or self.paused
+                                                     or len(self._unacked) >= self.prefetch):
+                    self._cond.wait(0.5)
+                if self._stop.is_set():
+                    return
+                _p, _s, t_pub, props, raw = heapq.heappop(q.heap)
+                tag = next(self._tags)
+                self._unacked[tag] = queue
+                q.delivered += 1
+                self.waits.append(time.monotonic() - t_pub)
+            on_message(self, tag, props, raw)
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=2)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"prefetch": self.prefetch, "unacked": len(self._unacked), "paused": self.paused,
+                    "queues": {n: {"depth": len(q.heap), "max_depth": q.max_depth,
+                                   "published": q.published, "delivered": q.delivered}
+                               for n, q in self._queues.items()}}
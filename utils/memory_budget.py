@@ -0,0 +1,345 @@
+# utils/memory_budget.py — Per-stage memory tracking, memory budget, worker recycling
+# ----------------------------------------------------------------------------------
+# A long-running consumer used to call gc.collect() + torch.cuda.empty_cache()
+# after every clip and still grow for days (glibc keeps freed arenas, model /
+# pydub buffers fragment the heap). Instead of guessing, memory is measured:
+#
+#   MEMORY.job(job_id) → JobMemory            one per job
+#       with mem.stage("tts"): ...            RSS / GPU before, after and peak of a stage
+#       mem.mark("tts")                       same for the span since the previous mark
+#       mem.report()                          {peak_rss_mb, peak_gpu_mb, rss_delta_mb, stages}
+#   A sampler thread (every MEM_SAMPLE_S while jobs run) updates the peaks;
+#   jobs running side by side share the process, so a job's peak is the
+#   process peak during its lifetime.
+#
+#   MEMORY.check(busy) → "ok" | "pause" | "recycle"     at job boundaries
+#       pause    RSS > MEM_BUDGET_MB or GPU memory reserved > GPU_MEM_BUDGET_MB:
+#                take no new messages until below MEM_RESUME_RATIO × budget
+#                (release() is tried first); over budget with nothing running
+#                means the memory is not coming back → recycle
+#       recycle  MEM_RECYCLE_JOBS jobs done, or RSS grew MEM_RECYCLE_GROWTH_MB
+#                over the baseline (RSS after MEM_WARMUP_JOBS jobs, so the
+#                lazily loaded models do not count as growth)
+#   The consumer then stops intake, drains the jobs it holds, and exits with
+#   RECYCLE_EXIT; supervise() restarts it in a fresh process.
+#
+#   release()   gc + CUDA cache + malloc_trim (returns freed heap to the OS);
+#               run after every job (MEM_TRIM) instead of after every clip.
+#
+# Env:
+#   MEM_BUDGET_MB=0            RSS budget of the worker process (0 = off)
+#   GPU_MEM_BUDGET_MB=0        torch memory_reserved budget (0 = off)
+#   MEM_RESUME_RATIO=0.9
+#   MEM_RECYCLE_JOBS=0         recycle after this many jobs (0 = never)
+#   MEM_RECYCLE_GROWTH_MB=0    recycle after this much RSS growth (0 = never)
+#   MEM_WARMUP_JOBS=3
+#   MEM_SAMPLE_S=0.5
+#   MEM_TRIM=1
+
+from __future__ import annotations
+
+import os
+import gc
+import sys
+import time
+import ctypes
+import logging
+import threading
+import contextlib
+import multiprocessing
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+MEM_BUDGET_MB         = float(os.getenv("MEM_BUDGET_MB", 0))
+GPU_MEM_BUDGET_MB     = float(os.getenv("GPU_MEM_BUDGET_MB", 0))
+MEM_RESUME_RATIO      = float(os.getenv("MEM_RESUME_RATIO", 0.9))
+MEM_RECYCLE_JOBS      = int(os.getenv("MEM_RECYCLE_JOBS", 0))
+MEM_RECYCLE_GROWTH_MB = float(os.getenv("MEM_RECYCLE_GROWTH_MB", 0))
+MEM_WARMUP_JOBS       = int(os.getenv("MEM_WARMUP_JOBS", 3))
+MEM_SAMPLE_S          = float(os.getenv("MEM_SAMPLE_S", 0.5))
+MEM_TRIM              = os.getenv("MEM_TRIM", "1").strip().lower() not in {"0", "false", "no"}
+
+RECYCLE_EXIT = 75                     # EX_TEMPFAIL: "restart me"
+
+__all__ = ["MEMORY", "MemoryGuard", "JobMemory", "rss_mb", "gpu_mb", "release", "supervise",
+           "RECYCLE_EXIT"]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def gpu_mb() -> Optional[float]:
+    """Memory reserved by torch's CUDA allocator in this process (None without CUDA)."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None
+    try:
+        if not torch.cuda.is_initialized():
+            return None
+        return torch.cuda.memory_reserved() / 2**20
+    except Exception:
+        return None
+
+
+_libc = None
+
+
+def release() -> None:
+    """Give freed memory back: Python cycles, torch's CUDA cache, glibc heap."""
+    global _libc
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        try:
+            if torch.cuda.is_initialized():
+                torch.cuda.empty_cache()
+        except Exception:
+            pass
+    if sys.platform.startswith("linux"):
+        try:
+            if _libc is None:
+                _libc = ctypes.CDLL("libc.so.6")
+            _libc.malloc_trim(0)
+        except (OSError, AttributeError):
+            _libc = False
+
+
+def _sample() -> Tuple[float, Optional[float]]:
+    return rss_mb(), gpu_mb()
+
+
+class _Peak:
+    """Max RSS / GPU seen between open and close (fed by the sampler)."""
+
+    def __init__(self):
+        self.rss0, self.gpu0 = _sample()
+        self.rss, self.gpu = self.rss0, self.gpu0
+
+    def update(self, rss: float, gpu: Optional[float]) -> None:
+        self.rss = max(self.rss, rss)
+        if gpu is not None:
+            self.gpu = gpu if self.gpu is None else max(self.gpu, gpu)
+
+
+def _mb(x: Optional[float]) -> Optional[float]:
+    return None if x is None else round(x, 1)
+
+
+class JobMemory:
+    def __init__(self, guard: "MemoryGuard", job_id: str):
+        self.guard = guard
+        self.job_id = job_id
+        self.peak = guard._open()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.end: Optional[Tuple[float, Optional[float]]] = None
+        self._current = guard._open()
+
+    def _finish(self, name: str, p: _Peak) -> None:
+        self.guard._close(p)
+        rss, gpu = _sample()
+        p.update(rss, gpu)
+        rec = {"rss_delta_mb": _mb(rss - p.rss0), "peak_rss_mb": _mb(p.rss)}
+        if p.gpu is not None:
+            rec.update(gpu_delta_mb=_mb(gpu - p.gpu0) if gpu is not None and p.gpu0 is not None else None,
+                       peak_gpu_mb=_mb(p.gpu))
+        self.stages[name] = rec
+        self.guard._record_stage(name, rec)
+
+    def mark(self, name: str) -> None:
+        """Close the stage running since the previous mark (or the job start) as *name*."""
+        self._finish(name, self._current)
+        self._current = self.guard._open()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        p = self.guard._open()
+        try:
+            yield
+        finally:
+            self._finish(name, p)
+
+    def close(self) -> None:
+        if self.end is None:
+            self.guard._close(self._current)
+            self.guard._close(self.peak)
+            self.end = _sample()
+            self.peak.update(*self.end)
+
+    def report(self) -> Dict[str, Any]:
+        rss, _gpu = self.end or _sample()
+        out = {"peak_rss_mb": _mb(self.peak.rss), "rss_delta_mb": _mb(rss - self.peak.rss0),
+               "stages": self.stages}
+        if self.peak.gpu is not None:
+            out["peak_gpu_mb"] = _mb(self.peak.gpu)
+        return out
+
+
+class MemoryGuard:
+    """Memory of one worker process: per-stage history, budget, recycling decision."""
+
+    def __init__(self, budget_mb: float = MEM_BUDGET_MB, gpu_budget_mb: float = GPU_MEM_BUDGET_MB,
+                 recycle_jobs: int = MEM_RECYCLE_JOBS, recycle_growth_mb: float = MEM_RECYCLE_GROWTH_MB):
+        self.budget_mb = budget_mb
+        self.gpu_budget_mb = gpu_budget_mb
+        self.recycle_jobs = recycle_jobs
+        self.recycle_growth_mb = recycle_growth_mb
+        self._lock = threading.Lock()
+        self._peaks: List[_Peak] = []
+        self._sampler: Optional[threading.Thread] = None
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self.start_rss = rss_mb()
+        self.baseline_mb: Optional[float] = None
+        self.peak_rss = self.start_rss
+        self.jobs = 0
+        self.paused = False
+        self.pauses = 0
+        self.recycle_reason: Optional[str] = None
+
+    @property
+    def recycling_enabled(self) -> bool:
+        """A budget or a recycle limit is set, so check() may ask for a restart."""
+        return bool(self.budget_mb or self.gpu_budget_mb or self.recycle_jobs or self.recycle_growth_mb)
+
+    # ------------------------------------------------------------------
+    # tracking
+    # ------------------------------------------------------------------
+
+    def _open(self) -> _Peak:
+        p = _Peak()
+        with self._lock:
+            self._peaks.append(p)
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name="mem-sampler", daemon=True)
+                self._sampler.start()
+        return p
+
+    def _close(self, p: _Peak) -> None:
+        with self._lock:
+            if p in self._peaks:
+                self._peaks.remove(p)
+
+    def _sample_loop(self) -> None:
+        while True:
+            time.sleep(MEM_SAMPLE_S)
+            rss, gpu = _sample()
+            with self._lock:
+                self.peak_rss = max(self.peak_rss, rss)
+                if not self._peaks:
+                    self._sampler = None
+                    return
+                for p in self._peaks:
+                    p.update(rss, gpu)
+
+    def _record_stage(self, name: str, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            s = self._stages.setdefault(name, {"count": 0, "rss_delta_mb": 0.0, "max_peak_rss_mb": 0.0})
+            s["count"] += 1
+            s["rss_delta_mb"] += rec["rss_delta_mb"] or 0.0
+            s["max_peak_rss_mb"] = max(s["max_peak_rss_mb"], rec["peak_rss_mb"] or 0.0)
+            if rec.get("peak_gpu_mb") is not None:
+                s["max_peak_gpu_mb"] = max(s.get("max_peak_gpu_mb", 0.0), rec["peak_gpu_mb"])
+
+    @contextlib.contextmanager
+    def job(self, job_id: str) -> Iterator[JobMemory]:
+        mem = JobMemory(self, job_id)
+        try:
+            yield mem
+        finally:
+            mem.close()
+            if MEM_TRIM:
+                release()
+            rss = rss_mb()
+            with self._lock:
+                self.jobs += 1
+                self.peak_rss = max(self.peak_rss, mem.peak.rss)
+                if self.baseline_mb is None and self.jobs >= MEM_WARMUP_JOBS:
+                    self.baseline_mb = rss
+
+    # ------------------------------------------------------------------
+    # budget / recycling
+    # ------------------------------------------------------------------
+
+    def _over(self, ratio: float = 1.0) -> Optional[str]:
+        rss = rss_mb()
+        if self.budget_mb and rss > self.budget_mb * ratio:
+            return f"rss {rss:.0f} MB > {self.budget_mb * ratio:.0f} MB"
+        gpu = gpu_mb()
+        if self.gpu_budget_mb and gpu is not None and gpu > self.gpu_budget_mb * ratio:
+            return f"gpu {gpu:.0f} MB > {self.gpu_budget_mb * ratio:.0f} MB"
+        return None
+
+    def _recycle_due(self) -> Optional[str]:
+        if self.recycle_jobs and self.jobs >= self.recycle_jobs:
+            return f"{self.jobs} jobs"
+        if self.recycle_growth_mb and self.baseline_mb is not None:
+            growth = rss_mb() - self.baseline_mb
+            if growth > self.recycle_growth_mb:
+                return f"rss grew {growth:.0f} MB since warm-up"
+        return None
+
+    def check(self, busy: int) -> str:
+        """Decision at a job boundary given the number of jobs still held by the worker:
+        "ok" (take messages), "pause" (hold intake) or "recycle" (drain and restart)."""
+        if self.recycle_reason is None:
+            self.recycle_reason = self._recycle_due()
+        if self.recycle_reason is not None:
+            return "recycle"
+
+        over = self._over(MEM_RESUME_RATIO if self.paused else 1.0)
+        if over:
+            release()
+            over = self._over(MEM_RESUME_RATIO if self.paused else 1.0)
+        if over and not busy:
+            full = self._over()          # nothing running and still over the budget itself
+            if full:
+                self.recycle_reason = f"idle over budget ({full})"
+                return "recycle"
+            over = None                  # between resume threshold and budget: let work in
+        if bool(over) != self.paused:
+            self.paused = bool(over)
+            self.pauses += self.paused
+            logging.warning("[MEM] intake %s%s", "paused: " if over else "resumed", over or "")
+        return "pause" if self.paused else "ok"
+
+    def stats(self) -> Dict[str, Any]:
+        rss = rss_mb()
+        with self._lock:
+            stages = {n: {"count": int(s["count"]),
+                          "avg_rss_delta_mb": round(s["rss_delta_mb"] / max(1, s["count"]), 2),
+                          "max_peak_rss_mb": round(s["max_peak_rss_mb"], 1),
+                          **({"max_peak_gpu_mb": round(s["max_peak_gpu_mb"], 1)}
+                             if "max_peak_gpu_mb" in s else {})}
+                      for n, s in self._stages.items()}
+        return {"rss_mb": _mb(rss), "gpu_mb": _mb(gpu_mb()), "start_rss_mb": _mb(self.start_rss),
+                "peak_rss_mb": _mb(max(self.peak_rss, rss)), "baseline_mb": _mb(self.baseline_mb),
+                "growth_mb": _mb(rss - self.baseline_mb) if self.baseline_mb is not None else None,
+                "budget_mb": self.budget_mb or None, "gpu_budget_mb": self.gpu_budget_mb or None,
+                "jobs": self.jobs, "paused": self.paused, "pauses": self.pauses,
+                "recycle": self.recycle_reason, "stages": stages}
+
+
+MEMORY = MemoryGuard()
+
+
+def supervise(target: Callable[..., Any], *args: Any) -> int:
+    """Run target(*args) in a child process, start a fresh one whenever it exits with
+    RECYCLE_EXIT; any other exit code ends supervision and is returned."""
+    ctx = multiprocessing.get_context("spawn")
+    generation = 0
+    while True:
+        generation += 1
+        proc = ctx.Process(target=target, args=args, name=f"worker-{generation}")
+        proc.start()
+        try:
+            proc.join()
+        except KeyboardInterrupt:
+            proc.join()
+            return 0
+        if proc.exitcode != RECYCLE_EXIT:
+            return proc.exitcode or 0
+        logging.info("[MEM] worker recycled (generation %d) – starting a fresh process", generation)
@@ -1,5 +1,5 @@
 # utils/merge.py
-import subprocess, tempfile, os
+import subprocess, tempfile, os, struct
 
 def concat_videos(video_paths, output_path):
     """Use ffmpeg to merge MP4 files sequentially without re-encoding."""
@@ -13,8 +13,45 @@ def concat_videos(video_paths, output_path):
             "-f", "concat", "-safe", "0",
             "-i", list_path,
             "-c", "copy",
+            "-movflags", "+faststart",          # moov first → playback / seeking before full download
             output_path,
         ]
         subprocess.check_call(cmd)
     finally:
         os.remove(list_path)
+
+
+def _moov_first(path):
+    """True if the top-level moov atom precedes mdat (the file is already faststart)."""
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                return False
+            size, kind = struct.unpack(">I4s", head)
+            if kind == b"moov":
+                return True
+            if kind == b"mdat":
+                return False
+            if size == 1:                       # 64-bit atom size follows
+                size = struct.unpack(">Q", f.read(8))[0] - 8
+            elif size == 0:                     # atom runs to EOF
+                return False
+            f.seek(size - 8, os.SEEK_CUR)
+
+
+def faststart(path):
+    """Move the moov atom of an MP4 to the front (ffmpeg remux, no re-encode), in place.
+    For MP4s written by tools we do not control (inference.py)."""
+    path = str(path)
+    if _moov_first(path):
+        return path
+    tmp = path + ".faststart.mp4"
+    try:
+        subprocess.check_call(["ffmpeg", "-y", "-loglevel", "error", "-i", path,
+                               "-map", "0", "-c", "copy", "-movflags", "+faststart", tmp])
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
@@ -54,7 +54,7 @@ def parse_text(text: str):
 
     for s in sentences:
         doc = nlp(s)
-        action_id, _ = classify_sentence_structure(doc)
+        action_id, _ = classify_sentence_structure(doc, text=s)
         stanza_outputs.append({
             "sentence": s,
             "classification": action_id,
@@ -64,6 +64,26 @@ def parse_text(text: str):
     return sentences, stanza_outputs
 
 
+def parse_texts(texts):
+    """parse_text for many texts at once (bulk jobs).
+
+    Every text is split first; each *distinct* segment then goes through
+    stanza once, in a single bulk_process call, and is classified once, so
+    repeated phrases across a batch share one analysis (and one action ID).
+
+    Returns (segments per text, {segment: analysis}).
+    """
+    split = [_smart_split(t) for t in texts]
+    unique = list(dict.fromkeys(s for segs in split for s in segs))
+    docs = nlp.bulk_process(unique) if unique else []
+
+    analysis = {}
+    for s, doc in zip(unique, docs):
+        action_id, _ = classify_sentence_structure(doc, text=s)
+        analysis[s] = {"sentence": s, "classification": action_id, "structure": "N/A"}
+    return split, analysis
+
+
 
 # import stanza
 # from utils.classify import classify_sentence_structure
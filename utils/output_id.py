@@ -1,23 +1,36 @@
 """
 OutputLogger — Records results that are only known after each small clip is completed.
-Write JSON Lines：static/logs/session_<ts>_clips.jsonl
+Write JSON Lines：static/logs/session_<ts>_<id>_clips.jsonl
+(batched writes, flushed by the pipelines at stage boundaries and when a job
+ends, also on failure; mirrored into the JobStore as kind="clips" when given one)
 """
 
 from __future__ import annotations
-import json, datetime
+import uuid, datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
+
+from utils.job_store import JobStore, JSONLBuffer
 
 class OutputLogger:
-    def __init__(self, log_dir: Path):
+    def __init__(self, log_dir: Path, job_id: Optional[str] = None,
+                 store: Optional[JobStore] = None):
         log_dir.mkdir(parents=True, exist_ok=True)
         ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        self._path = log_dir / f"session_{ts}_clips.jsonl"
+        suffix = (job_id or uuid.uuid4().hex)[:8]
+        self._path = log_dir / f"session_{ts}_{suffix}_clips.jsonl"
+        self._buf = JSONLBuffer(self._path)
+        self._job_id = job_id
+        self._store = store if job_id else None
 
     def add_entry(self, **payload: Any) -> None:
-        with self._path.open("a", encoding="utf-8") as fp:
-            json.dump(payload, fp, ensure_ascii=False)
-            fp.write("\n")
+        self._buf.append(payload)
+        if self._store:
+            self._store.add_event(self._job_id, "clips", payload)
+
+    def flush(self) -> None:
+        self._buf.flush()
 
     def file_path(self) -> str:
+        self._buf.flush()
         return str(self._path)
@@ -0,0 +1,100 @@
+# utils/partials.py — Batched per-segment partial results for the done queue
+# ---------------------------------------------------------------------------
+# Consumers of the done queue used to get nothing until every clip of a job
+# was rendered, uploaded and merged. With partial results on (payload
+# "partial": true, or RMQ_PARTIAL=1 for every job) the worker reports each
+# segment as soon as its clip is uploaded:
+#
+#   {"status": "partial", "page_id": …, "content_id": …, "text_id": …,
+#    "total": <segments>, "segments": [{"index", "clip", "duration", "action_id"}, …]}
+#
+# followed by the usual final message. Segments finishing close together go
+# out in one message: the first one opens a window of RMQ_PARTIAL_BATCH_MS,
+# a batch of RMQ_PARTIAL_MAX_SEGMENTS is sent at once, and close() flushes
+# the rest before the final message is published (same channel, so the
+# broker keeps the order).
+#
+# Env:
+#   RMQ_PARTIAL=0                  partial results for all jobs (else per payload)
+#   RMQ_PARTIAL_BATCH_MS=500
+#   RMQ_PARTIAL_MAX_SEGMENTS=16
+
+from __future__ import annotations
+
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+PARTIAL_DEFAULT      = os.getenv("RMQ_PARTIAL", "0").strip().lower() in {"1", "true", "yes"}
+PARTIAL_BATCH_MS     = float(os.getenv("RMQ_PARTIAL_BATCH_MS", 500))
+PARTIAL_MAX_SEGMENTS = int(os.getenv("RMQ_PARTIAL_MAX_SEGMENTS", 16))
+
+__all__ = ["PartialBatcher", "wants_partials", "PARTIAL_DEFAULT"]
+
+
+def wants_partials(payload: Dict[str, Any]) -> bool:
+    value = payload.get("partial", PARTIAL_DEFAULT)
+    if isinstance(value, str):
+        return value.strip().lower() in {"1", "true", "yes"}
+    return bool(value)
+
+
+class PartialBatcher:
+    """Collects segment records and publishes them in small batches."""
+
+    def __init__(self, publish: Callable[[Dict[str, Any]], Any], base: Dict[str, Any],
+                 window_ms: float = PARTIAL_BATCH_MS, max_segments: int = PARTIAL_MAX_SEGMENTS):
+        self.publish = publish
+        self.base = base
+        self.window_s = window_ms / 1000.0
+        self.max_segments = max(1, max_segments)
+        self.total: Optional[int] = None
+        self._pending: List[Dict[str, Any]] = []
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.messages = self.segments = 0
+
+    def add(self, segment: Dict[str, Any], total: Optional[int] = None) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            if total is not None:
+                self.total = total
+            self._pending.append(segment)
+            full = len(self._pending) >= self.max_segments
+            if not full and self._timer is None and self.window_s > 0:
+                self._timer = threading.Timer(self.window_s, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full or self.window_s <= 0:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not batch:
+                return
+            self.messages += 1
+            self.segments += len(batch)
+            body = {**self.base, "status": "partial", "total": self.total,
+                    "segments": sorted(batch, key=lambda s: s["index"])}
+            # publish under the lock: batches reach the transport in order
+            try:
+                fut = self.publish(body)
+            except Exception as e:
+                logging.warning("[PARTIAL] publish failed: %s", e)
+                return
+        if fut is not None and hasattr(fut, "add_done_callback"):
+            fut.add_done_callback(lambda f: f.exception() is not None and
+                                  logging.warning("[PARTIAL] not confirmed: %s", f.exception()))
+
+    def close(self) -> None:
+        """Send what is pending; later add() calls are ignored (the final message follows)."""
+        with self._lock:
+            self._closed = True
+        self.flush()
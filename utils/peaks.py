@@ -0,0 +1,139 @@
+# utils/peaks.py — Precomputed multi-resolution waveform peaks
+# -------------------------------------------------------------
+# The editor used to let wavesurfer.js download and decode every WAV just to
+# draw it. Each synthesized WAV (and each merged track) now gets a small
+# "<name>.peaks" file next to it; the UI fetches one resolution of it, draws
+# instantly and streams the audio itself lazily through a media element.
+#
+#   write_peaks(wav)                  → <wav>.peaks
+#   write_merged_peaks(wavs, out)     → peaks of the concatenated segments
+#   load_level(peaks_path, pixels)    → {duration, sample_rate, samples_per_bucket, bits, data}
+#                                       data = [min0, max0, min1, max1, …] as ints
+#
+# Levels: PEAKS_BASE samples per bucket, each next level ×4 coarser (min of
+# mins / max of maxes of the finer level, so all levels are exact). Values are
+# int8 (PEAKS_BITS=8, ±127) or int16 (±32767).
+#
+# File layout (little-endian):
+#   "PEAK" u8 version u8 bits u16 n_levels u32 sample_rate u32 n_samples
+#   n_levels × (u32 samples_per_bucket, u32 n_buckets)
+#   level data in the same order, interleaved min/max
+#
+# Env:
+#   AUDIO_PEAKS=1        write peaks files (0 = off)
+#   PEAKS_BITS=8         8 / 16
+#   PEAKS_BASE=64        samples per bucket of the finest level (250 buckets/s at 16 kHz)
+#   PEAKS_LEVELS=4
+
+from __future__ import annotations
+
+import os
+import struct
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from utils.vad import read_wav
+
+PEAKS_ENABLED = os.getenv("AUDIO_PEAKS", "1").strip().lower() not in {"0", "false", "no"}
+PEAKS_BITS    = int(os.getenv("PEAKS_BITS", 8))
+PEAKS_BASE    = int(os.getenv("PEAKS_BASE", 64))
+PEAKS_LEVELS  = int(os.getenv("PEAKS_LEVELS", 4))
+
+MAGIC, VERSION, FACTOR = b"PEAK", 1, 4
+_HEAD  = struct.Struct("<4sBBHII")
+_LEVEL = struct.Struct("<II")
+
+__all__ = ["compute_peaks", "write_peaks", "write_merged_peaks", "load_level", "peaks_path",
+           "PEAKS_ENABLED"]
+
+PathLike = Union[str, Path]
+
+
+def peaks_path(path: PathLike) -> Path:
+    """foo.wav / foo.mp4 → foo.peaks"""
+    return Path(path).with_suffix(".peaks")
+
+
+def compute_peaks(x: np.ndarray, base: int = PEAKS_BASE, levels: int = PEAKS_LEVELS,
+                  bits: int = PEAKS_BITS) -> List[Tuple[int, np.ndarray]]:
+    """float samples (-1‥1) → [(samples_per_bucket, int array [n_buckets, 2] of min/max)]."""
+    scale = 127 if bits == 8 else 32767
+    n = -(-len(x) // base) * base
+    frames = np.zeros(max(n, base), np.float32)
+    frames[:len(x)] = x
+    frames = frames.reshape(-1, base)
+    mins, maxs = frames.min(axis=1), frames.max(axis=1)
+
+    out = []
+    spb = base
+    for _ in range(max(1, levels)):
+        q = np.stack([mins, maxs], axis=1) * scale
+        out.append((spb, np.clip(np.round(q), -scale, scale).astype(np.int8 if bits == 8 else "<i2")))
+        if len(mins) <= 1:
+            break
+        m = -(-len(mins) // FACTOR) * FACTOR          # pad with neutral values
+        mins = np.concatenate([mins, np.full(m - len(mins), np.inf, np.float32)]).reshape(-1, FACTOR).min(axis=1)
+        maxs = np.concatenate([maxs, np.full(m - len(maxs), -np.inf, np.float32)]).reshape(-1, FACTOR).max(axis=1)
+        spb *= FACTOR
+    return out
+
+
+def _write(path: Path, x: np.ndarray, sr: int) -> Path:
+    levels = compute_peaks(x)
+    tmp = path.with_name(path.name + ".part")
+    with open(tmp, "wb") as f:
+        f.write(_HEAD.pack(MAGIC, VERSION, PEAKS_BITS, len(levels), sr, len(x)))
+        for spb, q in levels:
+            f.write(_LEVEL.pack(spb, len(q)))
+        for _spb, q in levels:
+            f.write(q.tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def write_peaks(wav_path: PathLike) -> Path | None:
+    """<wav>.peaks next to a WAV; failures are logged, never raised (display only)."""
+    if not PEAKS_ENABLED:
+        return None
+    try:
+        x, sr = read_wav(wav_path)
+        return _write(peaks_path(wav_path), x, sr)
+    except Exception as e:
+        logging.warning("[PEAKS] %s: %s", wav_path, e)
+        return None
+
+
+def write_merged_peaks(wav_paths: Sequence[PathLike], out_path: PathLike) -> Path | None:
+    """Peaks of the segment WAVs played back to back (the merged video's track)."""
+    if not PEAKS_ENABLED or not wav_paths:
+        return None
+    try:
+        parts = [read_wav(p) for p in wav_paths]
+        sr = parts[0][1]
+        return _write(peaks_path(out_path), np.concatenate([x for x, _ in parts]), sr)
+    except Exception as e:
+        logging.warning("[PEAKS] merged %s: %s", out_path, e)
+        return None
+
+
+def load_level(path: PathLike, pixels: int = 0) -> Dict[str, Any]:
+    """The coarsest level with at least *pixels* buckets (finest if none has)."""
+    with open(path, "rb") as f:
+        magic, version, bits, n_levels, sr, n_samples = _HEAD.unpack(f.read(_HEAD.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a peaks file: {path}")
+        table = [_LEVEL.unpack(f.read(_LEVEL.size)) for _ in range(n_levels)]
+        width = 1 if bits == 8 else 2
+        offset = f.tell()
+        pick = 0
+        for k, (_spb, n) in enumerate(table):
+            if n >= pixels:
+                pick = k
+        f.seek(offset + sum(n * 2 * width for _spb, n in table[:pick]))
+        spb, n = table[pick]
+        data = np.frombuffer(f.read(n * 2 * width), np.int8 if bits == 8 else "<i2")
+    return {"duration": n_samples / sr, "sample_rate": sr, "samples_per_bucket": spb,
+            "bits": bits, "data": data.tolist()}
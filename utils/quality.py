@@ -0,0 +1,142 @@
+# utils/quality.py — Render quality tiers + background final upgrades
+# -------------------------------------------------------------------
+# Every lip-sync request picks a tier:
+#
+#   tier      resize_factor  face enhance   x264 preset  max height
+#   draft          4             —          ultrafast       360
+#   standard       3             —          medium          —      (old fixed settings)
+#   final          1          GFPGAN+seg    slow            —      (old cli.run_clip settings)
+#
+# resize_factor / enhancement are inference.py flags (wav2lip_flags); preset
+# and max height apply where we run the encoder ourselves (lipsync_engine).
+# Face enhancement only exists in inference.py, so "final" always renders
+# through the subprocess path.
+#
+# A draft can be returned within seconds and upgraded later: UPGRADER runs
+# queued final renders on one background thread that
+#   • waits until no foreground job is running (UPGRADER.foreground()),
+#   • runs at a lower OS priority (nice UPGRADE_NICE; inherited by the
+#     inference.py subprocesses it starts).
+#
+# Env:
+#   QUALITY_TIER=standard   default tier when a request names none
+#   UPGRADE_NICE=10         niceness of the background upgrade thread
+
+from __future__ import annotations
+
+import os
+import queue
+import logging
+import threading
+import contextlib
+import concurrent.futures as futures
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Union
+
+QUALITY_TIER = os.getenv("QUALITY_TIER", "standard").strip().lower()
+UPGRADE_NICE = int(os.getenv("UPGRADE_NICE", 10))
+
+__all__ = ["Tier", "TIERS", "get_tier", "wav2lip_flags", "encoder_args", "Upgrader", "UPGRADER"]
+
+
+class Tier(NamedTuple):
+    name: str
+    resize_factor: int
+    enhance_face: bool
+    preset: str
+    max_height: int          # 0 = keep template resolution
+
+
+TIERS: Dict[str, Tier] = {
+    "draft":    Tier("draft", 4, False, "ultrafast", 360),
+    "standard": Tier("standard", 3, False, "medium", 0),
+    "final":    Tier("final", 1, True, "slow", 0),
+}
+
+
+def get_tier(tier: Union[str, Tier, None] = None) -> Tier:
+    """Tier by name (None → QUALITY_TIER); ValueError for unknown names."""
+    if isinstance(tier, Tier):
+        return tier
+    name = (tier or QUALITY_TIER).strip().lower()
+    try:
+        return TIERS[name]
+    except KeyError:
+        raise ValueError(f"unknown quality tier {name!r} (have {', '.join(TIERS)})") from None
+
+
+def wav2lip_flags(tier: Tier, wav2lip_dir: Path) -> List[str]:
+    """inference.py flags for *tier*."""
+    flags = ["--resize_factor", str(tier.resize_factor)]
+    if tier.enhance_face:
+        flags += ["--segmentation_path", str(wav2lip_dir / "checkpoints/face_segmentation.pth"),
+                  "--enhance_face", "gfpgan"]
+    return flags
+
+
+def encoder_args(tier: Tier) -> List[str]:
+    """ffmpeg video-encoder args for *tier* (preset + optional downscale)."""
+    args = ["-preset", tier.preset]
+    if tier.max_height:
+        args += ["-vf", f"scale=-2:min(ih\\,{tier.max_height})"]
+    return args
+
+
+class Upgrader:
+    """One low-priority worker thread for deferred final renders."""
+
+    def __init__(self, nice: int = UPGRADE_NICE):
+        self.nice = nice
+        self._q: "queue.Queue[tuple]" = queue.Queue()
+        self._cond = threading.Condition()
+        self._foreground = 0
+        self._thread: Optional[threading.Thread] = None
+        self.done = self.failed = 0
+
+    @contextlib.contextmanager
+    def foreground(self):
+        """Mark a user-facing job as running; upgrades do not start meanwhile."""
+        with self._cond:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kw: Any) -> futures.Future:
+        fut: futures.Future = futures.Future()
+        self._q.put((fut, fn, args, kw))
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="quality-upgrader", daemon=True)
+                self._thread.start()
+        return fut
+
+    def _run(self) -> None:
+        try:                                   # per-thread on Linux; children inherit it
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError) as e:
+            logging.warning("[UPGRADE] cannot lower priority: %s", e)
+        while True:
+            fut, fn, args, kw = self._q.get()
+            with self._cond:
+                while self._foreground:
+                    self._cond.wait()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(fn(*args, **kw))
+                self.done += 1
+            except BaseException as exc:
+                logging.exception("[UPGRADE] final render failed")
+                fut.set_exception(exc)
+                self.failed += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._q.qsize(), "foreground": self._foreground,
+                "done": self.done, "failed": self.failed}
+
+
+UPGRADER = Upgrader()
@@ -0,0 +1,176 @@
+# utils/result_cache.py — Whole-job result cache with in-flight dedup
+# -------------------------------------------------------------------
+# Re-submitting the same text (editor saves, retries, re-publishes) used to
+# render everything again. Finished job results are now stored in the
+# JobStore under
+#
+#   job_key(text, gender, lang, use_avatar, merge, templates, quality, tts)
+#
+# where text is Unicode-normalised and whitespace-collapsed. Entries are
+# valid only for the current version_tag(), which changes whenever the
+# Wav2Lip checkpoint or the template set changes (or RESULT_CACHE_VERSION is
+# bumped), so a model/template update invalidates everything at once.
+#
+# Concurrent identical requests coalesce: the first one runs, the others
+# wait for its result (or its exception) instead of rendering in parallel.
+#
+# Env:
+#   RESULT_CACHE=0            disable lookups and stores
+#   RESULT_CACHE_VERSION=...  manual invalidation tag (default "1")
+#   RESULT_CACHE_TTL=SECONDS  optional maximum age of an entry
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+import concurrent.futures as futures
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils.job_store import get_store
+from utils.classify import ASSIGNMENT_POLICY
+from utils.quality import get_tier
+from utils.tts import TTS_BACKEND
+from utils.video_utils import TEMPLATE_DIR, WAV2LIP_DIR
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+RESULT_CACHE_VERSION = os.getenv("RESULT_CACHE_VERSION", "1").strip()
+RESULT_CACHE_TTL     = float(os.getenv("RESULT_CACHE_TTL", 0)) or None
+
+CHECKPOINT_PATH = WAV2LIP_DIR / "checkpoints/wav2lip_gan.pth"
+
+__all__ = ["job_key", "version_tag", "ResultCache", "RESULT_CACHE"]
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def job_key(text: str, gender: str, lang: str, use_avatar: bool, merge: bool,
+            templates: str = ASSIGNMENT_POLICY, quality: Optional[str] = None,
+            tts: Optional[str] = None) -> str:
+    """Stable hash of everything that determines a job's output.
+
+    templates: how actions are assigned ("random" / "hash", see
+    utils.classify, or an explicit assignment such as "3,7,1").
+    quality: render tier (utils.quality); None = the default tier.
+    tts: TTS backend (utils.tts); None = TTS_BACKEND. Edge-TTS keys carry no
+    "tts" field, so they match keys stored before backends were selectable.
+    """
+    fields = {
+        "text": normalize_text(text), "gender": str(gender).lower(), "lang": str(lang).lower(),
+        "use_avatar": bool(use_avatar), "merge": bool(merge), "templates": templates,
+        "quality": get_tier(quality).name,
+    }
+    tts = (tts or TTS_BACKEND).strip().lower()
+    if tts != "edge":
+        fields["tts"] = tts
+    blob = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _stat_sig(path) -> str:
+    try:
+        st = os.stat(path)
+        return f"{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return "-"
+
+
+def version_tag() -> str:
+    """Manual tag + checkpoint signature + template-set signature."""
+    tpl = sorted(
+        f"{p.name}:{_stat_sig(p)}" for p in TEMPLATE_DIR.glob("*.mp4")
+    ) if TEMPLATE_DIR.exists() else []
+    sig = hashlib.sha1("|".join([_stat_sig(CHECKPOINT_PATH), *tpl]).encode()).hexdigest()[:12]
+    return f"{RESULT_CACHE_VERSION}-{sig}"
+
+
+class ResultCache:
+    """Store-backed result cache + single-flight execution per key."""
+
+    def __init__(self, enabled: bool = RESULT_CACHE_ENABLED, ttl: Optional[float] = RESULT_CACHE_TTL):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._inflight: Dict[str, futures.Future] = {}
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self.hits = self.misses = self.coalesced = 0
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = version_tag()
+        return self._version
+
+    def refresh_version(self) -> str:
+        """Recompute the version tag (call after deploying new templates/model)."""
+        self._version = version_tag()
+        return self._version
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        store = get_store()
+        if not self.enabled or store is None:
+            return None
+        return store.get_result(key, self.version, self.ttl)
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        store = get_store()
+        if self.enabled and store is not None:
+            store.put_result(key, self.version, result)
+
+    def get_or_run(
+        self,
+        key: str,
+        fn: Callable[[], Dict[str, Any]],
+        cacheable: Callable[[Dict[str, Any]], bool] = lambda r: True,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Return (result, from_cache). Identical concurrent calls share one run."""
+        if not self.enabled:
+            return fn(), False
+
+        hit = self.get(key)
+        if hit is not None:
+            self.hits += 1
+            return hit, True
+
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = futures.Future()
+        if not owner:
+            self.coalesced += 1
+            return fut.result(), True
+
+        self.misses += 1
+        try:
+            result = fn()
+        except BaseException as exc:
+            fut.set_exception(exc)
+            raise
+        else:
+            if cacheable(result):
+                try:
+                    self.put(key, result)
+                except Exception as e:
+                    logging.warning("[CACHE] store failed: %s", e)
+            fut.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "version": self.version, "hits": self.hits,
+                "misses": self.misses, "coalesced": self.coalesced,
+                "inflight": len(self._inflight)}
+
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,222 @@
+# utils/trace.py — Per-job span recorder (Chrome trace + optional OTLP)
+# --------------------------------------------------------------------
+# Records nested spans for every pipeline stage / segment / subprocess
+# and writes them next to the job's JSONL logs as a Chrome-trace file
+# (open in chrome://tracing or https://ui.perfetto.dev).
+#
+# • start_trace(job_id, log_dir) → Tracer, or NULL_TRACER when disabled
+# • with tracer.span("tts", index=3): ...
+# • tracer.export() → path of session_<ts>_trace.json (+ OTLP push)
+#
+# Env:
+#   TRACE_ENABLED=1            turn recording on (off by default)
+#   TRACE_OTLP_ENDPOINT=URL    also POST spans as OTLP/HTTP JSON to
+#                              <URL>/v1/traces (e.g. http://127.0.0.1:4318)
+#
+# When disabled, span() hands back one shared no-op context manager, so the
+# cost per call is a single attribute lookup.
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import uuid
+import logging
+import datetime
+import threading
+import contextlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "0").strip().lower() in {"1", "true", "yes"}
+OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "").strip().rstrip("/")
+SERVICE_NAME  = os.getenv("TRACE_SERVICE_NAME", "avatar-enu")
+
+__all__ = ["Tracer", "NULL_TRACER", "start_trace"]
+
+
+class Tracer:
+    """Collect spans of one job in memory; export them once at the end."""
+
+    def __init__(self, job_id: str, log_dir: Optional[Path] = None):
+        self.job_id = job_id
+        self._log_dir = log_dir
+        self._trace_id = uuid.uuid4().hex                  # 32 hex chars (OTLP)
+        self._spans: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()                    # per-thread parent stack
+        # perf_counter is monotonic; anchor it to wall-clock once
+        self._wall0_ns = time.time_ns()
+        self._perf0_ns = time.perf_counter_ns()
+        self._path: Optional[Path] = None
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def now_ns(self) -> int:
+        return self._wall0_ns + (time.perf_counter_ns() - self._perf0_ns)
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str = "stage", **args: Any) -> Iterator[None]:
+        """Time the enclosed block as one span (nested spans get a parent)."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        span_id = uuid.uuid4().hex[:16]
+        parent = stack[-1] if stack else None
+        stack.append(span_id)
+        start = self.now_ns()
+        error: Optional[str] = None
+        try:
+            yield
+        except BaseException as exc:
+            error = repr(exc)
+            raise
+        finally:
+            end = self.now_ns()
+            stack.pop()
+            if error:
+                args["error"] = error
+            self._record(name, cat, start, end, span_id, parent, args)
+
+    def add_span(self, name: str, start_ns: int, end_ns: int,
+                 cat: str = "stage", **args: Any) -> None:
+        """Record a span measured elsewhere (wall-clock ns, e.g. queue waits)."""
+        stack = getattr(self._local, "stack", None) or []
+        parent = stack[-1] if stack else None
+        self._record(name, cat, start_ns, end_ns, uuid.uuid4().hex[:16], parent, args)
+
+    def _record(self, name, cat, start, end, span_id, parent, args) -> None:
+        th = threading.current_thread()
+        with self._lock:
+            self._threads.setdefault(th.ident or 0, th.name)
+            self._spans.append({
+                "name": name, "cat": cat, "start": start, "end": end,
+                "tid": th.ident or 0, "span_id": span_id, "parent": parent,
+                "args": args,
+            })
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self._spans)
+            threads = dict(self._threads)
+        events: List[Dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+             "args": {"name": tname}}
+            for tid, tname in threads.items()
+        ]
+        for s in spans:
+            events.append({
+                "name": s["name"], "cat": s["cat"], "ph": "X", "pid": pid, "tid": s["tid"],
+                "ts": s["start"] / 1000.0, "dur": (s["end"] - s["start"]) / 1000.0,
+                "args": {k: _jsonable(v) for k, v in s["args"].items()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"job_id": self.job_id, "trace_id": self._trace_id}}
+
+    def otlp_payload(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self._spans)
+        otlp_spans = []
+        for s in spans:
+            attrs = [{"key": "job.id", "value": {"stringValue": self.job_id}}]
+            attrs += [{"key": k, "value": _otlp_value(v)} for k, v in s["args"].items()]
+            span = {
+                "traceId": self._trace_id, "spanId": s["span_id"], "name": s["name"],
+                "kind": 1,  # INTERNAL
+                "startTimeUnixNano": str(s["start"]), "endTimeUnixNano": str(s["end"]),
+                "attributes": attrs,
+            }
+            if s["parent"]:
+                span["parentSpanId"] = s["parent"]
+            if "error" in s["args"]:
+                span["status"] = {"code": 2, "message": str(s["args"]["error"])}
+            otlp_spans.append(span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "utils.trace"}, "spans": otlp_spans}],
+        }]}
+
+    def export(self) -> Optional[str]:
+        """Write the Chrome-trace JSON (and push OTLP if configured)."""
+        if self._log_dir is not None:
+            self._log_dir.mkdir(parents=True, exist_ok=True)
+            ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+            self._path = self._log_dir / f"session_{ts}_trace.json"
+            with self._path.open("w", encoding="utf-8") as fp:
+                json.dump(self.chrome_trace(), fp, ensure_ascii=False)
+        if OTLP_ENDPOINT:
+            _post_otlp(self.otlp_payload())
+        return self.file_path()
+
+    def file_path(self) -> Optional[str]:
+        return str(self._path) if self._path else None
+
+
+class _NullTracer:
+    """Drop-in Tracer that records nothing."""
+
+    job_id = ""
+    _NULL = contextlib.nullcontext()
+
+    def span(self, name: str, cat: str = "stage", **args: Any):
+        return self._NULL
+
+    def add_span(self, *a: Any, **kw: Any) -> None:
+        pass
+
+    def now_ns(self) -> int:
+        return 0
+
+    def export(self) -> None:
+        return None
+
+    def file_path(self) -> None:
+        return None
+
+
+NULL_TRACER = _NullTracer()
+
+
+def start_trace(job_id: str, log_dir: Optional[Path] = None) -> Tracer | _NullTracer:
+    """Return a recording tracer if TRACE_ENABLED, otherwise NULL_TRACER."""
+    if not TRACE_ENABLED:
+        return NULL_TRACER
+    return Tracer(job_id, log_dir)
+
+
+# ---------------------------------------------------------------------------
+# helpers
+# ---------------------------------------------------------------------------
+
+def _jsonable(v: Any) -> Any:
+    return v if isinstance(v, (str, int, float, bool, type(None))) else str(v)
+
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def _post_otlp(payload: Dict[str, Any]) -> None:
+    try:
+        import requests
+        r = requests.post(f"{OTLP_ENDPOINT}/v1/traces", json=payload, timeout=5)
+        if r.status_code >= 300:
+            logging.warning("[TRACE] OTLP HTTP %s %s", r.status_code, r.text[:120])
+    except Exception as e:
+        logging.warning("[TRACE] OTLP export failed: %s", e)
@@ -1,25 +1,86 @@
-# utils/tts.py — Multilingual Edge‑TTS integration
-# -----------------------------------------------
+# utils/tts.py — Multilingual TTS integration (pluggable backends)
+# -----------------------------------------------------------------
 # Generates **16‑kHz mono WAV** files compatible with Wav2Lip.
 #
-# • synthesize_speech(text, output_path, gender="m", lang="kk")
+# • synthesize_speech(text, output_path, gender="m", lang="kk", backend=None)
 #     gender: "m" / "f" → choose gender
 #     lang: "kk" / "ru" / "en"
+#     backend: "edge" / "edge-stream" / "vits" (None → TTS_BACKEND); selectable per request
 #
 # • Also supports full Edge-TTS voice ID directly as gender argument.
 #
-# Requirements (pip):  edge-tts  pydub  ffmpeg/avlib in PATH.
+# • synthesize_many([(text, output_path, gender, lang), ...], backend=None)
+#     many utterances in one call (bulk jobs, utils/bulk.py); per-item
+#     exceptions are returned, not raised.
+#
+# • Both write <name>.peaks next to every WAV (waveform display, utils/peaks.py).
+#
+# Backends (TTSBackend: synthesize / synthesize_many):
+#   edge  — Edge-TTS over the network; synthesize_many runs all utterances
+#           on one event loop, requests in flight bounded by the "tts" limit.
+#   vits  — local VITS (facebook/mms-tts-*) on CPU, network-free. The model
+#           is loaded once per language; utterances are sorted by length and
+#           run TTS_VITS_BATCH at a time as one padded tensor, the waveform
+#           is written directly as 16 kHz PCM (no MP3 round-trip). MMS voices
+#           are single-speaker: gender is ignored. The noise seed is fixed,
+#           so the same batch gives the same audio (clip cache hits).
+#   edge-stream — Edge-TTS, one stream per job instead of one session per
+#           segment: consecutive utterances with the same voice are joined
+#           (up to TTS_STREAM_MAX_CHARS), synthesized in one request with
+#           WordBoundary events, decoded once, and the PCM is cut between the
+#           last word of a segment and the first word of the next (middle of
+#           the pause). Fewer handshakes, consistent prosody across segments.
+#           A chunk whose words cannot be aligned falls back to per-segment
+#           requests.
+#   router / fake — hedging + circuit breaker across backends and a
+#           network-free stand-in, see utils/tts_router.py
+#
+# Env:
+#   TTS_BACKEND=edge              default backend
+#   TTS_CONCURRENCY=4             initial Edge-TTS requests in flight, process-wide; adjusted
+#                                 by the "tts" stage controller (utils/concurrency.py)
+#   TTS_STREAM_MAX_CHARS=2000     edge-stream: characters per joined request
+#   TTS_VITS_MODEL=facebook/mms-tts-kaz   Kazakh VITS checkpoint (ru / en: mms-tts-rus / -eng)
+#   TTS_VITS_THREADS=<cpu count>  torch intra-op threads for VITS
+#   TTS_VITS_BATCH=8              utterances per VITS forward pass
+#
+# Requirements (pip):  edge-tts  pydub  ffmpeg/avlib in PATH; vits: torch  transformers.
 
 from __future__ import annotations
 
+import io
+import os
+import wave
+import importlib
 import asyncio
+import logging
 import tempfile
+import threading
 from pathlib import Path
-from typing import Literal, Union
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import edge_tts
 from pydub import AudioSegment
 
+from utils.peaks import write_peaks
+from utils.concurrency import Limiter, limiter
+
+TTS_BACKEND      = os.getenv("TTS_BACKEND", "edge").strip().lower()
+TTS_CONCURRENCY  = int(os.getenv("TTS_CONCURRENCY", 4))
+STREAM_MAX_CHARS = int(os.getenv("TTS_STREAM_MAX_CHARS", 2000))
+VITS_THREADS     = int(os.getenv("TTS_VITS_THREADS", os.cpu_count() or 1))
+VITS_BATCH       = int(os.getenv("TTS_VITS_BATCH", 8))
+VITS_MODELS = {
+    "kk": os.getenv("TTS_VITS_MODEL", "facebook/mms-tts-kaz"),
+    "ru": "facebook/mms-tts-rus",
+    "en": "facebook/mms-tts-eng",
+}
+VITS_SEED   = 0
+SAMPLE_RATE = 16000
+
+__all__ = ["synthesize_speech", "synthesize_many", "get_backend", "backend_stats", "TTSBackend",
+           "EdgeBackend", "EdgeStreamBackend", "VitsBackend", "BACKENDS", "TTS_BACKEND"]
 
 VOICE_MAP = {
     "kk": {
@@ -43,11 +104,322 @@ async def _edge_tts_to_mp3(text: str, voice: str, mp3_path: Path):
     await comm.save(str(mp3_path))
 
 
+def _voice_id(voice_gender: str, lang: str) -> str:
+    return VOICE_MAP.get(lang.lower(), {}).get(str(voice_gender).lower(), voice_gender)
+
+
+def _temp_mp3() -> Path:
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp_mp3:
+        return Path(tmp_mp3.name)
+
+
+def _mp3_to_wav(mp3_path: Path, output_path: Union[str, Path]) -> str:
+    """MP3 → WAV (16 kHz mono) using pydub; removes the MP3."""
+    wav_path = Path(output_path)
+    wav_path.parent.mkdir(parents=True, exist_ok=True)
+    audio = AudioSegment.from_file(mp3_path)
+    audio = audio.set_frame_rate(16000).set_channels(1)
+    audio.export(wav_path, format="wav")
+    mp3_path.unlink(missing_ok=True)
+    return str(wav_path)
+
+
+def _write_wav(path: Union[str, Path], x: np.ndarray, sr: int = SAMPLE_RATE) -> str:
+    """float waveform (-1‥1) → 16-bit PCM mono WAV at SAMPLE_RATE."""
+    if sr != SAMPLE_RATE and len(x):
+        n = int(round(len(x) * SAMPLE_RATE / sr))
+        x = np.interp(np.arange(n) * (sr / SAMPLE_RATE), np.arange(len(x)), x)
+    pcm = (np.clip(x, -1.0, 1.0) * 32767).astype("<i2")
+    wav_path = Path(path)
+    wav_path.parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(str(wav_path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm.tobytes())
+    return str(wav_path)
+
+
+Utterance = Tuple[str, Union[str, Path], str, str]   # (text, output_path, gender, lang)
+Result    = Union[str, BaseException]
+
+
+class TTSBackend:
+    """One utterance → 16 kHz mono WAV; subclasses may batch synthesize_many."""
+
+    name = "base"
+    batched = False          # True → one synthesize_many call is much cheaper than a loop
+
+    def synthesize(self, text: str, output_path: Union[str, Path],
+                   voice_gender: str = "m", lang: str = "kk") -> str:
+        raise NotImplementedError
+
+    def synthesize_many(self, jobs: Sequence[Utterance]) -> List[Result]:
+        out: List[Result] = []
+        for job in jobs:
+            try:
+                out.append(self.synthesize(*job))
+            except Exception as e:
+                out.append(e)
+        return out
+
+
+class EdgeBackend(TTSBackend):
+    """Edge-TTS over the network (MP3 → pydub → WAV)."""
+
+    name = "edge"
+
+    def __init__(self, limit: Optional[Limiter] = None):
+        self.limit = limit or limiter("tts", TTS_CONCURRENCY, 1, 16)   # shared, adaptive
+
+    def synthesize(self, text, output_path, voice_gender="m", lang="kk") -> str:
+        voice_id = _voice_id(voice_gender, lang)
+
+        # 1) Fetch MP3 via Edge TTS (async) into temp file
+        mp3_path = _temp_mp3()
+        with self.limit.slot(size=len(text)):
+            asyncio.run(_edge_tts_to_mp3(text, voice_id, mp3_path))
+
+        # 2) Convert MP3 → WAV (16 kHz mono), 3) cleanup temp
+        return _mp3_to_wav(mp3_path, output_path)
+
+    def synthesize_many(self, jobs: Sequence[Utterance]) -> List[Result]:
+        """
+        All utterances on one event loop instead of one asyncio.run() per
+        sentence. At most the "tts" limit of Edge-TTS requests are in flight
+        (process-wide, adaptive); the MP3 → WAV conversions run in the loop's
+        thread pool meanwhile.
+        """
+        async def _run() -> List[Result]:
+            loop = asyncio.get_running_loop()
+
+            async def _one(text: str, output_path: Union[str, Path], gender: str, lang: str) -> str:
+                mp3_path = _temp_mp3()
+                try:
+                    async with self.limit.aslot(len(text)):
+                        await _edge_tts_to_mp3(text, _voice_id(gender, lang), mp3_path)
+                    return await loop.run_in_executor(None, _mp3_to_wav, mp3_path, output_path)
+                finally:
+                    mp3_path.unlink(missing_ok=True)
+
+            return await asyncio.gather(*(_one(*job) for job in jobs), return_exceptions=True)
+
+        return asyncio.run(_run()) if jobs else []
+
+
+class EdgeStreamBackend(EdgeBackend):
+    """Edge-TTS, one request per job; segments cut on WordBoundary timestamps."""
+
+    name = "edge-stream"
+    batched = True
+
+    def __init__(self, limit: Optional[Limiter] = None, max_chars: int = STREAM_MAX_CHARS):
+        super().__init__(limit)
+        self.max_chars = max_chars
+
+    def _chunks(self, jobs: Sequence[Utterance]) -> List[List[int]]:
+        """Runs of consecutive jobs with the same voice, at most max_chars each."""
+        chunks: List[List[int]] = []
+        size, voice = 0, None
+        for i, (text, _out, gender, lang) in enumerate(jobs):
+            v = _voice_id(gender, lang)
+            if not chunks or v != voice or size + len(text) > self.max_chars:
+                chunks.append([])
+                size, voice = 0, v
+            chunks[-1].append(i)
+            size += len(text) + 1
+        return chunks
+
+    @staticmethod
+    async def _stream(text: str, voice: str) -> Tuple[bytes, List[Tuple[str, float, float]]]:
+        """MP3 bytes + [(word, start_s, end_s)] of one Edge-TTS request."""
+        try:
+            comm = edge_tts.Communicate(text, voice, boundary="WordBoundary")
+        except TypeError:                          # edge-tts < 7 emits WordBoundary by default
+            comm = edge_tts.Communicate(text, voice)
+        audio, words = bytearray(), []
+        async for chunk in comm.stream():
+            if chunk["type"] == "audio":
+                audio += chunk["data"]
+            elif chunk["type"] == "WordBoundary":   # offset / duration in 100 ns ticks
+                t0 = chunk["offset"] / 1e7
+                words.append((chunk["text"], t0, t0 + chunk["duration"] / 1e7))
+        return bytes(audio), words
+
+    @staticmethod
+    def _cuts(texts: List[str], words: List[Tuple[str, float, float]], total_s: float) -> List[float]:
+        """Segment start/end times: the joined text is matched word by word, each
+        segment boundary is placed halfway between its neighbouring words."""
+        joined = " ".join(texts)
+        starts, pos = [], 0
+        for t in texts:
+            starts.append(pos)
+            pos += len(t) + 1
+
+        located, cursor = [], 0               # (char position, start_s, end_s)
+        for w, t0, t1 in words:
+            at = joined.find(w, cursor)
+            if at < 0:
+                continue
+            located.append((at, t0, t1))
+            cursor = at + len(w)
+
+        cuts = [0.0]
+        for c in starts[1:]:
+            before = [t1 for at, _t0, t1 in located if at < c]
+            after  = [t0 for at, t0, _t1 in located if at >= c]
+            if not before or not after or before[-1] <= cuts[-1]:
+                raise ValueError(f"no word boundary around char {c}")
+            cuts.append((before[-1] + after[0]) / 2)
+        cuts.append(total_s)
+        return cuts
+
+    def _split(self, mp3: bytes, words, chunk_jobs: List[Utterance]) -> List[str]:
+        """Decode the joined MP3 once, write one WAV per segment."""
+        audio = AudioSegment.from_file(io.BytesIO(mp3), format="mp3")
+        audio = audio.set_frame_rate(SAMPLE_RATE).set_channels(1).set_sample_width(2)
+        x = np.frombuffer(audio.raw_data, dtype="<i2").astype(np.float32) / 32768.0
+        cuts = self._cuts([j[0] for j in chunk_jobs], words, len(x) / SAMPLE_RATE)
+        return [_write_wav(out, x[int(a * SAMPLE_RATE):int(b * SAMPLE_RATE)])
+                for (_t, out, _g, _l), a, b in zip(chunk_jobs, cuts, cuts[1:])]
+
+    def synthesize_many(self, jobs: Sequence[Utterance]) -> List[Result]:
+        async def _run() -> List[Result]:
+            loop = asyncio.get_running_loop()
+            results: List[Optional[Result]] = [None] * len(jobs)
+
+            async def _chunk(idxs: List[int]) -> None:
+                chunk_jobs = [jobs[i] for i in idxs]
+                _t, _o, gender, lang = chunk_jobs[0]
+                try:
+                    async with self.limit.aslot(sum(len(j[0]) for j in chunk_jobs)):
+                        mp3, words = await self._stream(" ".join(j[0] for j in chunk_jobs),
+                                                        _voice_id(gender, lang))
+                    paths = await loop.run_in_executor(None, self._split, mp3, words, chunk_jobs)
+                    for i, p in zip(idxs, paths):
+                        results[i] = p
+                    return
+                except Exception as e:
+                    if len(idxs) == 1:
+                        results[idxs[0]] = e
+                        return
+                    logging.warning("[TTS] edge-stream: %d segments fall back to one request each: %s",
+                                    len(idxs), e)
+                per = await loop.run_in_executor(None, EdgeBackend.synthesize_many, self, chunk_jobs)
+                for i, r in zip(idxs, per):
+                    results[i] = r
+
+            await asyncio.gather(*(_chunk(c) for c in self._chunks(jobs)))
+            return results  # type: ignore
+
+        return asyncio.run(_run()) if jobs else []
+
+
+class VitsBackend(TTSBackend):
+    """Local VITS (transformers VitsModel) on CPU, batched padded inference."""
+
+    name = "vits"
+    batched = True
+
+    def __init__(self, models: Dict[str, str] = VITS_MODELS, threads: int = VITS_THREADS,
+                 batch: int = VITS_BATCH):
+        self.models = models
+        self.threads = threads
+        self.batch = max(1, batch)
+        self._loaded: Dict[str, tuple] = {}
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()     # one forward pass at a time; threads go intra-op
+
+    def _model(self, lang: str):
+        lang = lang.lower()
+        with self._load_lock:
+            if lang not in self._loaded:
+                import torch                                   # only when VITS is used
+                from transformers import VitsModel, AutoTokenizer
+
+                model_id = self.models.get(lang)
+                if model_id is None:
+                    raise ValueError(f"no VITS model for lang {lang!r} (have {', '.join(self.models)})")
+                torch.set_num_threads(self.threads)
+                model = VitsModel.from_pretrained(model_id).eval()
+                self._loaded[lang] = (model, AutoTokenizer.from_pretrained(model_id))
+                logging.info("[TTS] VITS %s loaded (%d threads)", model_id, self.threads)
+            return self._loaded[lang]
+
+    def _infer(self, model, tokenizer, texts: List[str]) -> List[np.ndarray]:
+        import torch
+
+        inputs = tokenizer(texts, return_tensors="pt", padding=True)
+        with self._run_lock, torch.inference_mode():
+            torch.manual_seed(VITS_SEED)
+            out = model(**inputs)
+        waves = out.waveform.float().cpu().numpy()
+        return [w[:n] for w, n in zip(waves, out.sequence_lengths.tolist())]
+
+    def synthesize(self, text, output_path, voice_gender="m", lang="kk") -> str:
+        res = self.synthesize_many([(text, output_path, voice_gender, lang)])[0]
+        if isinstance(res, BaseException):
+            raise res
+        return res
+
+    def synthesize_many(self, jobs: Sequence[Utterance]) -> List[Result]:
+        results: List[Optional[Result]] = [None] * len(jobs)
+        by_lang: Dict[str, List[int]] = {}
+        for i, (_text, _out, _gender, lang) in enumerate(jobs):
+            by_lang.setdefault(lang.lower(), []).append(i)
+
+        for lang, idxs in by_lang.items():
+            try:
+                model, tokenizer = self._model(lang)
+            except Exception as e:
+                for i in idxs:
+                    results[i] = e
+                continue
+            sr = model.config.sampling_rate
+            idxs.sort(key=lambda i: len(jobs[i][0]))          # similar lengths → little padding
+            for k in range(0, len(idxs), self.batch):
+                chunk = idxs[k:k + self.batch]
+                try:
+                    waves = self._infer(model, tokenizer, [jobs[i][0] for i in chunk])
+                    for i, x in zip(chunk, waves):
+                        results[i] = _write_wav(jobs[i][1], x, sr)
+                except Exception as e:
+                    for i in chunk:
+                        results[i] = e
+        return results  # type: ignore
+
+
+BACKENDS = {"edge": EdgeBackend, "edge-stream": EdgeStreamBackend, "vits": VitsBackend}
+_LAZY = {"router": "utils.tts_router", "fake": "utils.tts_router"}   # register on first use
+_instances: Dict[str, TTSBackend] = {}
+_instances_lock = threading.Lock()
+
+
+def get_backend(name: Optional[str] = None) -> TTSBackend:
+    """Shared backend instance by name (None → TTS_BACKEND); ValueError for unknown names."""
+    name = (name or TTS_BACKEND).strip().lower()
+    if name not in BACKENDS and name in _LAZY:
+        importlib.import_module(_LAZY[name])
+    if name not in BACKENDS:
+        raise ValueError(f"unknown TTS backend {name!r} (have {', '.join(BACKENDS)})")
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = BACKENDS[name]()
+        return _instances[name]
+
+
+def backend_stats() -> Dict[str, Any]:
+    """stats() of the backends in use that report any (router: latencies, breakers, hedge rate)."""
+    with _instances_lock:
+        return {n: b.stats() for n, b in _instances.items() if hasattr(b, "stats")}
+
+
 def synthesize_speech(
     text: str,
     output_path: Union[str, Path],
     voice_gender: Literal["m", "f"] | str = "m",
-    lang: Literal["kk", "ru", "en"] = "kk"
+    lang: Literal["kk", "ru", "en"] = "kk",
+    backend: Optional[str] = None,
 ):
     """
     Generate speech in selected language and save as 16‑kHz mono WAV.
@@ -63,24 +435,18 @@ def synthesize_speech(
         • Or pass a full Edge‑TTS voice ID directly.
     lang : "kk" | "ru" | "en"
         Language of the voice. Default: "kk"
+    backend : "edge" | "edge-stream" | "vits" | None
+        TTS backend. Default: TTS_BACKEND
     """
-    lang = lang.lower()
-    gender = str(voice_gender).lower()
-    voice_id = VOICE_MAP.get(lang, {}).get(gender, voice_gender)
-
-    # 1) Fetch MP3 via Edge TTS (async) into temp file
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp_mp3:
-        mp3_path = Path(tmp_mp3.name)
-    asyncio.run(_edge_tts_to_mp3(text, voice_id, mp3_path))
-
-    # 2) Convert MP3 → WAV (16 kHz mono) using pydub
-    wav_path = Path(output_path)
-    wav_path.parent.mkdir(parents=True, exist_ok=True)
-    audio = AudioSegment.from_file(mp3_path)
-    audio = audio.set_frame_rate(16000).set_channels(1)
-    audio.export(wav_path, format="wav")
+    path = get_backend(backend).synthesize(text, output_path, voice_gender, lang)
+    write_peaks(path)                       # <wav>.peaks for the editor's waveform (utils/peaks.py)
+    return path  # path, convenient for callers
 
-    # 3) Cleanup temp
-    mp3_path.unlink(missing_ok=True)
 
-    return str(wav_path)  # convenient for callers
+def synthesize_many(jobs: Sequence[Utterance], backend: Optional[str] = None) -> List[Result]:
+    """Synthesize many utterances; returns, in order, the WAV path or the exception of each."""
+    results = get_backend(backend).synthesize_many(jobs) if jobs else []
+    for res in results:
+        if not isinstance(res, BaseException):
+            write_peaks(res)
+    return results
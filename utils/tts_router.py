@@ -0,0 +1,292 @@
+# utils/tts_router.py — Hedged TTS requests + circuit breaker across backends
+# -------------------------------------------------------------------------
+# Edge-TTS latency has a long tail and is throttled now and then; a single
+# slow request used to stall the whole job. TTSRouter (backend "router")
+# sends every utterance along a route of backends (TTS_ROUTE, e.g.
+# "edge,edge,vits" — a backend may appear twice for a same-service hedge):
+#
+#   1. start the first backend whose breaker is closed
+#   2. if it has not answered after its own p95 latency (recent window,
+#      clamped to TTS_HEDGE_MIN_S; TTS_HEDGE_DEFAULT_S until there is
+#      history), fire a hedged duplicate on the next backend
+#   3. whichever succeeds first wins; a failure immediately moves on to the
+#      next backend; after TTS_TIMEOUT_S the utterance fails
+#
+# Every attempt writes its own temp WAV; the winner is renamed into place,
+# losers are deleted when they finish (threads cannot be cancelled).
+#
+# Every route position is its own lane (breaker, latency window, counters),
+# so "edge,edge,vits" has two independent edge lanes; stats() names repeated
+# backends "edge#0", "edge#1".
+#
+# Circuit breaker per lane: TTS_CB_FAILURES consecutive failures open it
+# for TTS_CB_COOLDOWN_S; then one trial request is let through (half-open),
+# success closes it, failure re-opens it. An open backend is skipped.
+#
+# stats(): per backend requests / failures / p50 / p95 / breaker state, plus
+# hedges fired, hedge wins and hedge rate.
+#
+# StandInBackend (backend "fake") writes a quiet tone with configurable
+# latency / jitter / failure rate, for tests and offline load runs:
+#   TTS_FAKE_LATENCY_S=0.2  TTS_FAKE_JITTER_S=0.1  TTS_FAKE_FAIL_RATE=0
+#
+# Env:
+#   TTS_ROUTE=edge,vits      backends in order of preference
+#   TTS_TIMEOUT_S=60         give up on an utterance
+#   TTS_HEDGE_MIN_S=1.0      never hedge earlier than this
+#   TTS_HEDGE_DEFAULT_S=5    hedge delay before a backend has latency history
+#   TTS_CB_FAILURES=5        consecutive failures that open a breaker
+#   TTS_CB_COOLDOWN_S=30     open → half-open delay
+
+from __future__ import annotations
+
+import os
+import time
+import random
+import logging
+import threading
+import collections
+import concurrent.futures as futures
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.tts import (TTSBackend, BACKENDS, Utterance, Result, SAMPLE_RATE, TTS_CONCURRENCY,
+                       _write_wav, get_backend)
+
+TTS_ROUTE          = [b.strip().lower() for b in os.getenv("TTS_ROUTE", "edge,vits").split(",") if b.strip()]
+TTS_TIMEOUT_S      = float(os.getenv("TTS_TIMEOUT_S", 60))
+TTS_HEDGE_MIN_S    = float(os.getenv("TTS_HEDGE_MIN_S", 1.0))
+TTS_HEDGE_DEFAULT_S = float(os.getenv("TTS_HEDGE_DEFAULT_S", 5))
+TTS_CB_FAILURES    = int(os.getenv("TTS_CB_FAILURES", 5))
+TTS_CB_COOLDOWN_S  = float(os.getenv("TTS_CB_COOLDOWN_S", 30))
+
+FAKE_LATENCY_S  = float(os.getenv("TTS_FAKE_LATENCY_S", 0.2))
+FAKE_JITTER_S   = float(os.getenv("TTS_FAKE_JITTER_S", 0.1))
+FAKE_FAIL_RATE  = float(os.getenv("TTS_FAKE_FAIL_RATE", 0))
+
+WINDOW      = 200          # latency samples per backend
+MIN_HISTORY = 20           # samples before p95 is trusted
+
+__all__ = ["TTSRouter", "CircuitBreaker", "StandInBackend"]
+
+
+class CircuitBreaker:
+    """closed → (N consecutive failures) → open → (cooldown) → half-open → closed / open."""
+
+    def __init__(self, failures: int = TTS_CB_FAILURES, cooldown_s: float = TTS_CB_COOLDOWN_S):
+        self.failures = failures
+        self.cooldown_s = cooldown_s
+        self.state = "closed"
+        self._fails = 0
+        self._opened = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        self.opened_count = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened >= self.cooldown_s:
+                self.state, self._trial = "half-open", False
+            if self.state == "closed":
+                return True
+            if self.state == "half-open" and not self._trial:
+                self._trial = True                  # exactly one trial request
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self._fails = 0
+            self.state = "closed"
+
+    def failure(self) -> bool:
+        """Record a failure; True if this one opened the breaker."""
+        with self._lock:
+            self._fails += 1
+            if self.state == "open" or (self.state == "closed" and self._fails < self.failures):
+                return False
+            self.opened_count += 1
+            self.state, self._opened = "open", time.monotonic()
+            return True
+
+
+class _Lane:
+    """Route entry: backend + its breaker and recent latencies."""
+
+    def __init__(self, name: str, key: Optional[str] = None):
+        self.name = name
+        self.key = key or name
+        self.breaker = CircuitBreaker()
+        self.latencies: Deque[float] = collections.deque(maxlen=WINDOW)
+        self.requests = self.failed = 0
+        self._lock = threading.Lock()      # counters are bumped from several hedge threads
+
+    def count(self, requests: int = 0, failed: int = 0) -> None:
+        with self._lock:
+            self.requests += requests
+            self.failed += failed
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < MIN_HISTORY:
+            return TTS_HEDGE_DEFAULT_S
+        return max(TTS_HEDGE_MIN_S, float(np.percentile(self.latencies, 95)))
+
+    def snapshot(self) -> Dict[str, Any]:
+        lat = list(self.latencies)
+        with self._lock:
+            requests, failed = self.requests, self.failed
+        return {"requests": requests, "failed": failed, "breaker": self.breaker.state,
+                "breaker_opened": self.breaker.opened_count,
+                "p50_s": round(float(np.percentile(lat, 50)), 3) if lat else None,
+                "p95_s": round(float(np.percentile(lat, 95)), 3) if lat else None}
+
+
+class TTSRouter(TTSBackend):
+    """Hedging / failover across the backends of TTS_ROUTE."""
+
+    name = "router"
+
+    def __init__(self, route: Sequence[str] = tuple(TTS_ROUTE), timeout_s: float = TTS_TIMEOUT_S,
+                 concurrency: int = TTS_CONCURRENCY):
+        route = [r for r in route if r != self.name]
+        if not route:
+            raise ValueError("TTS_ROUTE is empty")
+        self.timeout_s = timeout_s
+        self.concurrency = concurrency
+        self.route = list(route)
+        # one lane per route position: a repeated backend gets its own breaker and latencies
+        self.lanes: List[_Lane] = [_Lane(n, f"{n}#{k}" if route.count(n) > 1 else n)
+                                   for k, n in enumerate(route)]
+        self._pool = futures.ThreadPoolExecutor(max_workers=max(4, 2 * concurrency * len(route)),
+                                                thread_name_prefix="tts-route")
+        self._lock = threading.Lock()
+        self.requests = self.hedges = self.hedge_wins = self.failovers = self.failed = 0
+
+    # ------------------------------------------------------------------
+    # one utterance
+    # ------------------------------------------------------------------
+
+    def _attempt(self, lane: _Lane, text: str, tmp: Path, gender: str, lang: str) -> str:
+        t0 = time.monotonic()
+        try:
+            path = get_backend(lane.name).synthesize(text, tmp, gender, lang)
+        except Exception as e:
+            lane.count(failed=1)
+            if lane.breaker.failure():
+                logging.warning("[TTS] %s circuit open for %.0fs after: %s",
+                                lane.key, lane.breaker.cooldown_s, e)
+            raise
+        lane.latencies.append(time.monotonic() - t0)
+        lane.breaker.success()
+        return path
+
+    def synthesize(self, text, output_path, voice_gender="m", lang="kk") -> str:
+        out = Path(output_path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self.requests += 1
+        deadline = time.monotonic() + self.timeout_s
+        route = iter(enumerate(self.lanes))
+        running: Dict[futures.Future, tuple] = {}
+        errors: List[str] = []
+        hedged = False
+
+        def launch(kind: str) -> bool:
+            for k, lane in route:
+                if not lane.breaker.allow():
+                    errors.append(f"{lane.key}: circuit open")
+                    continue
+                lane.count(requests=1)
+                tmp = out.with_name(f"{out.stem}.{k}.{lane.name}.part.wav")
+                fut = self._pool.submit(self._attempt, lane, text, tmp, voice_gender, lang)
+                running[fut] = (kind, lane, tmp)
+                return True
+            return False
+
+        if not launch("first"):
+            with self._lock:
+                self.failed += 1
+            raise RuntimeError(f"no TTS backend available ({'; '.join(errors)})")
+
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not hedged and len(running) == 1:   # one hedge per utterance
+                lane = next(iter(running.values()))[1]
+                remaining = min(remaining, lane.hedge_delay())
+            done, _ = futures.wait(running, timeout=remaining, return_when=futures.FIRST_COMPLETED)
+            if not done:
+                if not hedged and len(running) == 1 and launch("hedge"):   # slower than its p95
+                    with self._lock:
+                        self.hedges += 1
+                hedged = True
+                continue
+            for fut in done:
+                kind, lane, tmp = running.pop(fut)
+                if fut.exception() is None:
+                    self._discard(running)
+                    os.replace(fut.result(), out)
+                    if kind == "hedge":
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return str(out)
+                errors.append(f"{lane.key}: {fut.exception()}")
+                Path(tmp).unlink(missing_ok=True)
+            if not running and launch("failover"):     # failed → next backend right away
+                with self._lock:
+                    self.failovers += 1
+
+        self._discard(running)
+        with self._lock:
+            self.failed += 1
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"TTS timed out after {self.timeout_s:.0f}s ({'; '.join(errors) or 'no answer'})")
+        raise RuntimeError(f"all TTS backends failed: {'; '.join(errors)}")
+
+    @staticmethod
+    def _discard(running: Dict[futures.Future, tuple]) -> None:
+        """Losing attempts keep running; delete their output once they finish."""
+        for fut, (_k, _lane, tmp) in running.items():
+            fut.add_done_callback(lambda _f, t=tmp: Path(t).unlink(missing_ok=True))
+        running.clear()
+
+    def synthesize_many(self, jobs: Sequence[Utterance]) -> List[Result]:
+        with futures.ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as pool:
+            futs = [pool.submit(self.synthesize, *job) for job in jobs]
+        return [f.exception() or f.result() for f in futs]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "failed": self.failed, "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins, "failovers": self.failovers,
+                "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+                "backends": {lane.key: lane.snapshot() for lane in self.lanes}}
+
+
+class StandInBackend(TTSBackend):
+    """Network-free stand-in: a quiet tone after a configurable delay / failure rate."""
+
+    name = "fake"
+
+    def __init__(self, latency_s: float = FAKE_LATENCY_S, jitter_s: float = FAKE_JITTER_S,
+                 fail_rate: float = FAKE_FAIL_RATE, seconds_per_char: float = 0.06,
+                 seed: Optional[int] = None):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.fail_rate = fail_rate
+        self.seconds_per_char = seconds_per_char
+        self._rng = random.Random(seed)
+
+    def synthesize(self, text, output_path, voice_gender="m", lang="kk") -> str:
+        time.sleep(max(0.0, self.latency_s + self._rng.uniform(-self.jitter_s, self.jitter_s)))
+        if self._rng.random() < self.fail_rate:
+            raise RuntimeError("stand-in TTS failure")
+        n = int(max(0.2, len(text) * self.seconds_per_char) * SAMPLE_RATE)
+        tone = 0.1 * np.sin(2 * np.pi * 220.0 * np.arange(n) / SAMPLE_RATE)
+        return _write_wav(output_path, tone)
+
+
+BACKENDS.setdefault(TTSRouter.name, TTSRouter)
+BACKENDS.setdefault(StandInBackend.name, StandInBackend)
@@ -0,0 +1,100 @@
+# utils/vad.py — Energy VAD on the 16 kHz TTS WAVs, per video frame
+# -----------------------------------------------------------------
+# Edge-TTS output has leading/trailing silence and pauses at commas. The
+# lip-sync engine only runs the face model on frames whose audio window is
+# voiced; silent frames keep the original template frame.
+#
+# Frame i of a Wav2Lip clip is driven by the mel window starting at i/fps
+# and lasting MEL_STEP hops (0.2 s), so the energy is measured over exactly
+# that span of samples. Everything is one cumulative sum + fancy indexing:
+#
+#   energy_db[i] = 10·log10(mean(x[i·sr/fps : i·sr/fps + window]²))
+#   voiced       = energy_db > max(peak + VAD_REL_DB, VAD_FLOOR_DB)
+#
+# then silent gaps shorter than VAD_MIN_SILENCE frames are filled (no mouth
+# flicker inside a phrase) and voiced spans are widened by VAD_HANGOVER
+# frames on each side so the mouth opens/closes smoothly.
+#
+# Env:
+#   LIPSYNC_VAD=0            disable (every frame is inferred)
+#   VAD_REL_DB=-35           threshold relative to the clip's loudest frame
+#   VAD_FLOOR_DB=-60         absolute threshold (dBFS) for quiet clips
+#   VAD_MIN_SILENCE=6        frames; shorter pauses count as voiced
+#   VAD_HANGOVER=2           frames added before/after every voiced span
+
+from __future__ import annotations
+
+import os
+import wave
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+VAD_ENABLED     = os.getenv("LIPSYNC_VAD", "1").strip().lower() not in {"0", "false", "no"}
+VAD_REL_DB      = float(os.getenv("VAD_REL_DB", -35))
+VAD_FLOOR_DB    = float(os.getenv("VAD_FLOOR_DB", -60))
+VAD_MIN_SILENCE = int(os.getenv("VAD_MIN_SILENCE", 6))
+VAD_HANGOVER    = int(os.getenv("VAD_HANGOVER", 2))
+
+WINDOW_S = 0.2          # 16 mel columns × 200-sample hop at 16 kHz
+
+__all__ = ["read_wav", "frame_energy_db", "voiced_mask", "spans", "VAD_ENABLED"]
+
+
+def read_wav(path: str | Path) -> Tuple[np.ndarray, int]:
+    """PCM WAV → (mono float32 samples in -1‥1, sample rate)."""
+    with wave.open(str(path), "rb") as w:
+        sr, ch, width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+        raw = w.readframes(w.getnframes())
+    if width == 2:
+        x = np.frombuffer(raw, "<i2").astype(np.float32) / 32768.0
+    elif width == 4:
+        x = np.frombuffer(raw, "<i4").astype(np.float32) / 2147483648.0
+    elif width == 1:
+        x = (np.frombuffer(raw, np.uint8).astype(np.float32) - 128.0) / 128.0
+    else:
+        raise ValueError(f"unsupported sample width {width} in {path}")
+    if ch > 1:
+        x = x.reshape(-1, ch).mean(axis=1)
+    return x, sr
+
+
+def frame_energy_db(x: np.ndarray, sr: int, fps: float, n_frames: int,
+                    window_s: float = WINDOW_S) -> np.ndarray:
+    """Mean energy (dBFS) of the audio window driving each of *n_frames* frames."""
+    cs = np.concatenate([[0.0], np.cumsum(np.square(x, dtype=np.float64))])
+    start = np.minimum(np.round(np.arange(n_frames) * sr / fps).astype(np.int64), len(x))
+    stop = np.minimum(start + int(round(window_s * sr)), len(x))
+    energy = (cs[stop] - cs[start]) / np.maximum(stop - start, 1)
+    return 10.0 * np.log10(energy + 1e-12)
+
+
+def voiced_mask(audio_path: str | Path, fps: float, n_frames: int,
+                rel_db: float = VAD_REL_DB, floor_db: float = VAD_FLOOR_DB,
+                min_silence: int = VAD_MIN_SILENCE, hangover: int = VAD_HANGOVER) -> np.ndarray:
+    """Boolean mask (n_frames,) — True where the frame needs inference."""
+    x, sr = read_wav(audio_path)
+    db = frame_energy_db(x, sr, fps, n_frames)
+    if not len(db):
+        return np.zeros(0, bool)
+    voiced = db > max(db.max() + rel_db, floor_db)
+
+    # fill short pauses: silent runs (not touching the clip edges) < min_silence
+    edges = np.flatnonzero(np.diff(np.concatenate([[1], voiced.view(np.int8), [1]])))
+    starts, stops = edges[0::2], edges[1::2]          # silent runs [start, stop)
+    inner = (starts > 0) & (stops < n_frames) & (stops - starts < min_silence)
+    fill = np.zeros(n_frames + 1, np.int32)
+    np.add.at(fill, starts[inner], 1)
+    np.add.at(fill, stops[inner], -1)
+    voiced |= np.cumsum(fill[:-1]) > 0
+
+    if hangover > 0:
+        voiced = np.convolve(voiced, np.ones(2 * hangover + 1), mode="same") > 0
+    return voiced
+
+
+def spans(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """Contiguous True runs of *mask* as [(start, stop), ...]."""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.view(np.int8), [0]])))
+    return list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
@@ -0,0 +1,239 @@
+# utils/video_serving.py — Range / conditional / zero-copy responses for rendered videos
+# -------------------------------------------------------------------------------------
+# Scrubbing through a long merged MP4 in the browser issues Range requests;
+# without them every seek re-downloads the file from byte 0. One framework-
+# agnostic core decides the response, two thin adapters send it:
+#
+#   plan(path, headers, method)  → status / headers / byte span
+#       • ETag ("size-mtime") + Last-Modified; If-None-Match and
+#         If-Modified-Since → 304
+#       • Range: bytes=a-b | a- | -n → 206 + Content-Range; unsatisfiable →
+#         416; several ranges → whole file (allowed by RFC 9110); If-Range
+#         with a stale validator → whole file
+#       • Accept-Ranges, Cache-Control (files never change after rendering)
+#
+#   starlette_response(path, request)   FastAPI (service.py /video/...)
+#       ASGI "http.response.zerocopysend" extension when the server offers
+#       it (sendfile), else os.pread chunks in a worker thread
+#   wsgi_response(path, environ)        Flask (/static/video_output/...)
+#       wsgi.file_wrapper (gunicorn → sendfile) positioned at the range
+#       start, else os.pread chunks
+#
+# Behind nginx, VIDEO_ACCEL_PREFIX hands the file to nginx instead
+# (X-Accel-Redirect: prefix + path relative to VIDEO_ACCEL_ROOT); nginx then
+# does the range / conditional handling and sendfile itself.
+#
+# Env:
+#   VIDEO_MAX_AGE=3600        Cache-Control max-age (seconds)
+#   VIDEO_ACCEL_PREFIX=       e.g. /_protected/   (off when empty)
+#   VIDEO_ACCEL_ROOT=static   directory that prefix maps to
+
+from __future__ import annotations
+
+import os
+import mimetypes
+import email.utils
+from pathlib import Path
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Tuple, Union
+
+VIDEO_MAX_AGE      = int(os.getenv("VIDEO_MAX_AGE", 3600))
+VIDEO_ACCEL_PREFIX = os.getenv("VIDEO_ACCEL_PREFIX", "").strip()
+VIDEO_ACCEL_ROOT   = Path(os.getenv("VIDEO_ACCEL_ROOT", "static")).resolve()
+CHUNK = 1 << 20
+
+__all__ = ["plan", "Plan", "starlette_response", "wsgi_response"]
+
+
+class Plan(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    start: int = 0
+    length: int = 0          # bytes of body to send (0 for 304 / 416 / HEAD-only)
+
+
+def _validators(st: os.stat_result) -> Tuple[str, str]:
+    return (f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+            email.utils.formatdate(st.st_mtime, usegmt=True))
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    inm = headers.get("if-none-match")
+    if inm:                                     # If-None-Match wins over If-Modified-Since
+        return _etag_matches(inm, etag)
+    ims = headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= email.utils.parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _byte_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end inclusive) of a single-range header; None → ignore it and send the
+    whole file (malformed or multi-range); ValueError → unsatisfiable."""
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        a = int(first) if first else None
+        b = int(last) if last else None
+    except ValueError:
+        return None
+    if a is None:                               # suffix: last N bytes
+        if b is None:
+            return None
+        if b == 0 or size == 0:
+            raise ValueError(value)
+        return max(0, size - b), size - 1
+    if a >= size or (b is not None and b < a):
+        raise ValueError(value)
+    return a, size - 1 if b is None else min(b, size - 1)
+
+
+def plan(path: Union[str, Path], headers: Mapping[str, str], method: str = "GET",
+         media_type: Optional[str] = None) -> Plan:
+    """Decide status / headers / span for serving *path* to a request with *headers*
+    (any case-insensitive mapping: Starlette Headers, Werkzeug EnvironHeaders)."""
+    st = os.stat(path)
+    size = st.st_size
+    etag, last_modified = _validators(st)
+    base = {"ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes",
+            "Cache-Control": f"public, max-age={VIDEO_MAX_AGE}"}
+
+    if _not_modified(headers, etag, st.st_mtime):
+        return Plan(304, base)
+
+    base["Content-Type"] = media_type or mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+    span = None
+    rng = headers.get("range")
+    if rng and method in ("GET", "HEAD"):
+        if_range = headers.get("if-range")
+        if not if_range or if_range.strip() in (etag, last_modified):
+            try:
+                span = _byte_range(rng, size)
+            except ValueError:
+                return Plan(416, {**base, "Content-Range": f"bytes */{size}", "Content-Length": "0"})
+    if span is None:
+        return Plan(200, {**base, "Content-Length": str(size)}, 0, 0 if method == "HEAD" else size)
+    start, end = span
+    n = end - start + 1
+    return Plan(206, {**base, "Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(n)},
+                start, 0 if method == "HEAD" else n)
+
+
+def _accel(path: Union[str, Path], media_type: Optional[str]) -> Optional[Dict[str, str]]:
+    if not VIDEO_ACCEL_PREFIX:
+        return None
+    try:
+        rel = Path(path).resolve().relative_to(VIDEO_ACCEL_ROOT)
+    except ValueError:
+        return None
+    return {"X-Accel-Redirect": VIDEO_ACCEL_PREFIX.rstrip("/") + "/" + rel.as_posix(),
+            "Content-Type": media_type or mimetypes.guess_type(str(path))[0] or "application/octet-stream"}
+
+
+def _pread_chunks(fd: int, start: int, length: int):
+    off, end = start, start + length
+    while off < end:
+        data = os.pread(fd, min(CHUNK, end - off), off)
+        if not data:
+            break
+        off += len(data)
+        yield data
+
+
+# ----------------------------------------------------------------------
+# ASGI (FastAPI / Starlette)
+# ----------------------------------------------------------------------
+
+_starlette_cls = None
+
+
+def _starlette_class():
+    global _starlette_cls
+    if _starlette_cls is None:
+        import anyio
+        from starlette.responses import Response
+
+        class VideoFileResponse(Response):
+            def __init__(self, path: Path, p: Plan):
+                self.path, self.plan = path, p
+                self.status_code = p.status
+                self.background = None
+                self.raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                                    for k, v in p.headers.items()]
+
+            async def __call__(self, scope, receive, send) -> None:
+                await send({"type": "http.response.start", "status": self.status_code,
+                            "headers": self.raw_headers})
+                p = self.plan
+                if not p.length:
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+                with open(self.path, "rb") as f:
+                    if "http.response.zerocopysend" in scope.get("extensions", {}):
+                        await send({"type": "http.response.zerocopysend", "file": f,
+                                    "offset": p.start, "count": p.length})
+                        return
+                    chunks = _pread_chunks(f.fileno(), p.start, p.length)
+                    while True:
+                        data = await anyio.to_thread.run_sync(next, chunks, None)
+                        if data is None:
+                            break
+                        await send({"type": "http.response.body", "body": data, "more_body": True})
+                    await send({"type": "http.response.body", "body": b""})
+
+        _starlette_cls = VideoFileResponse
+    return _starlette_cls
+
+
+def starlette_response(path: Union[str, Path], request: Any, media_type: Optional[str] = None,
+                       filename: Optional[str] = None):
+    """Starlette Response serving *path* for *request* (Range, 304, sendfile)."""
+    from starlette.responses import Response
+
+    disposition = {"Content-Disposition": f'attachment; filename="{filename}"'} if filename else {}
+    accel = _accel(path, media_type)
+    if accel:
+        return Response(status_code=200, headers={**accel, **disposition})
+    p = plan(path, request.headers, request.method, media_type)
+    return _starlette_class()(Path(path), p._replace(headers={**p.headers, **disposition}))
+
+
+# ----------------------------------------------------------------------
+# WSGI (Flask / Werkzeug)
+# ----------------------------------------------------------------------
+
+def wsgi_response(path: Union[str, Path], environ: Dict[str, Any], media_type: Optional[str] = None):
+    """Werkzeug Response serving *path* for the WSGI *environ* (Range, 304, sendfile)."""
+    from werkzeug.datastructures import EnvironHeaders
+    from werkzeug.wrappers import Response
+
+    accel = _accel(path, media_type)
+    if accel:
+        return Response(status=200, headers=accel)
+    p = plan(path, EnvironHeaders(environ), environ.get("REQUEST_METHOD", "GET"), media_type)
+    if not p.length:
+        return Response(status=p.status, headers=p.headers)
+
+    f = open(path, "rb")
+    wrapper = environ.get("wsgi.file_wrapper")
+    # gunicorn's file_wrapper sendfile()s from the current offset up to Content-Length;
+    # other servers may send to EOF, so they get a range only when it runs to the end
+    if wrapper and (environ.get("SERVER_SOFTWARE", "").startswith("gunicorn")
+                    or p.start + p.length == os.fstat(f.fileno()).st_size):
+        f.seek(p.start)
+        body = wrapper(f, CHUNK)
+    else:
+        def body_iter():
+            with f:
+                yield from _pread_chunks(f.fileno(), p.start, p.length)
+        body = body_iter()
+    return Response(body, status=p.status, headers=p.headers, direct_passthrough=True)
@@ -5,22 +5,63 @@
 # ① generate_lip_sync — Calls Wav2Lip once to get a single MP4 segment
 
 # ② generate_batch_lip_sync — ThreadPool concurrent, sequential return
+#   (submit_batch_lip_sync — same, but returns one future per task)
 
 # - Supports on_done(idx) callback, facilitating WebSocket progress pushing
 
+# - backend="torch": in-process engine (utils/lipsync_engine.py); windows of all
+#   segments (and of concurrent jobs) are batched into shared forward passes;
+#   the mel spectrograms of all segments are computed in one pass (utils/mel.py)
+
+# - tier="draft" / "standard" / "final": render settings, see utils/quality.py
+
 # ③ make_video_with_green_background — Static green background + audio to synthesize MP4
 
 # ============================================================
 
 from __future__ import annotations
-import pathlib, subprocess, os, uuid, threading, concurrent.futures
+import pathlib, subprocess, os, uuid, wave, logging, concurrent.futures
 from typing import Sequence, Tuple, List, Callable, Optional
 
+from utils.trace import NULL_TRACER
+from utils.clip_cache import CLIP_CACHE, clip_key
+from utils.quality import get_tier, wav2lip_flags, encoder_args
+from utils.merge import faststart
+from utils.concurrency import ResizablePool, limiter
+
 # --- Path constants -------------------------------------------
 TEMPLATE_DIR = pathlib.Path("static/video_templates").resolve()
 WAV2LIP_DIR  = pathlib.Path("./wav2lip").resolve()
 OUTPUT_DIR   = pathlib.Path("static/video_output").resolve()
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+CHECKPOINT   = WAV2LIP_DIR / "checkpoints/wav2lip_gan.pth"
+
+# "subprocess" → inference.py per clip; "torch" → in-process batched engine
+LIPSYNC_BACKEND = os.getenv("LIPSYNC_BACKEND", "subprocess").strip()
+
+_notes_logged = False
+
+def log_backend_notes() -> None:
+    """Once per process, at startup: on the default subprocess backend the
+    engine-only features are off, say so instead of letting their env vars
+    look effective."""
+    global _notes_logged
+    if _notes_logged or LIPSYNC_BACKEND != "subprocess":
+        return
+    _notes_logged = True
+    logging.warning(
+        "[LIPSYNC] LIPSYNC_BACKEND=subprocess (inference.py per clip): cross-job batching, "
+        "streamed encoding, VAD frame skipping (LIPSYNC_VAD), NumPy/cached mels (MEL_*) and the "
+        "tiers' x264 preset / max height are inactive; set LIPSYNC_BACKEND=torch or onnx to use them")
+
+def _template_and_out(gender: str, action_id: int, video_dir: pathlib.Path | None):
+    video_dir = video_dir or OUTPUT_DIR
+    video_dir.mkdir(parents=True, exist_ok=True)
+
+    template = TEMPLATE_DIR / f"{gender}_{action_id}.mp4"
+    if not template.exists():
+        raise FileNotFoundError(template)
+    return template, video_dir / f"{uuid.uuid4().hex}.mp4"
 
 # --- Single-segment lip-sync video generation -----------------
 def generate_lip_sync(
@@ -29,78 +70,218 @@ def generate_lip_sync(
     action_id  : int,
     video_dir  : pathlib.Path | None = None,
     use_gpu    : bool = False,
-    gpu_id     : int | None = None
+    gpu_id     : int | None = None,
+    tracer     = NULL_TRACER,
+    backend    : str | None = None,
+    tier       = None
 ) -> str:
     """
 Generate a lip-synced video based on the audio and template, and return the absolute path of the mp4 file.
     gender: 'm' / 'f'
+    backend: "subprocess" (default, LIPSYNC_BACKEND) or an in-process engine backend
+    tier: quality tier name or utils.quality.Tier (default QUALITY_TIER); tiers with
+          face enhancement always use the subprocess path
     """
-    video_dir = video_dir or OUTPUT_DIR
-    video_dir.mkdir(parents=True, exist_ok=True)
+    backend = backend or LIPSYNC_BACKEND
+    tier = get_tier(tier)
+    if backend != "subprocess" and not tier.enhance_face:
+        return submit_lip_sync(audio_path, gender, action_id, video_dir,
+                               tracer=tracer, backend=backend, tier=tier).result()
 
-    template = TEMPLATE_DIR / f"{gender}_{action_id}.mp4"
-    if not template.exists():
-        raise FileNotFoundError(template)
+    template, out_path = _template_and_out(gender, action_id, video_dir)
+    checkpoint = CHECKPOINT
+    flags = wav2lip_flags(tier, WAV2LIP_DIR)
 
-    out_path = video_dir / f"{uuid.uuid4().hex}.mp4"
+    # same audio + template + checkpoint + flags → identical clip
+    key = None
+    if CLIP_CACHE.enabled:
+        with tracer.span("clip_cache.lookup"):
+            key = clip_key(audio_path, template, checkpoint, flags)
+            if CLIP_CACHE.fetch(key, out_path):
+                return str(out_path)
 
     cmd = [
         "python", str(WAV2LIP_DIR / "inference.py"),
-        "--checkpoint_path", str(WAV2LIP_DIR / "checkpoints/wav2lip_gan.pth"),
+        "--checkpoint_path", str(checkpoint),
         "--face", str(template),
         "--audio", str(audio_path),
         "--outfile", str(out_path),
-        "--resize_factor", "3"
+        *flags
     ]
     env = dict(os.environ)
     env["CUDA_VISIBLE_DEVICES"] = "0"        # CPU
 
-    subprocess.check_call(cmd, cwd=str(WAV2LIP_DIR), env=env)
+    with tracer.span("wav2lip.subprocess", cat="subprocess", tier=tier.name,
+                     template=template.name, audio=pathlib.Path(audio_path).name):
+        subprocess.check_call(cmd, cwd=str(WAV2LIP_DIR), env=env)
+    faststart(out_path)                      # inference.py muxes without +faststart
+    if key:
+        CLIP_CACHE.store(key, out_path)
     return str(out_path)
 
+def submit_lip_sync(
+    audio_path : str,
+    gender     : str,
+    action_id  : int,
+    video_dir  : pathlib.Path | None = None,
+    tracer     = NULL_TRACER,
+    backend    : str = "torch",
+    max_batch  : int | None = None,
+    max_wait_ms: float | None = None,
+    tier       = None,
+    mel        = None
+) -> concurrent.futures.Future:
+    """
+Queue one segment on the shared in-process engine; the future resolves to the mp4 path.
+`mel`: the segment's precomputed spectrogram (utils.mel), computed by the engine if None.
+    """
+    from utils.lipsync_engine import get_engine, VAD_ENABLED, MEL_FAST   # numpy/cv2/torch only when used
+
+    tier = get_tier(tier)
+    template, out_path = _template_and_out(gender, action_id, video_dir)
+    flags = ["--resize_factor", str(tier.resize_factor), "--backend", backend, *encoder_args(tier)]
+    if VAD_ENABLED:
+        flags.append("--vad")       # silent frames are not inferred → different output
+    if MEL_FAST:
+        flags.append("--mel-f16")   # float16-rounded NumPy mels (utils/mel.py)
+
+    key = None
+    if CLIP_CACHE.enabled:
+        with tracer.span("clip_cache.lookup"):
+            key = clip_key(audio_path, template, CHECKPOINT, flags)
+            if CLIP_CACHE.fetch(key, out_path):
+                fut: concurrent.futures.Future = concurrent.futures.Future()
+                fut.set_result(str(out_path))
+                return fut
+
+    engine = get_engine(backend, max_batch, max_wait_ms)
+    t_submit = tracer.now_ns()
+    with tracer.span("lipsync.prepare", template=template.name):
+        fut = engine.submit(
+            audio_path, template, out_path, tier.resize_factor,
+            preset=tier.preset, max_height=tier.max_height, mel=mel,
+            # frames inferred / skipped as silent, estimated inference time saved
+            on_stats=lambda st: tracer.add_span("lipsync.clip", t_submit, tracer.now_ns(),
+                                                template=template.name, **st),
+        )
+    if key:
+        fut.add_done_callback(lambda f: f.exception() is None and CLIP_CACHE.store(key, out_path))
+    return fut
+
 # --- Batch concurrent lip-sync -----------------------------------------
 Task = Tuple[str, str, int]  # (audio_path, gender, action_id)
 
-_global_executor: concurrent.futures.ThreadPoolExecutor | None = None
-_executor_lock  = threading.Lock()
+# one persistent pool for inference.py runs; its concurrency is the adaptive
+# "lipsync" limit (utils/concurrency.py) and changes without recreating threads
+LIPSYNC_LIMIT = limiter("lipsync", 3, 1, 8, resource="gpu")
+LIPSYNC_POOL  = ResizablePool(LIPSYNC_LIMIT)
+_limit_seeded = False
+
+def _seed_limit(max_workers: int) -> None:
+    """The first caller's max_workers sizes the shared limit once (unless
+    CONC_LIPSYNC_INIT is set); later callers in the same process (service.py
+    and the celery_app it imports) do not overwrite it. Adaptive: the
+    controller takes over from there; fixed (CONC_ADAPTIVE=0): it stays."""
+    global _limit_seeded
+    if _limit_seeded:
+        return
+    _limit_seeded = True
+    if "CONC_LIPSYNC_INIT" not in os.environ:
+        LIPSYNC_LIMIT.resize(max_workers)
+
+def _audio_seconds(path: str) -> float:
+    try:
+        with wave.open(str(path), "rb") as w:
+            return max(w.getnframes() / w.getframerate(), 0.1)
+    except Exception:
+        return 1.0
+
+def submit_batch_lip_sync(
+    tasks      : Sequence[Task],
+    max_workers: int = 3,
+    video_dir  : pathlib.Path | None = None,
+    tracer     = NULL_TRACER,
+    backend    : str | None = None,
+    max_batch  : int | None = None,
+    max_wait_ms: float | None = None,
+    tier       = None
+) -> List[concurrent.futures.Future]:
+    """
+Queue all tasks at once; one future per task (same order) resolving to its mp4 path.
+Engine backends share forward passes across tasks, "subprocess" runs on the pool.
+    """
+    backend = backend or LIPSYNC_BACKEND
+    tier = get_tier(tier)
 
-def _get_executor(max_workers: int) -> concurrent.futures.ThreadPoolExecutor:
-    global _global_executor
-    with _executor_lock:
-        if _global_executor is None or _global_executor._max_workers != max_workers:
-            if _global_executor:
-                _global_executor.shutdown(wait=False)
-            _global_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
-    return _global_executor
+    if backend != "subprocess" and not tier.enhance_face:
+        from utils.mel import MELS, MEL_FAST
+        mels = [None] * len(tasks)
+        if MEL_FAST:     # one STFT pass for the whole job; retries hit the mel cache
+            with tracer.span("lipsync.mel", segments=len(tasks)):
+                mels = MELS.get_many([wav for wav, _g, _aid in tasks])
+        return [submit_lip_sync(wav, g, aid, video_dir, tracer, backend, max_batch, max_wait_ms, tier, mel)
+                for (wav, g, aid), mel in zip(tasks, mels)]
+
+    def _wrap(idx: int, t: Task, queued_ns: int) -> str:
+        wav, g, aid = t
+        tracer.add_span("lipsync.queue_wait", queued_ns, tracer.now_ns(),
+                        cat="wait", index=idx + 1)
+        with tracer.span("lipsync.segment", index=idx + 1, gender=g, action_id=aid):
+            return generate_lip_sync(wav, g, aid, video_dir, tracer=tracer, tier=tier)
+
+    _seed_limit(max_workers)
+    # size = audio seconds: the controller compares render time per second of audio
+    return [LIPSYNC_POOL.submit(_wrap, i, t, tracer.now_ns(), size=_audio_seconds(t[0]))
+            for i, t in enumerate(tasks)]
 
 def generate_batch_lip_sync(
     tasks      : Sequence[Task],
     max_workers: int = 3,
     video_dir  : pathlib.Path | None = None,
-    on_done    : Optional[Callable[[int], None]] = None
+    on_done    : Optional[Callable[[int], None]] = None,
+    tracer     = NULL_TRACER,
+    backend    : str | None = None,
+    max_batch  : int | None = None,
+    max_wait_ms: float | None = None,
+    tier       = None,
+    on_clip    : Optional[Callable[[int, str], None]] = None
 ) -> List[str]:
     """
     tasks:       [(wav, gender, action_id), ...]
-`max_workers`: Concurrency level
+`max_workers`: Concurrency level (starting point of the adaptive "lipsync" limit)
 
 `on_done(k)`: Callback after the completion of the k-th segment (1-based), which can be used to push progress.
 
+`tracer`: utils.trace.Tracer — records pool queue wait and per-segment spans.
+
+`backend`: "subprocess" (thread pool of inference.py runs) or an in-process engine
+backend such as "torch": all tasks are queued at once and their frames are packed
+into forward passes of up to `max_batch` windows, waiting at most `max_wait_ms`
+(defaults: LIPSYNC_MAX_BATCH / LIPSYNC_MAX_WAIT_MS). `max_workers` is unused there.
+
+`tier`: quality tier ("draft" / "standard" / "final", default QUALITY_TIER).
+
+`on_clip(k, mp4)`: like on_done, with the finished clip's path (partial results).
+
 Return value: A list of mp4 paths in the same order as the tasks.
     """
     results: List[str | None] = [None] * len(tasks)
+    backend = backend or LIPSYNC_BACKEND
+    tier = get_tier(tier)
+    engine = backend != "subprocess" and not tier.enhance_face
 
-    def _wrap(idx: int, t: Task):
-        wav, g, aid = t
-        path = generate_lip_sync(wav, g, aid, video_dir)
+    t_submit = tracer.now_ns()
+    futs = {fut: i for i, fut in enumerate(
+        submit_batch_lip_sync(tasks, max_workers, video_dir, tracer, backend, max_batch, max_wait_ms, tier))}
+    for fut in concurrent.futures.as_completed(futs):
+        idx = futs[fut]
+        results[idx] = fut.result()
+        if engine:       # subprocess runs record their own span in the pool thread
+            tracer.add_span("lipsync.segment", t_submit, tracer.now_ns(), index=idx + 1, backend=backend)
         if on_done:
             on_done(idx + 1)  # 1-based
-        return idx, path
-
-    exe = _get_executor(max_workers)
-    futs = {exe.submit(_wrap, i, t): i for i, t in enumerate(tasks)}
-    for fut in concurrent.futures.as_completed(futs):
-        idx, path = fut.result()
-        results[idx] = path
+        if on_clip:
+            on_clip(idx + 1, results[idx])
     return results  # type: ignore
 
 # --- Green background + audio-generated video-----------------------------------
@@ -0,0 +1,105 @@
+# utils/wav2lip_onnx.py — Export / quantize / verify the Wav2Lip ONNX generator
+# ----------------------------------------------------------------------------
+# CPU-only workers run lip-sync through ONNX Runtime (backend "onnx" /
+# "onnx-int8" in utils/lipsync_engine.py). This tool produces those models
+# from the same checkpoint inference.py uses:
+#
+#   python -m utils.wav2lip_onnx export     # wav2lip_gan.pth → wav2lip_gan.onnx
+#   python -m utils.wav2lip_onnx quantize   # → wav2lip_gan.int8.onnx (dynamic int8)
+#   python -m utils.wav2lip_onnx check      # compare onnx / int8 against torch
+#
+# The exported graph takes NCHW inputs  mel[B,1,80,16], face[B,6,96,96]  and
+# returns  pred[B,3,96,96]  in 0‥1, with a dynamic batch axis.
+#
+# `check` runs the same random batch through torch and ONNX Runtime and
+# reports max abs error and PSNR (0‥255 scale); it exits non-zero when PSNR
+# falls under --min-psnr, so it can gate a model rollout.
+
+from __future__ import annotations
+
+import sys
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from utils.lipsync_engine import (
+    CHECKPOINT, ONNX_MODEL, ONNX_INT8, IMG_SIZE, MEL_STEP, OnnxBackend, TorchBackend,
+)
+
+OPSET = 17
+
+
+def export(checkpoint: Path = CHECKPOINT, out: Path = ONNX_MODEL, opset: int = OPSET) -> Path:
+    import torch
+    model = TorchBackend(checkpoint, device="cpu").model
+    mel = torch.zeros(1, 1, 80, MEL_STEP)
+    face = torch.zeros(1, 6, IMG_SIZE, IMG_SIZE)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    torch.onnx.export(
+        model, (mel, face), str(out),
+        input_names=["mel", "face"], output_names=["pred"],
+        dynamic_axes={"mel": {0: "batch"}, "face": {0: "batch"}, "pred": {0: "batch"}},
+        opset_version=opset, do_constant_folding=True,
+    )
+    logging.warning("[ONNX] exported %s → %s", checkpoint, out)
+    return out
+
+
+def quantize(src: Path = ONNX_MODEL, out: Path = ONNX_INT8) -> Path:
+    """Dynamic int8: weights quantized offline, activations at run time."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(str(src), str(out), weight_type=QuantType.QInt8)
+    logging.warning("[ONNX] quantized %s → %s", src, out)
+    return out
+
+
+def psnr(ref: np.ndarray, test: np.ndarray) -> float:
+    mse = float(np.mean((ref.astype(np.float64) - test.astype(np.float64)) ** 2))
+    return float("inf") if mse == 0 else 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+def compare(model: Path, checkpoint: Path = CHECKPOINT, batch: int = 16, seed: int = 0) -> Dict[str, float]:
+    """Run one random batch through torch and *model*; errors on the 0‥255 scale."""
+    rng = np.random.default_rng(seed)
+    img = rng.random((batch, IMG_SIZE, IMG_SIZE, 6), dtype=np.float32)
+    mel = rng.standard_normal((batch, 80, MEL_STEP, 1), dtype=np.float32)
+    ref = TorchBackend(checkpoint, device="cpu")(img, mel)
+    test = OnnxBackend(model, device="cpu")(img, mel)
+    return {"max_abs": float(np.abs(ref - test).max()), "psnr": round(psnr(ref, test), 2)}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Wav2Lip ONNX export / quantization / check")
+    ap.add_argument("cmd", choices=["export", "quantize", "check", "all"])
+    ap.add_argument("--checkpoint", type=Path, default=CHECKPOINT)
+    ap.add_argument("--onnx", type=Path, default=ONNX_MODEL)
+    ap.add_argument("--int8", type=Path, default=ONNX_INT8)
+    ap.add_argument("--opset", type=int, default=OPSET)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--min-psnr", type=float, default=30.0,
+                    help="check fails below this PSNR (dB) vs. torch")
+    args = ap.parse_args()
+
+    if args.cmd in ("export", "all"):
+        export(args.checkpoint, args.onnx, args.opset)
+    if args.cmd in ("quantize", "all"):
+        quantize(args.onnx, args.int8)
+    if args.cmd in ("check", "all"):
+        ok = True
+        for model in (args.onnx, args.int8):
+            if not model.exists():
+                continue
+            res = compare(model, args.checkpoint, args.batch)
+            passed = res["psnr"] >= args.min_psnr
+            ok &= passed
+            print(f"{model.name:<28} max_abs={res['max_abs']:.2f} psnr={res['psnr']} dB"
+                  f" {'OK' if passed else 'FAIL'}")
+        return 0 if ok else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())